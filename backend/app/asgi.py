@@ -2,6 +2,13 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from app import tracing
+from app.redis import require_redis
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
 
 application = get_asgi_application()
+
+require_redis()
+
+tracing.configure()
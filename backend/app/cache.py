@@ -0,0 +1,476 @@
+"""
+Two-tier cache: an in-process LRU in front of Redis.
+
+`TieredCache.get_or_set(key, loader)` reads the local tier, then Redis, then
+calls `loader`. Keys are namespaced and versioned
+(`<namespace>:v<version>:<key>`), so a code change that alters the cached
+shape only needs a version bump. Every entry has its own TTL. The local copy
+lives for at most CACHE_LOCAL_TTL seconds, which bounds how stale another
+process can be.
+
+Misses are coalesced. Concurrent callers in a process share one load
+(single-flight). Across processes, a short Redis lock lets one caller load
+while the others poll for its result. Entries are also refreshed early
+with probability rising towards expiry ("XFetch", Vattani et al.). One
+caller recomputes a hot key before it expires while the rest keep serving
+the current value, so an expiring key does not stampede the database.
+
+Without REDIS_URL, or while Redis is unreachable, the cache keeps working
+from the local tier alone. Values shared through Redis must be bytes or
+JSON-serializable (see `encode_entry`).
+
+`cached(cache, key=...)` wraps a function or a ninja view, sync or async:
+
+    @cached(directory_cache, key=lambda version, *params: f"{version}:{params}")
+    def directory_page(version, *params): ...
+"""
+
+import asyncio
+import functools
+import inspect
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any
+
+import orjson
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from app.metrics import cache_counters
+from app.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Delete a load lock only if it still holds our token; it may have expired
+# and been taken by another loader in the meantime.
+RELEASE_LOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class LRUCache:
+    """Thread-safe LRU mapping whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float | None = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+@dataclass(frozen=True)
+class Entry:
+    value: Any
+    # Seconds the loader took; longer loads start refreshing earlier.
+    delta: float
+    expires_at: float
+
+    def should_refresh(self, beta: float, now: float | None = None) -> bool:
+        now = time.time() if now is None else now
+        # 1 - random() is in (0, 1], so the log is always defined.
+        return now - self.delta * beta * math.log(1.0 - random.random()) >= self.expires_at
+
+
+def encode_entry(entry: Entry) -> bytes:
+    """Redis form of `entry`: a JSON header line, then the value.
+
+    Bytes values are stored as they are; anything else must be JSON. Nothing
+    read back from Redis is ever unpickled or otherwise executed.
+    """
+    raw = isinstance(entry.value, bytes)
+    header = {"delta": entry.delta, "expires_at": entry.expires_at, "raw": raw}
+    value = entry.value if raw else orjson.dumps(entry.value)
+    return orjson.dumps(header) + b"\n" + value
+
+
+def decode_entry(data: bytes) -> Entry:
+    header, _, value = data.partition(b"\n")
+    header = orjson.loads(header)
+    return Entry(
+        value if header["raw"] else orjson.loads(value),
+        delta=header["delta"],
+        expires_at=header["expires_at"],
+    )
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one (threads)."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def in_flight(self, key) -> bool:
+        return key in self._calls
+
+    def do(self, key, fn):
+        """Run `fn` unless a call for `key` is running; returns (result, shared)."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+class AsyncSingleFlight:
+    """Collapse concurrent awaits for the same key into one (per event loop)."""
+
+    def __init__(self):
+        self._calls = {}
+
+    def in_flight(self, key) -> bool:
+        return (id(asyncio.get_running_loop()), key) in self._calls
+
+    async def do(self, key, fn):
+        flight_key = (id(asyncio.get_running_loop()), key)
+        future = self._calls.get(flight_key)
+        if future is not None:
+            return await asyncio.shield(future), True
+        future = self._calls[flight_key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Retrieved by the followers, if any; keep asyncio from warning.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self._calls.pop(flight_key, None)
+
+
+class TieredCache:
+    """Versioned two-tier cache with coalesced loads and early refresh."""
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl: float,
+        version: int = 1,
+        local_maxsize: int | None = None,
+        local_ttl: float | None = None,
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.version = version
+        self.local_ttl = settings.CACHE_LOCAL_TTL if local_ttl is None else local_ttl
+        self._local = LRUCache(local_maxsize or settings.CACHE_LOCAL_SIZE, self.local_ttl)
+        self._flight = SingleFlight()
+        self._aflight = AsyncSingleFlight()
+        self._hit_counter, self._remote_hit_counter, self._miss_counter = (
+            cache_counters(namespace)
+        )
+        self.hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.early_refreshes = 0
+        self._release_script = None
+
+    def make_key(self, key) -> str:
+        return f"{self.namespace}:v{self.version}:{key}"
+
+    def get_or_set(self, key, loader, ttl: float | None = None):
+        """Return the cached value for `key`, calling `loader()` to fill a miss."""
+        full_key = self.make_key(key)
+        entry = self._local.get(full_key)
+        if entry is not None:
+            self.hits += 1
+            self._hit_counter.inc()
+        else:
+            entry = self._get_remote(full_key)
+            if entry is not None:
+                self.remote_hits += 1
+                self._remote_hit_counter.inc()
+                self._set_local(full_key, entry)
+
+        if entry is not None:
+            if not entry.should_refresh(settings.CACHE_EARLY_REFRESH_BETA):
+                return entry.value
+            if self._flight.in_flight(full_key):
+                return entry.value
+            self.early_refreshes += 1
+        else:
+            self.misses += 1
+            self._miss_counter.inc()
+
+        value, shared = self._flight.do(
+            full_key, lambda: self._load(full_key, loader, ttl or self.ttl, entry)
+        )
+        if shared:
+            self.coalesced += 1
+        return value
+
+    async def aget_or_set(self, key, loader, ttl: float | None = None):
+        """Async variant of `get_or_set`; `loader` returns an awaitable."""
+        full_key = self.make_key(key)
+        entry = self._local.get(full_key)
+        if entry is not None:
+            self.hits += 1
+            self._hit_counter.inc()
+        elif get_redis() is not None:
+            entry = await sync_to_async(self._get_remote, thread_sensitive=False)(
+                full_key
+            )
+            if entry is not None:
+                self.remote_hits += 1
+                self._remote_hit_counter.inc()
+                self._set_local(full_key, entry)
+
+        if entry is not None:
+            if not entry.should_refresh(settings.CACHE_EARLY_REFRESH_BETA):
+                return entry.value
+            if self._aflight.in_flight(full_key):
+                return entry.value
+            self.early_refreshes += 1
+        else:
+            self.misses += 1
+            self._miss_counter.inc()
+
+        value, shared = await self._aflight.do(
+            full_key, lambda: self._aload(full_key, loader, ttl or self.ttl, entry)
+        )
+        if shared:
+            self.coalesced += 1
+        return value
+
+    def delete(self, key):
+        full_key = self.make_key(key)
+        self._local.delete(full_key)
+        client = get_redis()
+        if client is None:
+            return
+        try:
+            client.delete(full_key)
+        except redis.RedisError:
+            logger.warning("Cache delete failed for %s", full_key)
+
+    def clear(self):
+        """Empty the local tier and reset the counters (Redis keys expire on their own)."""
+        self._local.clear()
+        self._local.evictions = 0
+        self.hits = self.remote_hits = self.misses = 0
+        self.coalesced = self.early_refreshes = 0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._local),
+            "hits": self.hits,
+            "remote_hits": self.remote_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "early_refreshes": self.early_refreshes,
+            "evictions": self._local.evictions,
+        }
+
+    def _load(self, full_key, loader, ttl, stale):
+        token = self._acquire_load_lock(full_key)
+        if token is None:
+            entry = self._wait_for_other_loader(full_key, stale)
+            if entry is not None:
+                return entry.value
+        try:
+            started = time.perf_counter()
+            value = loader()
+            entry = Entry(value, time.perf_counter() - started, time.time() + ttl)
+            self._set_local(full_key, entry)
+            self._set_remote(full_key, entry, ttl)
+            return value
+        finally:
+            if token is not None:
+                self._release_load_lock(full_key, token)
+
+    async def _aload(self, full_key, loader, ttl, stale):
+        remote = get_redis() is not None
+        token = None
+        if remote:
+            token = await sync_to_async(
+                self._acquire_load_lock, thread_sensitive=False
+            )(full_key)
+            if token is None:
+                entry = await sync_to_async(
+                    self._wait_for_other_loader, thread_sensitive=False
+                )(full_key, stale)
+                if entry is not None:
+                    return entry.value
+        try:
+            started = time.perf_counter()
+            value = await loader()
+            entry = Entry(value, time.perf_counter() - started, time.time() + ttl)
+            self._set_local(full_key, entry)
+            if remote:
+                await sync_to_async(self._set_remote, thread_sensitive=False)(
+                    full_key, entry, ttl
+                )
+            return value
+        finally:
+            if token is not None:
+                await sync_to_async(self._release_load_lock, thread_sensitive=False)(
+                    full_key, token
+                )
+
+    def _set_local(self, full_key, entry):
+        remaining = entry.expires_at - time.time()
+        if remaining > 0:
+            self._local.set(full_key, entry, min(remaining, self.local_ttl))
+
+    def _get_remote(self, full_key):
+        client = get_redis()
+        if client is None:
+            return None
+        try:
+            raw = client.get(full_key)
+        except redis.RedisError:
+            logger.warning("Cache read failed for %s", full_key)
+            return None
+        if raw is None:
+            return None
+        try:
+            return decode_entry(raw)
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Unreadable cache entry at %s", full_key)
+            return None
+
+    def _set_remote(self, full_key, entry, ttl):
+        client = get_redis()
+        if client is None:
+            return
+        try:
+            client.set(full_key, encode_entry(entry), px=max(1, int(ttl * 1000)))
+        except redis.RedisError:
+            logger.warning("Cache write failed for %s", full_key)
+
+    def _acquire_load_lock(self, full_key) -> str | None:
+        """Take the cross-process lock on loading `full_key`.
+
+        Returns the token to release it with, or None while another process
+        holds it. Without Redis, or if it fails, the caller loads unlocked.
+        """
+        token = uuid.uuid4().hex
+        client = get_redis()
+        if client is None:
+            return token
+        try:
+            lock_ms = int(settings.CACHE_LOAD_LOCK_TIMEOUT * 1000)
+            if client.set(f"{full_key}:lock", token, nx=True, px=lock_ms):
+                return token
+            return None
+        except redis.RedisError:
+            return token
+
+    def _release_load_lock(self, full_key, token):
+        client = get_redis()
+        if client is None:
+            return
+        if self._release_script is None:
+            self._release_script = client.register_script(RELEASE_LOCK_SCRIPT)
+        try:
+            self._release_script(keys=[f"{full_key}:lock"], args=[token], client=client)
+        except redis.RedisError:
+            pass
+
+    def _wait_for_other_loader(self, full_key, stale):
+        """Poll Redis for the entry another process is loading; None on timeout."""
+        if stale is not None:
+            # Refreshing early: the current value is still good to serve.
+            return stale
+        deadline = time.monotonic() + settings.CACHE_LOAD_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.02)
+            entry = self._get_remote(full_key)
+            if entry is not None:
+                self._set_local(full_key, entry)
+                return entry
+        return None
+
+
+def cached(cache: TieredCache, key, ttl: float | None = None):
+    """Cache a function's result in `cache` under `key(*args, **kwargs)`.
+
+    Works on sync and async functions, including ninja views (the wrapped
+    signature is preserved). Return None from `key` to bypass the cache.
+    """
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                cache_key = key(*args, **kwargs)
+                if cache_key is None:
+                    return await func(*args, **kwargs)
+                return await cache.aget_or_set(
+                    cache_key, lambda: func(*args, **kwargs), ttl
+                )
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs)
+            if cache_key is None:
+                return func(*args, **kwargs)
+            return cache.get_or_set(cache_key, lambda: func(*args, **kwargs), ttl)
+
+        return wrapper
+
+    return decorator
@@ -3,6 +3,10 @@ import os
 from celery import Celery
 from django.conf import settings
 
+from app import broker  # noqa: F401  registers the pgbroker:// transport
+from app import tracing
+from app.metrics import instrument_celery
+
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
 
@@ -18,6 +22,11 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 # Load task modules from all registered Django apps.
 app.autodiscover_tasks()
 
+# Task runtime, queue wait and failure metrics (see app/metrics.py).
+instrument_celery(app)
+# Publish/run spans carrying the request's trace (see app/tracing.py).
+tracing.instrument_celery(app)
+
 
 @app.task(bind=True)
 def debug_task(self):
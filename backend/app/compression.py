@@ -0,0 +1,97 @@
+"""
+gzip and brotli compression for JSON responses.
+
+`CompressionMiddleware` compresses JSON bodies of at least
+RESPONSE_COMPRESSION_MIN_BYTES. Smaller bodies fit in a packet or two either
+way, so compressing them costs CPU for nothing. Brotli is used when the
+client accepts it and the `brotli` package is installed, gzip otherwise.
+
+Unlike Django's GZipMiddleware it leaves HTML alone (admin pages carry CSRF
+tokens, which compression exposes to BREACH) and streaming responses (the
+export offers its own `gzip=true`). ETags are left strong: they are derived
+from version stamps rather than body bytes, and /profile writes need a strong
+If-Match whichever coding the client negotiated. `Vary: Accept-Encoding`
+keeps caches from mixing codings.
+"""
+
+import gzip
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def accepted_encodings(header: str) -> set[str]:
+    """Codings an Accept-Encoding header allows, i.e. without `q=0`."""
+    accepted = set()
+    for item in header.lower().split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if coding and weight > 0:
+            accepted.add(coding)
+    return accepted
+
+
+def compress(content: bytes, accept_encoding: str):
+    """`(coding, compressed)` for the best coding the client takes, or None."""
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and ("br" in accepted or "*" in accepted):
+        quality = settings.RESPONSE_COMPRESSION_BROTLI_QUALITY
+        return "br", brotli.compress(content, quality=quality)
+    if "gzip" in accepted or "*" in accepted:
+        level = settings.RESPONSE_COMPRESSION_GZIP_LEVEL
+        return "gzip", gzip.compress(content, compresslevel=level, mtime=0)
+    return None
+
+
+class CompressionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        if (
+            response.streaming
+            or response.has_header("Content-Encoding")
+            or not response.get("Content-Type", "").startswith("application/json")
+            or len(response.content) < settings.RESPONSE_COMPRESSION_MIN_BYTES
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        compressed = compress(
+            response.content, request.META.get("HTTP_ACCEPT_ENCODING", "")
+        )
+        if compressed is None or len(compressed[1]) >= len(response.content):
+            return response
+
+        coding, content = compressed
+        response.content = content
+        response["Content-Length"] = str(len(content))
+        response["Content-Encoding"] = coding
+        return response
@@ -0,0 +1,263 @@
+"""
+Prometheus metrics for the API and the Celery workers.
+
+`MetricsMiddleware` records per-route latency, in-flight requests and the
+queries counted by `app.query_budget`. The auth bearers record auth outcomes
+and the caches record lookups (hit ratio = hits / lookups).
+`instrument_celery` adds task runtime, queue wait and failures, the resident
+memory of each worker process and how much it held when it exited (a prefork
+child is recycled after CELERY_WORKER_MAX_TASKS_PER_CHILD tasks), and the
+depth of each queue the worker consumes, read from the broker at scrape time.
+
+Recording is a handful of counter updates per request. Scrape `/metrics`
+with METRICS_TOKEN as a bearer token. Without a token it is only served when
+METRICS_PUBLIC is on, which it is by default only with DEBUG.
+
+Under gunicorn or Celery prefork, point PROMETHEUS_MULTIPROC_DIR at an empty
+directory shared by the processes (wiped on deploy). Each process then writes
+its samples there and a scrape aggregates them. `gunicorn.conf.py` and the
+worker shutdown hook below clean up after exited processes. A Celery worker
+serves its own metrics on CELERY_METRICS_PORT.
+"""
+
+import hmac
+import os
+import resource
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from app.query_budget import current_stats
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by route",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Requests being served",
+    multiprocess_mode="livesum",
+)
+DB_QUERIES = Counter("db_queries", "Database queries by route", ["method", "route"])
+DB_QUERY_SECONDS = Counter(
+    "db_query_seconds", "Time spent in database queries by route", ["method", "route"]
+)
+AUTH_OUTCOMES = Counter(
+    "auth_outcomes",
+    "Bearer authentication outcomes (success, expired, invalid, stale, role_denied)",
+    ["outcome"],
+)
+CACHE_LOOKUPS = Counter(
+    "cache_lookups",
+    "Cache lookups by cache and tier (hit, remote_hit, miss)",
+    ["cache", "result"],
+)
+TASK_RUNTIME = Histogram("celery_task_runtime_seconds", "Task runtime", ["task"])
+TASK_QUEUE_WAIT = Histogram(
+    "celery_task_queue_wait_seconds",
+    "Time from publish to start",
+    ["task"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, float("inf")),
+)
+TASK_FAILURES = Counter("celery_task_failures", "Failed tasks", ["task"])
+WORKER_RSS = Gauge(
+    "celery_worker_rss_bytes",
+    "Resident memory of each worker process after its latest task",
+    multiprocess_mode="liveall",
+)
+WORKER_EXITS = Counter("celery_worker_process_exits", "Worker processes that exited")
+WORKER_RSS_AT_EXIT = Histogram(
+    "celery_worker_rss_at_exit_bytes",
+    "Resident memory of worker processes when they exited",
+    buckets=tuple(2**n * 1024 * 1024 for n in range(5, 13)) + (float("inf"),),
+)
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def record_auth(outcome: str):
+    AUTH_OUTCOMES.labels(outcome).inc()
+
+
+def cache_counters(cache: str):
+    """Counters for `cache`'s hits, remote hits and misses, bound once."""
+    return (
+        CACHE_LOOKUPS.labels(cache, "hit"),
+        CACHE_LOOKUPS.labels(cache, "remote_hit"),
+        CACHE_LOOKUPS.labels(cache, "miss"),
+    )
+
+
+def rss_bytes() -> int:
+    """This process's resident memory, or its peak where /proc is missing."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+class QueueDepthCollector:
+    """Messages waiting in each of `app`'s queues, read when scraped."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def collect(self):
+        depth = GaugeMetricFamily(
+            "celery_queue_depth", "Messages waiting in the queue", labels=["queue"]
+        )
+        with self.app.connection_for_read() as connection:
+            channel = connection.channel()
+            for name, queue in self.app.amqp.queues.items():
+                try:
+                    waiting = queue.bind(channel).queue_declare(passive=True)
+                except connection.channel_errors:
+                    # AMQP closes the channel on an unknown queue; Redis has
+                    # no key for an empty one. Either way nothing waits.
+                    channel = connection.channel()
+                    waiting = None
+                depth.add_metric([name], waiting.message_count if waiting else 0)
+            channel.close()
+        yield depth
+
+
+def collector_registry():
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        supplied = request.headers.get("Authorization", "").encode()
+        if not hmac.compare_digest(supplied, f"Bearer {token}".encode()):
+            return HttpResponseForbidden()
+    elif not settings.METRICS_PUBLIC:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        generate_latest(collector_registry()), content_type=CONTENT_TYPE_LATEST
+    )
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+        self.observe(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+        self.observe(request, response, time.perf_counter() - started)
+        return response
+
+    def observe(self, request, response, elapsed):
+        match = getattr(request, "resolver_match", None)
+        # Unmatched paths share one label so scanners cannot explode cardinality.
+        route = f"/{match.route}" if match is not None else "unmatched"
+        REQUEST_LATENCY.labels(request.method, route, response.status_code).observe(
+            elapsed
+        )
+        stats = current_stats()
+        if stats is not None and stats.count:
+            DB_QUERIES.labels(request.method, route).inc(stats.count)
+            DB_QUERY_SECONDS.labels(request.method, route).inc(stats.duration)
+
+
+def instrument_celery(app):
+    """Record task, memory and queue metrics for `app`'s workers."""
+    from celery.signals import (
+        before_task_publish,
+        task_failure,
+        task_postrun,
+        task_prerun,
+        worker_init,
+        worker_process_shutdown,
+    )
+
+    started = {}
+
+    @before_task_publish.connect(weak=False)
+    def stamp_published(headers=None, **kwargs):
+        if headers is not None:
+            headers.setdefault("published_at", time.time())
+
+    @task_prerun.connect(weak=False)
+    def start_timer(task_id=None, task=None, **kwargs):
+        started[task_id] = time.perf_counter()
+        # Message headers become request attributes in a worker; eager
+        # `apply(headers=...)` keeps them under `headers`.
+        published_at = getattr(task.request, "published_at", None) or (
+            getattr(task.request, "headers", None) or {}
+        ).get("published_at")
+        if published_at:
+            TASK_QUEUE_WAIT.labels(task.name).observe(
+                max(0.0, time.time() - published_at)
+            )
+
+    @task_postrun.connect(weak=False)
+    def stop_timer(task_id=None, task=None, **kwargs):
+        began = started.pop(task_id, None)
+        if began is not None:
+            TASK_RUNTIME.labels(task.name).observe(time.perf_counter() - began)
+        WORKER_RSS.set(rss_bytes())
+
+    @task_failure.connect(weak=False)
+    def count_failure(sender=None, **kwargs):
+        TASK_FAILURES.labels(sender.name).inc()
+
+    @worker_init.connect(weak=False)
+    def serve_metrics(**kwargs):
+        if settings.CELERY_METRICS_PORT:
+            registry = collector_registry()
+            registry.register(QueueDepthCollector(app))
+            start_http_server(settings.CELERY_METRICS_PORT, registry=registry)
+
+    @worker_process_shutdown.connect(weak=False)
+    def mark_dead(pid=None, **kwargs):
+        # Runs in the exiting child, so this is the memory it is giving back.
+        WORKER_RSS_AT_EXIT.observe(rss_bytes())
+        WORKER_EXITS.inc()
+        if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+            multiprocess.mark_process_dead(pid or os.getpid())
@@ -0,0 +1,49 @@
+"""
+Prebuilt OpenAPI schema for /api/openapi.json.
+
+Ninja walks every route and pydantic model to rebuild the schema on each
+request to its openapi.json view. `manage.py build_openapi` writes the
+rendered schema to OPENAPI_SCHEMA_FILE at image build time instead, and
+`schema_view` (mounted ahead of the API's own URLs) serves those bytes.
+Without the file, as in development and tests, the schema is generated on
+the first request and kept for the life of the process.
+
+Responses carry a strong ETag of the content and a `public` Cache-Control of
+OPENAPI_SCHEMA_MAX_AGE seconds. Once that expires, clients revalidate with
+If-None-Match and get a 304 until a deploy changes the schema.
+"""
+
+import hashlib
+import logging
+from functools import cache
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+
+from app.renderers import dumps
+
+logger = logging.getLogger(__name__)
+
+
+@cache
+def schema_document(api) -> tuple[bytes, str]:
+    """`api`'s rendered schema and its ETag, read or built once per process."""
+    path = Path(settings.OPENAPI_SCHEMA_FILE)
+    try:
+        content = path.read_bytes()
+    except FileNotFoundError:
+        logger.info("No OpenAPI schema at %s; generating it", path)
+        content = dumps(api.get_openapi_schema())
+    return content, f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+
+
+def schema_view(request, api):
+    content, etag = schema_document(api)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content, content_type="application/json")
+    response["ETag"] = etag
+    response["Cache-Control"] = f"public, max-age={settings.OPENAPI_SCHEMA_MAX_AGE}"
+    return response
@@ -0,0 +1,148 @@
+"""
+Per-request query counts and database time, checked against budgets.
+
+Every database connection gets an execute wrapper that adds each query and
+its duration to the `QueryStats` of the request being served. The stats live
+in a context variable, so queries made through the async ORM's worker
+threads count towards the request that issued them.
+
+`QueryBudgetMiddleware` opens the stats for each request and reports them in
+a `Server-Timing` header:
+
+    Server-Timing: db;dur=3.2;desc="4 queries", app;dur=11.8
+
+It also logs a warning when the operation ("GET /api/auth/users", with path
+converters kept as in the URL pattern) goes over its budget in
+QUERY_BUDGETS, or QUERY_BUDGET_DEFAULT for unlisted routes. Queries run
+while a streaming response is consumed are not counted.
+
+Tests enforce budgets with `app.testing.QueryBudgetMixin`.
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    duration: float = 0.0
+
+    @property
+    def duration_ms(self) -> float:
+        return self.duration * 1000
+
+
+_stats = ContextVar("query_stats", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.duration += time.perf_counter() - started
+
+
+def install(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def install_on_connect(sender, connection, **kwargs):
+    install(connection)
+
+
+def current_stats():
+    """The stats being collected for the current request, if any."""
+    return _stats.get()
+
+
+@contextmanager
+def track():
+    """Collect the queries run inside the block (and its async ORM calls)."""
+    # Connections opened before this module was imported have no wrapper yet.
+    for connection in connections.all(initialized_only=True):
+        install(connection)
+    stats = QueryStats()
+    token = _stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _stats.reset(token)
+
+
+def operation_name(request) -> str | None:
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return None
+    return f"{request.method} /{match.route}"
+
+
+def budget_for(operation: str):
+    """Return `(max_queries, max_db_ms)` for `operation`; either may be None."""
+    return settings.QUERY_BUDGETS.get(operation, settings.QUERY_BUDGET_DEFAULT)
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with track() as stats:
+            response = self.get_response(request)
+        return self.process(request, response, stats, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with track() as stats:
+            response = await self.get_response(request)
+        return self.process(request, response, stats, time.perf_counter() - started)
+
+    def process(self, request, response, stats, elapsed):
+        if settings.SERVER_TIMING:
+            response["Server-Timing"] = (
+                f'db;dur={stats.duration_ms:.1f};desc="{stats.count} queries", '
+                f"app;dur={elapsed * 1000:.1f}"
+            )
+        operation = operation_name(request)
+        if operation is None:
+            return response
+        max_queries, max_db_ms = budget_for(operation)
+        if (max_queries is not None and stats.count > max_queries) or (
+            max_db_ms is not None and stats.duration_ms > max_db_ms
+        ):
+            logger.warning(
+                "%s over query budget: %d queries in %.1f ms (budget %s queries, %s ms)",
+                operation,
+                stats.count,
+                stats.duration_ms,
+                max_queries,
+                max_db_ms,
+            )
+        return response
@@ -0,0 +1,69 @@
+from functools import cache
+
+import redis
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from opentelemetry.trace import SpanKind
+from redis.client import Pipeline
+
+from app import tracing
+
+
+class TracedRedis(redis.Redis):
+    """Redis client that records a span per command (and per pipeline)."""
+
+    def execute_command(self, *args, **options):
+        if not tracing.enabled():
+            return super().execute_command(*args, **options)
+        with tracing.tracer.start_as_current_span(
+            f"redis {args[0]}", kind=SpanKind.CLIENT, attributes={"db.system": "redis"}
+        ):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TracedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+class TracedPipeline(Pipeline):
+    def execute(self, raise_on_error=True):
+        if not tracing.enabled():
+            return super().execute(raise_on_error)
+        with tracing.tracer.start_as_current_span(
+            "redis pipeline",
+            kind=SpanKind.CLIENT,
+            attributes={
+                "db.system": "redis",
+                "redis.commands": len(self.command_stack),
+            },
+        ):
+            return super().execute(raise_on_error)
+
+
+@cache
+def get_redis():
+    """Return the shared Redis client, or None when REDIS_URL is not configured.
+
+    redis-py connection pools reset themselves after a fork, so the client can
+    be shared safely across gunicorn and Celery worker processes.
+    """
+    if not settings.REDIS_URL:
+        return None
+    return TracedRedis.from_url(
+        settings.REDIS_URL,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        health_check_interval=30,
+    )
+
+
+def require_redis():
+    """Refuse to serve requests without REDIS_URL.
+
+    Refresh-token rotation, the directory version and rate limits only hold
+    across processes when they share Redis; their in-process fallbacks exist
+    for the test suite and management commands.
+    """
+    if not settings.REDIS_URL:
+        raise ImproperlyConfigured("REDIS_URL must be set to serve requests")
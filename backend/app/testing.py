@@ -0,0 +1,38 @@
+"""Test helpers shared by the apps' test suites."""
+
+from contextlib import contextmanager
+
+from app.query_budget import track
+
+
+class QueryBudgetMixin:
+    """Fail a test when an endpoint runs more queries than it is budgeted.
+
+    Declare budgets per endpoint on the test case and wrap each call:
+
+        query_budgets = {"GET /user/me": 0, "PUT /profile": (3, 50)}
+
+        with self.within_budget("GET /user/me"):
+            self.client.get("/user/me", headers=headers)
+
+    A budget is a maximum query count, or `(max_queries, max_db_ms)` where
+    either may be None.
+    """
+
+    query_budgets = {}
+
+    @contextmanager
+    def within_budget(self, endpoint):
+        budget = self.query_budgets[endpoint]
+        max_queries, max_db_ms = budget if isinstance(budget, tuple) else (budget, None)
+        with track() as stats:
+            yield stats
+        if max_queries is not None and stats.count > max_queries:
+            self.fail(
+                f"{endpoint} ran {stats.count} queries, over its budget of {max_queries}"
+            )
+        if max_db_ms is not None and stats.duration_ms > max_db_ms:
+            self.fail(
+                f"{endpoint} spent {stats.duration_ms:.1f} ms in the database, "
+                f"over its budget of {max_db_ms} ms"
+            )
@@ -0,0 +1,297 @@
+"""
+Request tracing with OpenTelemetry.
+
+With TRACING_EXPORTER set, every request gets a server span named after its
+route ("POST /api/auth/register"). Child spans cover each ORM query, password
+hashing, JWT encoding and decoding, the user signal receivers, Redis commands
+(through `app.redis.get_redis`), and Celery publish and execution. An
+incoming `traceparent` header continues the caller's trace. Publishing a
+task injects the current context into the message headers, so the task's
+spans join the request's trace.
+
+Sampling is decided once per trace at its root (TRACING_SAMPLE_RATIO, e.g.
+0.1 keeps one trace in ten) and followed by every child and task.
+
+Exporters, chosen by TRACING_EXPORTER:
+
+- "none" (default): tracing off; the hooks cost one flag check
+- "file": one JSON span per line appended to TRACING_FILE
+- "console": spans printed to stdout
+- "memory": kept in process, for tests (see `configure`)
+- "otlp": sent to an OpenTelemetry collector; needs
+  `opentelemetry-exporter-otlp-proto-http`
+
+`configure()` runs from app/wsgi.py, app/asgi.py and on Celery worker start.
+"""
+
+import functools
+import threading
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from opentelemetry import context, propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SimpleSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import SpanKind, StatusCode
+
+tracer = trace.get_tracer("app")
+
+_exporter = None
+_configure_lock = threading.Lock()
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """Append finished spans to a file, one JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        with self._lock, open(self.path, "a") as output:
+            output.write(lines)
+        return SpanExportResult.SUCCESS
+
+
+def build_sampler(ratio: float):
+    """Head sampling: keep `ratio` of new traces, follow the parent otherwise."""
+    return ParentBased(TraceIdRatioBased(ratio))
+
+
+def _build_exporter(name):
+    if name == "memory":
+        return InMemorySpanExporter(), SimpleSpanProcessor
+    if name == "file":
+        return JsonLinesSpanExporter(settings.TRACING_FILE), BatchSpanProcessor
+    if name == "console":
+        return ConsoleSpanExporter(), BatchSpanProcessor
+    if name == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+        except ImportError:
+            raise ImproperlyConfigured(
+                "TRACING_EXPORTER=otlp requires opentelemetry-exporter-otlp-proto-http"
+            )
+        return OTLPSpanExporter(), BatchSpanProcessor
+    raise ImproperlyConfigured(f"Unknown TRACING_EXPORTER: {name}")
+
+
+def configure(exporter: str | None = None, sample_ratio: float | None = None):
+    """Install the tracer provider for this process and return its exporter.
+
+    Only the first call has an effect; later calls return the same exporter.
+    Returns None while tracing is off.
+    """
+    global _exporter
+    with _configure_lock:
+        if _exporter is not None:
+            return _exporter
+        name = exporter or settings.TRACING_EXPORTER
+        if name == "none":
+            return None
+        span_exporter, processor = _build_exporter(name)
+        ratio = settings.TRACING_SAMPLE_RATIO if sample_ratio is None else sample_ratio
+        provider = TracerProvider(
+            resource=Resource.create({"service.name": settings.TRACING_SERVICE_NAME}),
+            sampler=build_sampler(ratio),
+        )
+        provider.add_span_processor(processor(span_exporter))
+        trace.set_tracer_provider(provider)
+        for connection in connections.all(initialized_only=True):
+            install(connection)
+        _exporter = span_exporter
+        return span_exporter
+
+
+def enabled() -> bool:
+    return _exporter is not None
+
+
+def traced(name: str):
+    """Run the decorated function (sync or async) inside a span called `name`."""
+
+    def decorator(func):
+        if iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _exporter is None:
+                    return await func(*args, **kwargs)
+                with tracer.start_as_current_span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _exporter is None:
+                return func(*args, **kwargs)
+            with tracer.start_as_current_span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def trace_query(execute, sql, params, many, context):
+    if _exporter is None:
+        return execute(sql, params, many, context)
+    connection = context["connection"]
+    with tracer.start_as_current_span(
+        f"db {sql.split(None, 1)[0].upper()}",
+        kind=SpanKind.CLIENT,
+        attributes={
+            "db.system": connection.vendor,
+            "db.name": str(connection.settings_dict.get("NAME", "")),
+            "db.statement": sql,
+        },
+    ):
+        return execute(sql, params, many, context)
+
+
+def install(connection):
+    if trace_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(trace_query)
+
+
+@receiver(connection_created)
+def install_on_connect(sender, connection, **kwargs):
+    install(connection)
+
+
+class TracingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if _exporter is None:
+            return self.get_response(request)
+        with self.start_span(request) as span:
+            response = self.get_response(request)
+            self.finish(span, request, response)
+        return response
+
+    async def __acall__(self, request):
+        if _exporter is None:
+            return await self.get_response(request)
+        with self.start_span(request) as span:
+            response = await self.get_response(request)
+            self.finish(span, request, response)
+        return response
+
+    def start_span(self, request):
+        return tracer.start_as_current_span(
+            request.method,
+            context=propagate.extract(request.headers),
+            kind=SpanKind.SERVER,
+            attributes={
+                "http.request.method": request.method,
+                "url.path": request.path,
+            },
+        )
+
+    def finish(self, span, request, response):
+        match = getattr(request, "resolver_match", None)
+        if match is not None:
+            span.update_name(f"{request.method} /{match.route}")
+            span.set_attribute("http.route", f"/{match.route}")
+            if match.url_name:
+                span.set_attribute("ninja.operation", match.url_name)
+        span.set_attribute("http.response.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.set_status(StatusCode.ERROR)
+
+
+def instrument_celery(app):
+    """Trace task publishing and execution, continuing the publisher's trace."""
+    from celery.signals import (
+        after_task_publish,
+        before_task_publish,
+        task_failure,
+        task_postrun,
+        task_prerun,
+        worker_init,
+    )
+
+    publishing = {}
+    running = {}
+
+    @before_task_publish.connect(weak=False)
+    def start_publish(sender=None, headers=None, **kwargs):
+        if _exporter is None or headers is None:
+            return
+        span = tracer.start_span(f"celery.publish {sender}", kind=SpanKind.PRODUCER)
+        propagate.inject(headers, context=trace.set_span_in_context(span))
+        publishing[headers.get("id")] = span
+
+    @after_task_publish.connect(weak=False)
+    def end_publish(headers=None, **kwargs):
+        span = publishing.pop((headers or {}).get("id"), None)
+        if span is not None:
+            span.end()
+
+    @task_prerun.connect(weak=False)
+    def start_run(task_id=None, task=None, **kwargs):
+        if _exporter is None:
+            return
+        # Message headers become request attributes in a worker; eager
+        # `apply(headers=...)` keeps them under `headers`.
+        carrier = dict(getattr(task.request, "headers", None) or {})
+        for key in ("traceparent", "tracestate"):
+            value = getattr(task.request, key, None)
+            if value:
+                carrier[key] = value
+        span = tracer.start_span(
+            f"celery.run {task.name}",
+            context=propagate.extract(carrier),
+            kind=SpanKind.CONSUMER,
+            attributes={"celery.task_id": task_id},
+        )
+        token = context.attach(trace.set_span_in_context(span))
+        running[task_id] = (span, token)
+
+    @task_failure.connect(weak=False)
+    def record_failure(task_id=None, exception=None, **kwargs):
+        entry = running.get(task_id)
+        if entry is not None and exception is not None:
+            entry[0].record_exception(exception)
+            entry[0].set_status(StatusCode.ERROR)
+
+    @task_postrun.connect(weak=False)
+    def end_run(task_id=None, **kwargs):
+        entry = running.pop(task_id, None)
+        if entry is not None:
+            span, token = entry
+            context.detach(token)
+            span.end()
+
+    @worker_init.connect(weak=False)
+    def configure_worker(**kwargs):
+        configure()
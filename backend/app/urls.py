@@ -1,13 +1,26 @@
+from functools import partial
+
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 from ninja import NinjaAPI
 
-from users.api import router as auth_router
+from app.metrics import metrics_view
+from app.openapi import schema_view
+from app.renderers import ORJSONRenderer
+
+if settings.AUTH_ASYNC_VIEWS:
+    from users.api_async import router as auth_router
+else:
+    from users.api import router as auth_router
 
-api = NinjaAPI(version="1.0.0")
+api = NinjaAPI(version="1.0.0", renderer=ORJSONRenderer())
 api.add_router("/auth", auth_router)
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    # Ahead of api.urls, whose own view rebuilds the schema on every request.
+    path("api/openapi.json", partial(schema_view, api=api)),
     path("api/", api.urls),
+    path("metrics", metrics_view),
 ]
@@ -2,6 +2,13 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from app import tracing
+from app.redis import require_redis
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
 
 application = get_wsgi_application()
+
+require_redis()
+
+tracing.configure()
@@ -0,0 +1,135 @@
+"""
+Serialization time and bytes on the wire for the user directory.
+
+    python manage.py seed_users 100000
+    python -m benchmarks.api_payload --limit 200 --repeat 50
+
+Renders one directory page in-process both ways, without HTTP or caching:
+
+- `schema`: model instances, a pydantic `UserProfileSchema` per row, then
+  `json.dumps` with ninja's encoder (the previous path)
+- `values`: `values()` rows projected to the requested fields, then orjson
+
+and reports fetch and serialization time separately. It then requests
+`/api/auth/users` through the full middleware stack for each `--fields` set
+and Accept-Encoding, with the directory cache cleared before each request,
+and reports latency and response bytes.
+"""
+
+import argparse
+import json
+import time
+
+from benchmarks.common import manager_token, percentile, setup_django
+
+FIELDSETS = ("", "id,username", "id,username,email,role")
+ENCODINGS = ("identity", "gzip", "br")
+
+
+def timed(func, repeat):
+    """Median milliseconds of `func()` over `repeat` calls, and its last result."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - started)
+    return round(percentile(samples, 50) * 1000, 2), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from ninja.responses import NinjaJSONEncoder
+
+    from app.renderers import dumps
+    from users.api import user_profile_schema
+    from users.cache import directory_cache
+    from users.pagination import directory_queryset
+    from users.projection import items, parse_fields, project
+    from users.schema import UserPageSchema
+
+    limit, repeat = args.limit, args.repeat
+    queryset = directory_queryset()
+
+    def schema_fetch():
+        return list(queryset.select_related("user")[:limit])
+
+    def schema_render(profiles):
+        page = UserPageSchema(
+            items=[user_profile_schema(profile.user, profile) for profile in profiles]
+        )
+        return json.dumps(page.model_dump(), cls=NinjaJSONEncoder).encode()
+
+    fetch_ms, profiles = timed(schema_fetch, repeat)
+    render_ms, body = timed(lambda: schema_render(profiles), repeat)
+    report = {
+        "users": User.objects.count(),
+        "limit": limit,
+        "in_process": [
+            {
+                "path": "schema",
+                "fields": "",
+                "fetch_ms": fetch_ms,
+                "serialize_ms": render_ms,
+                "bytes": len(body),
+            }
+        ],
+        "http": [],
+    }
+
+    for fieldset in FIELDSETS:
+        fields = parse_fields(fieldset)
+        fetch_ms, rows = timed(lambda: list(project(queryset, fields)[:limit]), repeat)
+        render_ms, body = timed(
+            lambda: dumps({"items": items(rows, fields), "next_cursor": None}), repeat
+        )
+        report["in_process"].append(
+            {
+                "path": "values",
+                "fields": fieldset,
+                "fetch_ms": fetch_ms,
+                "serialize_ms": render_ms,
+                "bytes": len(body),
+            }
+        )
+
+    client = Client(HTTP_HOST="localhost")
+    authorization = f"Bearer {manager_token()}"
+    for fieldset in FIELDSETS:
+        for encoding in ENCODINGS:
+
+            def request():
+                directory_cache.clear()
+                return client.get(
+                    "/api/auth/users",
+                    (
+                        {"limit": limit, "fields": fieldset}
+                        if fieldset
+                        else {"limit": limit}
+                    ),
+                    HTTP_AUTHORIZATION=authorization,
+                    HTTP_ACCEPT_ENCODING=encoding,
+                )
+
+            latency_ms, response = timed(request, repeat)
+            report["http"].append(
+                {
+                    "fields": fieldset,
+                    "accept_encoding": encoding,
+                    "content_encoding": response.get("Content-Encoding", "identity"),
+                    "p50_ms": latency_ms,
+                    "bytes": len(response.content),
+                }
+            )
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Compare the sync (WSGI) and async (ASGI) auth routes under concurrent load.
+
+    python manage.py seed_users 10000
+    python -m benchmarks.async_vs_sync --requests 5000 --concurrency 64
+
+Each server gets the same number of worker processes; the ASGI run mounts
+users/api_async.py via AUTH_ASYNC_VIEWS.
+"""
+
+import argparse
+import json
+
+from benchmarks.common import manager_token, setup_django, summarize
+from benchmarks.http import drive, serve
+
+ENDPOINTS = {
+    "me": ("GET", "/api/auth/user/me"),
+    "users": ("GET", "/api/auth/users?limit=50"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="me")
+    args = parser.parse_args()
+
+    setup_django()
+    headers = {"Authorization": f"Bearer {manager_token()}"}
+    method, path = ENDPOINTS[args.endpoint]
+
+    results = {}
+    for kind in ("wsgi", "asgi"):
+        with serve(kind, workers=args.workers) as base_url:
+            # Warm the per-process caches before measuring.
+            drive(base_url, method, path, args.workers * 20, args.workers, headers=headers)
+            latencies, errors, elapsed = drive(
+                base_url, method, path, args.requests, args.concurrency, headers=headers
+            )
+        results[kind] = {**summarize(latencies, elapsed), "errors": errors}
+
+    print(json.dumps({"endpoint": path, "concurrency": args.concurrency, **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
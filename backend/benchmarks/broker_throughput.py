@@ -0,0 +1,45 @@
+"""
+Compare Celery broker throughput: publish rate and worker completion rate.
+
+    python -m benchmarks.broker_throughput --tasks 5000 --concurrency 4 \\
+        --broker redis://localhost:6379/0 --broker pgbroker://
+
+For each broker, publishes `--tasks` no-op tasks to a dedicated queue, then
+starts a worker (`--concurrency` processes, CELERY_WORKER_PREFETCH_MULTIPLIER
+from settings) and times it until every task has completed (see
+`benchmarks.worker`). A no-op task measures the broker's per-message cost
+rather than the work. Run each broker on the same machine and under the same
+load.
+"""
+
+import argparse
+import json
+
+from benchmarks.worker import bench, flood
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--broker", action="append", dest="brokers")
+    parser.add_argument("--tasks", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--pool", default="prefork", choices=["prefork", "threads"])
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    brokers = args.brokers or [bench.conf.broker_url]
+    report = [
+        flood(
+            broker,
+            args.tasks,
+            concurrency=args.concurrency,
+            pool=args.pool,
+            timeout=args.timeout,
+        )
+        for broker in brokers
+    ]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
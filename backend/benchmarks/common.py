@@ -0,0 +1,45 @@
+"""Shared helpers for the benchmark scripts in this package."""
+
+import os
+import statistics
+import sys
+from pathlib import Path
+
+
+def setup_django():
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
+    import django
+
+    django.setup()
+
+
+def manager_token():
+    """Return an access token for a seeded manager (see `manage.py seed_users`)."""
+    from users.api import generate_tokens
+    from users.models import Profile, UserRole
+
+    profile = Profile.objects.filter(role=UserRole.MANAGER).select_related("user").first()
+    if profile is None:
+        raise SystemExit("No manager found; run `manage.py seed_users N` first.")
+    return generate_tokens(profile.user).access_token
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed):
+    """Throughput and latency percentiles (milliseconds) for a run."""
+    return {
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
@@ -0,0 +1,98 @@
+"""
+Measure what pooling and prepared statements save per request on Postgres.
+
+    python manage.py seed_users 1000
+    python -m benchmarks.db_connections --iterations 500
+
+Runs against DATABASE_URL and reports, per iteration:
+
+- connect: open a connection, run the principal lookup, close (what every
+  request paid with CONN_MAX_AGE=0)
+- pooled: borrow a connection from a psycopg pool for the same lookup
+- unprepared / prepared: the lookup on one open connection, without and with
+  server-side prepared statements
+"""
+
+import argparse
+import json
+import time
+
+from benchmarks.common import setup_django, summarize
+
+
+def timed(iterations, run):
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        began = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - began)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    setup_django()
+    import psycopg
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from psycopg_pool import ConnectionPool
+
+    if connection.vendor != "postgresql":
+        raise SystemExit("Point DATABASE_URL at Postgres to run this benchmark.")
+
+    user_id = User.objects.order_by("id").values_list("id", flat=True).first()
+    if user_id is None:
+        raise SystemExit("No users found; run `manage.py seed_users N` first.")
+    # The query the principal cache issues on a miss.
+    sql, params = (
+        User.objects.select_related("profile").filter(id=user_id).query.sql_with_params()
+    )
+
+    conninfo = connection.get_connection_params()
+    conninfo.pop("cursor_factory", None)
+    conninfo.pop("context", None)
+    conninfo.pop("prepare_threshold", None)
+
+    def connect_and_query():
+        with psycopg.connect(**conninfo) as conn:
+            conn.execute(sql, params).fetchall()
+
+    pool = ConnectionPool(kwargs=conninfo, min_size=1, max_size=1, open=True)
+
+    def pooled_query():
+        with pool.connection() as conn:
+            conn.execute(sql, params).fetchall()
+
+    unprepared = psycopg.connect(**conninfo, prepare_threshold=None)
+    prepared = psycopg.connect(**conninfo, prepare_threshold=0)
+
+    report = {
+        "iterations": args.iterations,
+        "connect": timed(args.iterations, connect_and_query),
+        "pooled": timed(args.iterations, pooled_query),
+        "unprepared": timed(
+            args.iterations, lambda: unprepared.execute(sql, params).fetchall()
+        ),
+        "prepared": timed(
+            args.iterations, lambda: prepared.execute(sql, params).fetchall()
+        ),
+    }
+    pool.close()
+    unprepared.close()
+    prepared.close()
+
+    report["connection_setup_saved_ms"] = round(
+        report["connect"]["mean_ms"] - report["pooled"]["mean_ms"], 3
+    )
+    report["prepare_saved_ms"] = round(
+        report["unprepared"]["mean_ms"] - report["prepared"]["mean_ms"], 3
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
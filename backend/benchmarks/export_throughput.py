@@ -0,0 +1,62 @@
+"""
+Measure /api/auth/users/export throughput and peak Python heap.
+
+    python manage.py seed_users 100000
+    python -m benchmarks.export_throughput --format csv --gzip
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+from benchmarks.common import manager_token, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--format", default="ndjson", choices=["ndjson", "csv"])
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Report peak Python heap (tracemalloc roughly halves throughput).",
+    )
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import Client
+
+    from users.models import Profile
+
+    rows = Profile.objects.count()
+    token = manager_token()
+    client = Client(HTTP_HOST="localhost")
+
+    if args.trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    response = client.get(
+        "/api/auth/users/export",
+        {"format": args.format, "gzip": str(args.gzip).lower()},
+        HTTP_AUTHORIZATION=f"Bearer {token}",
+    )
+    size = sum(len(chunk) for chunk in response.streaming_content)
+    elapsed = time.perf_counter() - started
+
+    report = {
+        "format": args.format,
+        "gzip": args.gzip,
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed),
+        "bytes": size,
+    }
+    if args.trace_memory:
+        report["peak_heap_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        tracemalloc.stop()
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Run the app under a real WSGI or ASGI server and drive it over HTTP.
+
+`serve()` starts gunicorn (sync workers for WSGI, uvicorn workers for ASGI)
+against whatever DATABASE_URL and REDIS_URL the caller's environment points
+at (the server refuses to start without Redis), and `drive()` issues requests at a fixed concurrency with httpx, recording
+per-request latency.
+"""
+
+import asyncio
+import itertools
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Every benchmark client shares one address; measure the server, not the limits.
+UNTHROTTLED = {
+    name: "1000000/min"
+    for name in (
+        "THROTTLE_LOGIN_IP",
+        "THROTTLE_LOGIN_USERNAME",
+        "THROTTLE_REGISTER_IP",
+        "THROTTLE_REFRESH_IP",
+        "THROTTLE_PASSWORD_HASHING",
+    )
+}
+
+SERVERS = {
+    "wsgi": ["app.wsgi:application"],
+    "asgi": ["app.asgi:application", "-k", "uvicorn_worker.UvicornWorker"],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def serve(kind: str, workers: int = 3, threads: int = 1, env: dict | None = None):
+    """Start gunicorn for `kind` ("wsgi" or "asgi") and yield its base URL."""
+    port = free_port()
+    server_env = {**os.environ, "DJANGO_DEBUG": "False", **UNTHROTTLED, **(env or {})}
+    if kind == "asgi":
+        server_env.setdefault("AUTH_ASYNC_VIEWS", "True")
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            *SERVERS[kind],
+            "--workers",
+            str(workers),
+            *(["--threads", str(threads)] if kind == "wsgi" and threads > 1 else []),
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--log-level",
+            "warning",
+        ],
+        cwd=BACKEND_DIR,
+        env=server_env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_until_up(base_url, process)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def _wait_until_up(base_url, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Server exited during startup")
+        try:
+            httpx.get(f"{base_url}/api/openapi.json", timeout=1.0)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start in time")
+
+
+async def load(
+    base_url,
+    method,
+    path,
+    requests=None,
+    concurrency=16,
+    duration=None,
+    **request_kwargs,
+):
+    """Issue `requests` calls (or keep going for `duration` seconds) at `concurrency`.
+
+    Returns `(latencies, statuses, elapsed)`.
+    """
+    latencies = []
+    statuses = Counter()
+    remaining = iter(range(requests)) if requests else itertools.count()
+    limits = httpx.Limits(max_connections=concurrency)
+    started = time.perf_counter()
+    deadline = started + duration if duration else None
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+
+        async def worker():
+            for _ in remaining:
+                sent = time.perf_counter()
+                if deadline and sent > deadline:
+                    return
+                response = await client.request(method, path, **request_kwargs)
+                latencies.append(time.perf_counter() - sent)
+                statuses[response.status_code] += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return latencies, statuses, time.perf_counter() - started
+
+
+def drive(base_url, method, path, requests=1000, concurrency=16, **request_kwargs):
+    """Synchronous wrapper around `load`; returns (latencies, errors, elapsed)."""
+    latencies, statuses, elapsed = asyncio.run(
+        load(base_url, method, path, requests, concurrency, **request_kwargs)
+    )
+    errors = sum(count for status, count in statuses.items() if status >= 400)
+    return latencies, errors, elapsed
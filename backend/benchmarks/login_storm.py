@@ -0,0 +1,83 @@
+"""
+Login storm: login throughput and /user/me latency while logins saturate the server.
+
+    python manage.py seed_users 1000
+    python -m benchmarks.login_storm --duration 20
+
+Runs the same storm twice against threaded gunicorn workers: once hashing
+inline on the request threads (PASSWORD_HASHING_WORKERS=0) and once on the
+bounded hashing pool.
+"""
+
+import argparse
+import asyncio
+import json
+
+from benchmarks.common import manager_token, setup_django, summarize
+from benchmarks.http import load, serve
+
+
+async def storm(base_url, args, headers):
+    credentials = {"username": "seed_0", "password": "seedpass123"}
+    logins, me = await asyncio.gather(
+        load(
+            base_url,
+            "POST",
+            "/api/auth/login",
+            concurrency=args.login_concurrency,
+            duration=args.duration,
+            json=credentials,
+        ),
+        load(
+            base_url,
+            "GET",
+            "/api/auth/user/me",
+            concurrency=args.probe_concurrency,
+            duration=args.duration,
+            headers=headers,
+        ),
+    )
+    return logins, me
+
+
+def report(run):
+    latencies, statuses, elapsed = run
+    return {
+        **summarize(latencies, elapsed),
+        "ok_per_second": statuses[200] / elapsed,
+        "statuses": dict(statuses),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--login-concurrency", type=int, default=32)
+    parser.add_argument("--probe-concurrency", type=int, default=4)
+    parser.add_argument("--pool-workers", type=int, default=2)
+    parser.add_argument("--pool-queue", type=int, default=2)
+    args = parser.parse_args()
+
+    setup_django()
+    headers = {"Authorization": f"Bearer {manager_token()}"}
+
+    configs = {
+        "inline": {"PASSWORD_HASHING_WORKERS": "0"},
+        "pool": {
+            "PASSWORD_HASHING_WORKERS": str(args.pool_workers),
+            "PASSWORD_HASHING_QUEUE": str(args.pool_queue),
+        },
+    }
+    results = {}
+    for name, env in configs.items():
+        with serve("wsgi", workers=args.workers, threads=args.threads, env=env) as url:
+            logins, me = asyncio.run(storm(url, args, headers))
+        results[name] = {"login": report(logins), "user_me": report(me)}
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Measure bulk user import throughput (users.tasks.import_users) in-process.
+
+    python -m benchmarks.user_import --rows 10000 --passwords hashed
+"""
+
+import argparse
+import json
+import time
+
+from benchmarks.common import setup_django
+
+
+def build_payload(rows, passwords, prefix):
+    from django.contrib.auth.hashers import make_password
+
+    shared_hash = make_password("importpass123")
+    lines = []
+    for i in range(rows):
+        row = {"username": f"{prefix}{i}", "email": f"{prefix}{i}@example.com"}
+        if passwords == "plain":
+            row["password"] = f"importpass{i}"
+        elif passwords == "hashed":
+            row["password_hash"] = shared_hash
+        lines.append(json.dumps(row))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument(
+        "--passwords", default="hashed", choices=["plain", "hashed", "none"]
+    )
+    parser.add_argument("--prefix", default="imported")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth.models import User
+
+    from users.imports import run_import
+    from users.models import UserImport
+
+    User.objects.filter(username__startswith=args.prefix).delete()
+    payload = build_payload(args.rows, args.passwords, args.prefix)
+    job = UserImport.objects.create(format="ndjson", payload=payload, total=args.rows)
+
+    started = time.perf_counter()
+    run_import(job.id)
+    elapsed = time.perf_counter() - started
+
+    job.refresh_from_db()
+    print(
+        json.dumps(
+            {
+                "passwords": args.passwords,
+                "rows": args.rows,
+                "created": job.created,
+                "conflicts": job.conflict_count,
+                "seconds": round(elapsed, 3),
+                "users_per_minute": round(job.created / elapsed * 60),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Measure /api/auth/users/search latency against a fixed target.
+
+    python manage.py seed_users 1000000
+    python -m benchmarks.user_search --repeat 50 --target-ms 100
+
+Runs each search term `--repeat` times through the full Django stack and
+reports p50/p95/p99 and the result count per term. Terms cover an exact
+username, a selective number, a term matching every seeded user (the
+candidate cap applies), bio words, a typo and a miss. Exits with status 1
+when any term's p95 exceeds `--target-ms`.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from benchmarks.common import manager_token, setup_django, summarize
+
+TERMS = {
+    "exact": "seed_123456",
+    "selective": "654321",
+    "broad": "seed",
+    "bio": "number 42",
+    "typo": "sede_123456",
+    "miss": "nobody-by-that-name",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--target-ms", type=float, default=100)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth.models import User
+    from django.test import Client
+
+    from users.search import has_trigram
+
+    token = manager_token()
+    client = Client(HTTP_HOST="localhost")
+    report = {"users": User.objects.count(), "trigram": has_trigram(), "terms": {}}
+
+    failed = False
+    for name, term in TERMS.items():
+        latencies, status, results = [], None, 0
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            response = client.get(
+                "/api/auth/users/search",
+                {"q": term},
+                HTTP_AUTHORIZATION=f"Bearer {token}",
+            )
+            latencies.append(time.perf_counter() - started)
+            status = response.status_code
+            if status == 200:
+                results = len(response.json()["items"])
+        summary = summarize(latencies, sum(latencies))
+        report["terms"][name] = {
+            "q": term,
+            "status": status,
+            "results": results,
+            **{key: round(summary[key], 1) for key in ("p50_ms", "p95_ms", "p99_ms")},
+        }
+        failed |= summary["p95_ms"] > args.target_ms or status != 200
+
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
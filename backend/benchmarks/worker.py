@@ -0,0 +1,162 @@
+"""
+Synthetic Celery tasks and a runner that floods a worker with them.
+
+`flood()` publishes N tasks to a dedicated queue, starts a worker
+subprocess with the given pool, concurrency and prefetch multiplier, and
+times the worker from its first completed task to its last. Each task
+appends a byte to a file, so completions are counted the same way for every
+pool and broker. The worker runs in its own process, so the broker must be
+one both processes can reach (Redis or pgbroker). Kombu's in-memory
+transport only works inside one process.
+
+Task kinds:
+
+- noop: measures the broker and worker overhead per message
+- io: sleeps 10 ms, standing in for a network call
+- cpu: spins for 10 ms, standing in for hashing or encoding
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from celery import Celery
+
+from benchmarks.common import setup_django
+
+setup_django()
+
+import app.broker  # noqa: E402,F401  registers pgbroker://
+
+QUEUE = "worker-benchmark"
+
+bench = Celery("worker_benchmark")
+bench.config_from_object("django.conf:settings", namespace="CELERY")
+bench.conf.task_always_eager = False
+
+
+_done = None
+
+
+def completed():
+    global _done
+    if _done is None:
+        _done = os.open(
+            os.environ["BENCHMARK_DONE_FILE"], os.O_WRONLY | os.O_APPEND | os.O_CREAT
+        )
+    os.write(_done, b".")
+
+
+@bench.task(name="benchmarks.noop", ignore_result=True)
+def noop():
+    completed()
+
+
+@bench.task(name="benchmarks.sleep", ignore_result=True)
+def sleep(ms):
+    time.sleep(ms / 1000)
+    completed()
+
+
+@bench.task(name="benchmarks.spin", ignore_result=True)
+def spin(ms):
+    deadline = time.perf_counter() + ms / 1000
+    while time.perf_counter() < deadline:
+        pass
+    completed()
+
+
+TASKS = {"noop": (noop, ()), "io": (sleep, (10,)), "cpu": (spin, (10,))}
+
+
+def queue_size(connection):
+    return connection.default_channel.queue_declare(QUEUE, durable=True).message_count
+
+
+def flood(
+    broker,
+    tasks,
+    concurrency=4,
+    pool="prefork",
+    prefetch_multiplier=None,
+    kind="noop",
+    timeout=300,
+):
+    """
+    Publish `tasks` tasks of `kind`, then time a worker completing them.
+
+    A worker still busy after `timeout` seconds is stopped, and the report
+    covers the tasks it completed, with `timed_out` set.
+    """
+    prefetch_multiplier = prefetch_multiplier or bench.conf.worker_prefetch_multiplier
+    task, args = TASKS[kind]
+    with bench.connection_for_write(broker) as connection:
+        queue_size(connection)
+        connection.default_channel.queue_purge(QUEUE)
+
+        started = time.perf_counter()
+        producer = connection.Producer()
+        for _ in range(tasks):
+            task.apply_async(args, queue=QUEUE, producer=producer)
+        published = time.perf_counter() - started
+
+        done = tempfile.NamedTemporaryFile(prefix="celery-benchmark-")
+        worker = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "celery",
+                "-A",
+                "benchmarks.worker:bench",
+                "--broker",
+                broker,
+                "worker",
+                "--queues",
+                QUEUE,
+                "--concurrency",
+                str(concurrency),
+                "--pool",
+                pool,
+                "--prefetch-multiplier",
+                str(prefetch_multiplier),
+                "--without-gossip",
+                "--without-mingle",
+                "--without-heartbeat",
+                "--loglevel",
+                "WARNING",
+            ],
+            env={**os.environ, "BENCHMARK_DONE_FILE": done.name},
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            deadline = time.monotonic() + timeout
+            # Start the clock at the first completed task, not at worker boot.
+            while os.path.getsize(done.name) == 0:
+                if time.monotonic() > deadline:
+                    raise SystemExit(f"{broker}: the worker completed nothing")
+                time.sleep(0.005)
+            began = time.perf_counter()
+            while (finished := os.path.getsize(done.name)) < tasks:
+                if time.monotonic() > deadline:
+                    break
+                time.sleep(0.005)
+            drained = time.perf_counter() - began
+        finally:
+            worker.terminate()
+            worker.wait()
+            done.close()
+
+    return {
+        "broker": broker.split("://", 1)[0],
+        "pool": pool,
+        "concurrency": concurrency,
+        "prefetch_multiplier": prefetch_multiplier,
+        "task": kind,
+        "tasks": tasks,
+        "publish_per_second": round(tasks / published, 1),
+        "completed": finished,
+        "completed_per_second": round((finished - 1) / drained, 1) if drained else None,
+        "timed_out": finished < tasks,
+    }
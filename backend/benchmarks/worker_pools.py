@@ -0,0 +1,71 @@
+"""
+Celery worker throughput across pool types and prefetch multipliers.
+
+    redis-server --port 6380 &
+    python -m benchmarks.worker_pools --broker redis://localhost:6380/0 \\
+        --tasks 2000 --pools prefork,threads,gevent --prefetch 1,4,16 --task io
+
+Floods a worker with `--tasks` synthetic tasks for every pool and prefetch
+multiplier combination (see `benchmarks.worker`) and prints completed
+tasks/second for each as JSON. `--task noop` measures per-message overhead;
+`io` and `cpu` show which pool suits which kind of work. The gevent pool
+needs `gevent` installed and is reported as skipped otherwise.
+"""
+
+import argparse
+import importlib.util
+import json
+
+from benchmarks.worker import TASKS, bench, flood
+
+POOLS = ("prefork", "threads", "gevent")
+
+
+def available(pool):
+    return pool != "gevent" or importlib.util.find_spec("gevent") is not None
+
+
+def csv(cast):
+    return lambda value: [cast(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--broker", default=None)
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--pools", type=csv(str), default=["prefork", "threads"])
+    parser.add_argument("--prefetch", type=csv(int), default=[1, 4, 16])
+    parser.add_argument("--task", default="noop", choices=sorted(TASKS))
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    broker = args.broker or bench.conf.broker_url
+    if broker.startswith("memory://"):
+        parser.error("the worker runs in a subprocess; use Redis or pgbroker")
+    unknown = set(args.pools) - set(POOLS)
+    if unknown:
+        parser.error(f"unknown pools: {', '.join(sorted(unknown))}")
+
+    report = []
+    for pool in args.pools:
+        if not available(pool):
+            report.append({"pool": pool, "skipped": f"{pool} is not installed"})
+            continue
+        for prefetch in args.prefetch:
+            report.append(
+                flood(
+                    broker,
+                    args.tasks,
+                    concurrency=args.concurrency,
+                    pool=pool,
+                    prefetch_multiplier=prefetch,
+                    kind=args.task,
+                    timeout=args.timeout,
+                )
+            )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
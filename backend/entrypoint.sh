@@ -0,0 +1,12 @@
+#!/bin/sh
+# Container entrypoint: start with an empty Prometheus multiprocess directory
+# (see app/metrics.py). Files left by the processes of a previous run would
+# otherwise be summed into every scrape.
+set -e
+
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+    find "$PROMETHEUS_MULTIPROC_DIR" -mindepth 1 -delete
+fi
+
+exec "$@"
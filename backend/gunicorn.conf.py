@@ -0,0 +1,11 @@
+"""Gunicorn settings picked up from the working directory."""
+
+import os
+
+
+def child_exit(server, worker):
+    # Drop the exited worker's live gauges from the Prometheus aggregate.
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,8 +1,50 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
+from django.db.models import Q
+from django.urls import reverse
+
+from app.paginator import EstimatedCountPaginator
 
 from .models import Profile
+from .search import matching_ids
+
+
+class LargeTableMixin:
+    """
+    Changelist settings that hold up with millions of rows.
+
+    Page counts come from the planner above ADMIN_ESTIMATED_COUNT_THRESHOLD,
+    the "N total" link (a second COUNT over the whole table) is dropped, and
+    columns sort only where an index provides the order.
+
+    Related rows shown in the list are prefetched for the page rather than
+    joined: Postgres would run a select_related join for every row that the
+    page's OFFSET skips.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_select_related = ()
+    list_prefetch_related = ()
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return queryset.prefetch_related(*self.list_prefetch_related)
+
+
+class SearchEngineMixin:
+    """Route the changelist search box through users.search."""
+
+    # Lookup from the admin's model to the Profile ids that matched.
+    search_profile_lookup = "id__in"
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        matches = matching_ids(search_term)
+        return queryset.filter(**{self.search_profile_lookup: matches}), False
 
 
 class ProfileInline(admin.StackedInline):
@@ -13,8 +55,13 @@ class ProfileInline(admin.StackedInline):
     readonly_fields = ("created_at", "updated_at")
 
 
-class CustomUserAdmin(UserAdmin):
+class CustomUserAdmin(LargeTableMixin, SearchEngineMixin, UserAdmin):
+    search_profile_lookup = "profile__id__in"
     inlines = (ProfileInline,)
+    # The role columns read each row's profile.
+    list_prefetch_related = ("profile",)
+    # Ordered by the unique index on username (UserAdmin's default).
+    sortable_by = ("username",)
     list_display = (
         "username",
         "email",
@@ -24,6 +71,8 @@ class CustomUserAdmin(UserAdmin):
         "get_role",
         "get_is_manager",
     )
+    # profile__role joins through users_profile's unique user_id and the
+    # (role, created_at, id) index.
     list_filter = UserAdmin.list_filter + ("profile__role",)
 
     def get_role(self, obj):
@@ -39,11 +88,32 @@ class CustomUserAdmin(UserAdmin):
     get_is_manager.boolean = True
     get_is_manager.short_description = "Is Manager"
 
+    def get_search_results(self, request, queryset, search_term):
+        if request.path != reverse("admin:autocomplete"):
+            return super().get_search_results(request, queryset, search_term)
+        # ProfileAdmin's user picker is mostly for users without a profile,
+        # which users.search never finds; match their own columns by prefix
+        # (the UPPER(col) text_pattern_ops indexes from migration 0003).
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        matches = Q(username__istartswith=search_term) | Q(
+            email__istartswith=search_term
+        )
+        return queryset.filter(matches), False
+
 
 @admin.register(Profile)
-class ProfileAdmin(admin.ModelAdmin):
+class ProfileAdmin(LargeTableMixin, SearchEngineMixin, admin.ModelAdmin):
     list_display = ("user", "role", "mobile", "is_manager", "created_at", "updated_at")
+    list_prefetch_related = ("user",)
     list_filter = ("role", "created_at")
+    # The directory's keyset order, read straight off profile_created_id_idx
+    # (or profile_role_created_id_idx under the role filter).
+    ordering = ("-created_at", "-id")
+    sortable_by = ()
+    autocomplete_fields = ("user",)
+    # Keeps the search box; matching itself goes through users.search.
     search_fields = ("user__username", "user__email", "mobile")
     readonly_fields = ("created_at", "updated_at")
 
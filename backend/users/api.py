@@ -5,9 +5,20 @@ This module provides comprehensive user authentication, profile management,
 and role-based access control using JWT tokens.
 
 ## Authentication Classes:
-- AuthBearer: Basic JWT authentication for any authenticated user
+- AuthBearer: Basic JWT authentication for any authenticated user. The caller
+  is resolved through the principal cache (users/cache.py), so `request.auth`
+  is a read-only `Principal` rather than a `User` instance.
 - ManagerAuthBearer: JWT authentication that only allows users with Manager role
 - DefaultUserAuthBearer: JWT authentication that only allows users with DefaultUser role
+- SessionAuthBearer: returns the token's `TokenClaims` without loading the user;
+  /logout uses it to find the session (refresh token family) to revoke
+
+The role bearers authorize from the token's `role` claim alone and return its
+`TokenClaims`. Tokens minted before the user's last role change carry an older
+`epoch` claim and are rejected (see users/tokens.py).
+
+Refresh tokens are single use. /refresh rotates them through the Redis
+registry in users/tokens.py, and replaying a used one revokes the session.
 
 ## Role-Based Access Control:
 Users have roles defined in UserRole enum (Manager, DefaultUser).
@@ -22,50 +33,89 @@ Example usage:
     def user_endpoint(request: HttpRequest):
         return {"message": "Default user access granted"}
 
+## Conditional Requests:
+/profile, /user/me and /users send a strong ETag, Last-Modified and
+`Cache-Control: private, no-cache`, and answer If-None-Match or
+If-Modified-Since with 304. The validators come from the cached `Principal`
+or from `directory_version`, so a 304 costs no queries. Without Redis the
+directory has no shared version, and /users is served without validators.
+PUT /profile checks If-Match against the rows it loads and returns 412 when
+they have changed.
+
 ## Utility Functions:
+These accept a `Principal`, `TokenClaims` or `User`; only the last needs a query.
 - check_user_role(user, role): Check if user has specific role (returns bool)
 - require_manager_role(user): Require manager role or raise HttpError
 - require_role(user, role): Require specific role or raise HttpError
 """
 
 import uuid
+import hashlib
+import logging
 from datetime import datetime, timedelta
 
 import jwt
 from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from django.http import HttpRequest
-from ninja import Router
+from django.db import IntegrityError, transaction
+from django.http import HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from ninja import File, Router
 from ninja.errors import HttpError
+from ninja.files import UploadedFile
 from ninja.security import HttpBearer
 
-from .models import Profile, UserRole
+from app.cache import cached
+from app.renderers import dumps
+from app.tracing import traced
+
+from . import outbox
+from .cache import Principal, directory_cache, directory_version, principal_cache
+from .export import EXPORT_FORMATS, export_stream
+from .hashing import HashingPoolSaturated, hash_password
+from .imports import IMPORT_FORMATS, count_rows
+from .models import Profile, UserImport, UserRole
+from .pagination import directory_queryset, keyset_page
+from .projection import items, parse_fields, project
 from .schema import (
     LoginSchema,
     MessageSchema,
+    PrincipalCacheStatsSchema,
     RefreshSchema,
     RegisterSchema,
     TokenSchema,
     UpdateProfileSchema,
+    UserImportSchema,
+    UserPageSchema,
     UserProfileSchema,
+    UserSearchSchema,
 )
+from .search import SearchTimeout, search_profiles
+from .tasks import import_users
+from .throttling import CombinedThrottle, IPThrottle, RouteThrottle, UsernameThrottle
+from .tokens import (
+    REFRESH_TOKEN_TTL,
+    RefreshTokenStore,
+    authorize,
+    authz_epochs,
+    decode_access_token,
+    refresh_tokens,
+)
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
 
 class AuthBearer(HttpBearer):
-    """Base authentication class that validates JWT tokens and returns the user."""
+    """Base authentication class that validates JWT tokens and returns the principal."""
 
     def authenticate(self, request, token):
-        try:
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-            user_id = payload.get("user_id")
-            if user_id:
-                user = User.objects.get(id=user_id)
-                return user
-        except (jwt.ExpiredSignatureError, jwt.DecodeError, User.DoesNotExist):
-            pass
+        claims = authorize(decode_access_token(token))
+        if claims:
+            return principal_cache.get(claims.id)
         return None
 
 
@@ -73,46 +123,56 @@ class ManagerAuthBearer(HttpBearer):
     """Authentication class that only allows users with Manager role access."""
 
     def authenticate(self, request, token):
-        try:
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-            user_id = payload.get("user_id")
-            if user_id:
-                user = User.objects.get(id=user_id)
-                if user.profile.is_manager:
-                    return user
-        except (jwt.ExpiredSignatureError, jwt.DecodeError, User.DoesNotExist):
-            pass
-        return None
+        return authorize(decode_access_token(token), manager=True)
 
 
 class DefaultUserAuthBearer(HttpBearer):
     """Authentication class that only allows users with DefaultUser role access."""
 
     def authenticate(self, request, token):
-        try:
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-            user_id = payload.get("user_id")
-            if user_id:
-                user = User.objects.get(id=user_id)
-                if not user.profile.is_manager:
-                    return user
-        except (jwt.ExpiredSignatureError, jwt.DecodeError, User.DoesNotExist):
-            pass
-        return None
+        return authorize(decode_access_token(token), manager=False)
+
+
+class SessionAuthBearer(HttpBearer):
+    """Authentication class that returns the verified `TokenClaims` of any user."""
+
+    def authenticate(self, request, token):
+        return authorize(decode_access_token(token))
 
 
 # Authentication instances
 auth_bearer = AuthBearer()
 manager_auth = ManagerAuthBearer()
 default_user_auth = DefaultUserAuthBearer()
+session_auth = SessionAuthBearer()
+
+# Rate limits (rates in NINJA_DEFAULT_THROTTLE_RATES, see users/throttling.py).
+# Combined, so requests rejected per client never count towards the global cap.
+password_hashing_throttle = RouteThrottle("password_hashing")
+login_throttles = CombinedThrottle(
+    IPThrottle("login_ip"),
+    UsernameThrottle("login_username"),
+    password_hashing_throttle,
+)
+register_throttles = CombinedThrottle(
+    IPThrottle("register_ip"), password_hashing_throttle
+)
+refresh_throttles = [IPThrottle("refresh_ip")]
+
+
+def _role_of(user) -> str:
+    # Token claims and principals carry the role; a User instance needs its profile.
+    role = getattr(user, "role", None)
+    if role is None:
+        role = user.profile.role
+    return role
 
 
 def check_user_role(user, required_role: UserRole) -> bool:
     """Check if user has the required role."""
     if not user:
         return False
-    profile, _ = Profile.objects.get_or_create(user=user)
-    return profile.role == required_role
+    return _role_of(user) == required_role
 
 
 def require_manager_role(user) -> bool:
@@ -120,8 +180,7 @@ def require_manager_role(user) -> bool:
     if not user:
         raise HttpError(401, "Authentication required")
 
-    profile, _ = Profile.objects.get_or_create(user=user)
-    if not profile.is_manager:
+    if _role_of(user) != UserRole.MANAGER:
         raise HttpError(403, "Manager role required")
     return True
 
@@ -131,16 +190,32 @@ def require_role(user, required_role: UserRole) -> bool:
     if not user:
         raise HttpError(401, "Authentication required")
 
-    profile, _ = Profile.objects.get_or_create(user=user)
-    if profile.role != required_role:
+    if _role_of(user) != required_role:
         raise HttpError(403, f"{required_role.label} role required")
     return True
 
 
-def generate_tokens(user):
+def user_profile_schema(user, profile):
+    return UserProfileSchema(
+        id=user.id,
+        username=user.username,
+        email=user.email,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        bio=profile.bio,
+        mobile=profile.mobile,
+        role=profile.role,
+    )
+
+
+@traced("jwt.encode")
+def encode_tokens(user, role: str, epoch: int, session: str, jti: str):
     access_payload = {
         "user_id": user.id,
         "username": user.username,
+        "role": role,
+        "epoch": epoch,
+        "sid": session,
         "exp": datetime.utcnow() + timedelta(hours=1),
         "iat": datetime.utcnow(),
     }
@@ -148,9 +223,10 @@ def generate_tokens(user):
     refresh_payload = {
         "user_id": user.id,
         "type": "refresh",
-        "exp": datetime.utcnow() + timedelta(days=7),
+        "sid": session,
+        "exp": datetime.utcnow() + timedelta(seconds=REFRESH_TOKEN_TTL),
         "iat": datetime.utcnow(),
-        "jti": str(uuid.uuid4()),
+        "jti": jti,
     }
 
     access_token = jwt.encode(access_payload, settings.SECRET_KEY, algorithm="HS256")
@@ -159,68 +235,241 @@ def generate_tokens(user):
     return TokenSchema(access_token=access_token, refresh_token=refresh_token)
 
 
-@router.post("/login", response=TokenSchema)
-def login_user(request: HttpRequest, data: LoginSchema):
-    user = authenticate(username=data.username, password=data.password)
-    if not user:
-        raise HttpError(401, "Invalid credentials")
+def generate_tokens(user):
+    """Start a new session (refresh token family) for `user`."""
+    principal = principal_cache.get(user.id)
+    session, jti = uuid.uuid4().hex, str(uuid.uuid4())
+    refresh_tokens.issue(user.id, session, jti)
+    return encode_tokens(user, principal.role, authz_epochs.get(user.id), session, jti)
 
-    return generate_tokens(user)
 
+@traced("jwt.decode")
+def refresh_payload(token: str):
+    """Verify a refresh JWT's signature and shape; the registry decides the rest."""
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+    except (jwt.ExpiredSignatureError, jwt.DecodeError):
+        raise HttpError(401, "Invalid refresh token")
+    if payload.get("type") != "refresh":
+        raise HttpError(401, "Invalid token type")
+    # Tokens minted before rotation existed carry no session and must log in again.
+    if not (payload.get("user_id") and payload.get("sid") and payload.get("jti")):
+        raise HttpError(401, "Invalid refresh token")
+    return payload
 
-@router.post("/register", response=TokenSchema)
-def register_user(request: HttpRequest, data: RegisterSchema):
-    if User.objects.filter(username=data.username).exists():
-        raise HttpError(400, "Username already exists")
 
-    if User.objects.filter(email=data.email).exists():
-        raise HttpError(400, "Email already exists")
+def reject_refresh(status, payload):
+    if status == RefreshTokenStore.REUSED:
+        logger.warning(
+            "Refresh token reuse for user %s; revoked session %s",
+            payload["user_id"],
+            payload["sid"],
+        )
+    if status is None:
+        raise HttpError(503, "Token service unavailable")
+    raise HttpError(401, "Invalid refresh token")
+
 
-    user = User.objects.create_user(
-        username=data.username, email=data.email, password=data.password
+def set_validators(response: HttpResponse, etag: str, last_modified: float):
+    response["ETag"] = etag
+    if last_modified:
+        response["Last-Modified"] = http_date(last_modified)
+    # Authenticated data: browsers may keep it, but must revalidate each time.
+    response["Cache-Control"] = "private, no-cache"
+
+
+def conditional_response(request: HttpRequest, etag: str, last_modified: float):
+    """Return the 304 or 412 the request's preconditions call for, or None."""
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified) or None
     )
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
 
-    Profile.objects.get_or_create(user=user)
 
-    return generate_tokens(user)
+def directory_etag(version: float | None, *params) -> str | None:
+    """Strong ETag for one directory listing: the version stamp plus its query.
 
+    None without a shared version, which also keeps the page out of the cache.
+    """
+    if version is None:
+        return None
+    encoded = repr((version, *params)).encode()
+    return f'"{hashlib.blake2b(encoded, digest_size=16).hexdigest()}"'
+
+
+@cached(directory_cache, key=directory_etag)
+def directory_page(
+    version: float | None, cursor, limit, role, username_prefix, email_prefix, fields
+) -> bytes:
+    """One directory listing as JSON, cached under its ETag (any write retires it)."""
+    queryset = directory_queryset(role, username_prefix, email_prefix)
+    rows, next_cursor = keyset_page(project(queryset, fields), cursor, limit)
+    return dumps({"items": items(rows, fields), "next_cursor": next_cursor})
+
+
+def user_search(q: str, limit: int, role: str | None, fields: str | None) -> bytes:
+    """Ranked matches for `q` as JSON; shared by the sync and async routers."""
+    q = q.strip()
+    if len(q) < settings.USER_SEARCH_MIN_LENGTH:
+        raise HttpError(
+            400,
+            f"Search term must be at least {settings.USER_SEARCH_MIN_LENGTH} "
+            "characters",
+        )
+    limit = max(1, min(limit, settings.USER_SEARCH_MAX_SIZE))
+    fields = parse_fields(fields)
+    try:
+        rows = search_profiles(q, limit, role, fields)
+    except SearchTimeout:
+        raise HttpError(503, "Search took too long, try a more specific term")
+    return dumps({"items": items(rows, fields)})
 
-@router.get("/profile", response=UserProfileSchema, auth=auth_bearer)
-def get_profile(request: HttpRequest):
-    user = request.auth
 
-    profile, created = Profile.objects.get_or_create(user=user)
+def busy_response(exc: HashingPoolSaturated):
+    """503 telling the client when to retry; used when the hashing pool is full."""
+    response = JsonResponse(
+        {"detail": "Server is busy, please retry shortly"}, status=503
+    )
+    response["Retry-After"] = str(exc.retry_after)
+    return response
 
-    return UserProfileSchema(
-        id=user.id,
-        username=user.username,
-        email=user.email,
-        first_name=user.first_name,
-        last_name=user.last_name,
-        bio=profile.bio,
-        mobile=profile.mobile,
-        role=profile.role,
+
+def start_user_import(created_by_id, file: UploadedFile, format: str = None):
+    """Store an uploaded CSV/NDJSON file as a `UserImport` and queue it."""
+    if format is None:
+        format = file.name.rsplit(".", 1)[-1].lower() if file.name else ""
+        format = {"jsonl": "ndjson"}.get(format, format)
+    if format not in IMPORT_FORMATS:
+        raise HttpError(400, f"Unsupported import format: {format}")
+    if file.size > settings.USER_IMPORT_MAX_UPLOAD_SIZE:
+        raise HttpError(413, "Import file too large")
+
+    try:
+        payload = file.read().decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HttpError(400, "Import file must be UTF-8 encoded")
+
+    job = UserImport.objects.create(
+        created_by_id=created_by_id,
+        format=format,
+        payload=payload,
+        total=count_rows(payload, format),
     )
+    transaction.on_commit(lambda: import_users.delay(job.id))
+    return job
 
 
-@router.put("/profile", response=UserProfileSchema, auth=auth_bearer)
-def update_profile(request: HttpRequest, data: UpdateProfileSchema):
-    user = request.auth
+def email_taken(email: str):
+    """Users holding `email` in any case, looked up by its unique index."""
+    # The index skips blank emails; the exclude lets Postgres use it.
+    return User.objects.filter(email__iexact=email).exclude(email="")
+
+
+# auth_user's unique indexes by the column they cover, and the 400 for each.
+UNIQUE_CONFLICTS = (
+    ("email", "Email already exists"),
+    ("username", "Username already exists"),
+)
+
+
+def unique_conflict(exc: IntegrityError) -> HttpError:
+    """The 400 for a unique violation on auth_user; anything else is re-raised."""
+    # psycopg names the violated constraint; SQLite only says it in the message.
+    diag = getattr(exc.__cause__, "diag", None)
+    constraint = getattr(diag, "constraint_name", None) or str(exc)
+    for column, message in UNIQUE_CONFLICTS:
+        if column in constraint:
+            return HttpError(400, message)
+    raise exc
+
+
+@transaction.atomic
+def create_account(username: str, email: str, password: str) -> User:
+    """Create a user and profile and record `user.registered` in the outbox."""
+    # The post_save receiver `create_user_profile` inserts the profile.
+    user = User.objects.create(
+        username=User.normalize_username(username),
+        email=User.objects.normalize_email(email),
+        password=password,
+    )
+    outbox.publish(
+        outbox.USER_REGISTERED,
+        {"user_id": user.id, "username": user.username, "email": user.email},
+        key=str(user.id),
+    )
+    return user
 
-    if data.email:
-        if User.objects.filter(email=data.email).exclude(id=user.id).exists():
+
+def save_profile_changes(user: User, profile: Profile, changed: list[str]):
+    """Save the edited user and profile and record `profile.updated` if any changed.
+
+    Runs in the caller's transaction (see `apply_profile_update`).
+    """
+    if changed:
+        user.save(update_fields=changed)
+
+    dirty = profile.dirty_fields
+    if dirty is None:
+        dirty = Profile.TRACKED_FIELDS
+    fields = changed + [name for name in dirty if name != "user_id"]
+
+    # Profile.save() writes only the fields that changed, if any. User-only
+    # edits still touch updated_at so Last-Modified moves with them.
+    if changed and not profile._state.adding and not profile.dirty_fields:
+        profile.save(update_fields=["updated_at"])
+    else:
+        profile.save()
+
+    if fields:
+        outbox.publish(outbox.PROFILE_UPDATED, {"user_id": user.id, "fields": fields})
+
+
+@transaction.atomic
+def apply_profile_update(request: HttpRequest, data: UpdateProfileSchema):
+    """Apply a PUT /profile to the caller's rows, or return why it may not.
+
+    The rows are locked before If-Match / If-Unmodified-Since are checked,
+    so concurrent PUTs carrying the same validator run one after the other
+    and the second gets a 412. Returns that response, or the saved user and
+    profile.
+    """
+    # The principal is a read-only snapshot; writes go through the real rows.
+    # Both rows are locked, so a PUT that waited re-reads them once released.
+    try:
+        profile = (
+            Profile.objects.select_for_update()
+            .select_related("user")
+            .get(user_id=request.auth.id)
+        )
+        user = profile.user
+    except Profile.DoesNotExist:
+        user = User.objects.select_for_update().get(id=request.auth.id)
+        profile = Profile(user=user)
+
+    current = Principal.from_user(user, profile)
+    precondition_failed = conditional_response(
+        request, current.etag, current.updated_at
+    )
+    if precondition_failed:
+        return precondition_failed
+
+    changed = []
+
+    if data.email and data.email != user.email:
+        if email_taken(data.email).exclude(id=user.id).exists():
             raise HttpError(400, "Email already exists")
         user.email = data.email
+        changed.append("email")
 
-    if data.first_name:
+    if data.first_name and data.first_name != user.first_name:
         user.first_name = data.first_name
+        changed.append("first_name")
 
-    if data.last_name:
+    if data.last_name and data.last_name != user.last_name:
         user.last_name = data.last_name
-
-    user.save()
-
-    profile, _ = Profile.objects.get_or_create(user=user)
+        changed.append("last_name")
 
     if data.bio:
         profile.bio = data.bio
@@ -231,69 +480,168 @@ def update_profile(request: HttpRequest, data: UpdateProfileSchema):
     if data.role:
         profile.role = data.role
 
-    profile.save()
+    save_profile_changes(user, profile, changed)
+    return user, profile
 
-    return UserProfileSchema(
-        id=user.id,
-        username=user.username,
-        email=user.email,
-        first_name=user.first_name,
-        last_name=user.last_name,
-        bio=profile.bio,
-        mobile=profile.mobile,
-        role=profile.role,
-    )
 
+@router.post("/login", response=TokenSchema, throttle=login_throttles)
+def login_user(request: HttpRequest, data: LoginSchema):
+    try:
+        user = authenticate(username=data.username, password=data.password)
+    except HashingPoolSaturated as exc:
+        return busy_response(exc)
+    if not user:
+        raise HttpError(401, "Invalid credentials")
 
-@router.post("/refresh", response=TokenSchema)
-def refresh_token(request: HttpRequest, data: RefreshSchema):
+    return generate_tokens(user)
+
+
+@router.post("/register", response=TokenSchema, throttle=register_throttles)
+def register_user(request: HttpRequest, data: RegisterSchema):
     try:
-        payload = jwt.decode(
-            data.refresh_token, settings.SECRET_KEY, algorithms=["HS256"]
-        )
-        if payload.get("type") != "refresh":
-            raise HttpError(401, "Invalid token type")
+        password = hash_password(data.password)
+    except HashingPoolSaturated as exc:
+        return busy_response(exc)
+
+    # The case-insensitive unique indexes on username and email decide
+    # conflicts, so concurrent registrations cannot both get through.
+    try:
+        user = create_account(data.username, data.email, password)
+    except IntegrityError as exc:
+        raise unique_conflict(exc) from exc
+    return generate_tokens(user)
+
+
+@router.get("/profile", response=UserProfileSchema, auth=auth_bearer)
+def get_profile(request: HttpRequest, response: HttpResponse):
+    principal = request.auth
+    not_modified = conditional_response(request, principal.etag, principal.updated_at)
+    if not_modified:
+        return not_modified
+    set_validators(response, principal.etag, principal.updated_at)
+    return principal
+
+
+@router.put("/profile", response=UserProfileSchema, auth=auth_bearer)
+def update_profile(
+    request: HttpRequest, data: UpdateProfileSchema, response: HttpResponse
+):
+    try:
+        result = apply_profile_update(request, data)
+    except IntegrityError as exc:
+        # Another account took the email after the check.
+        raise unique_conflict(exc) from exc
+    if isinstance(result, HttpResponse):
+        return result
+    user, profile = result
+
+    updated = Principal.from_user(user, profile)
+    set_validators(response, updated.etag, updated.updated_at)
+    return user_profile_schema(user, profile)
+
+
+@router.post("/refresh", response=TokenSchema, throttle=refresh_throttles)
+def refresh_token(request: HttpRequest, data: RefreshSchema):
+    payload = refresh_payload(data.refresh_token)
+    session, jti = payload["sid"], str(uuid.uuid4())
+
+    status = refresh_tokens.rotate(session, payload["jti"], jti)
+    if status != RefreshTokenStore.ROTATED:
+        reject_refresh(status, payload)
 
-        user_id = payload.get("user_id")
-        user = User.objects.get(id=user_id)
-        return generate_tokens(user)
-    except (jwt.ExpiredSignatureError, jwt.DecodeError, User.DoesNotExist):
+    principal = principal_cache.get(payload["user_id"])
+    if principal is None:
+        refresh_tokens.revoke_family(session)
         raise HttpError(401, "Invalid refresh token")
+    epoch = authz_epochs.get(principal.id)
+    return encode_tokens(principal, principal.role, epoch, session, jti)
 
 
-@router.post("/logout", response=MessageSchema, auth=auth_bearer)
+@router.post("/logout", response=MessageSchema, auth=session_auth)
 def logout_user(request: HttpRequest):
+    if request.auth.session:
+        refresh_tokens.revoke_family(request.auth.session)
     return MessageSchema(message="Successfully logged out")
 
 
-@router.get("/users", response=list[UserProfileSchema], auth=manager_auth)
-def list_all_users(request: HttpRequest):
-    users = User.objects.select_related("profile").all()
-    return [
-        UserProfileSchema(
-            id=user.id,
-            username=user.username,
-            email=user.email,
-            first_name=user.first_name,
-            last_name=user.last_name,
-            bio=user.profile.bio,
-            mobile=user.profile.mobile,
-            role=user.profile.role,
-        )
-        for user in users
-    ]
+@router.get("/users", response=UserPageSchema, auth=manager_auth)
+def list_all_users(
+    request: HttpRequest,
+    response: HttpResponse,
+    cursor: str = None,
+    limit: int = settings.USERS_PAGE_DEFAULT_SIZE,
+    role: str = None,
+    username_prefix: str = None,
+    email_prefix: str = None,
+    fields: str = None,
+):
+    limit = max(1, min(limit, settings.USERS_PAGE_MAX_SIZE))
+    fields = parse_fields(fields)
+    params = (cursor, limit, role, username_prefix, email_prefix, fields)
+    version = directory_version.get()
+    etag = directory_etag(version, *params)
+    if etag is not None:
+        not_modified = conditional_response(request, etag, version)
+        if not_modified:
+            return not_modified
+        set_validators(response, etag, version)
+
+    # Rows are rendered straight to JSON; items may hold only `fields`.
+    response.content = directory_page(version, *params)
+    return response
+
+
+@router.get("/users/search", response=UserSearchSchema, auth=manager_auth)
+def search_users(
+    request: HttpRequest,
+    response: HttpResponse,
+    q: str,
+    limit: int = settings.USER_SEARCH_DEFAULT_SIZE,
+    role: str = None,
+    fields: str = None,
+):
+    response.content = user_search(q, limit, role, fields)
+    return response
+
+
+@router.get("/users/export", auth=manager_auth)
+def export_users(request: HttpRequest, format: str = "ndjson", gzip: bool = False):
+    if format not in EXPORT_FORMATS:
+        raise HttpError(400, f"Unsupported export format: {format}")
+
+    filename = f"users.{format}"
+    content_type = EXPORT_FORMATS[format]
+    if gzip:
+        filename += ".gz"
+        content_type = "application/gzip"
+
+    response = StreamingHttpResponse(
+        export_stream(format, gzip=gzip), content_type=content_type
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+@router.post("/users/import", response={202: UserImportSchema}, auth=manager_auth)
+def import_users_upload(
+    request: HttpRequest, file: UploadedFile = File(...), format: str = None
+):
+    return 202, start_user_import(request.auth.id, file, format)
+
+
+@router.get("/users/import/{import_id}", response=UserImportSchema, auth=manager_auth)
+def get_user_import(request: HttpRequest, import_id: int):
+    try:
+        return UserImport.objects.get(id=import_id)
+    except UserImport.DoesNotExist:
+        raise HttpError(404, "Import not found")
 
 
 @router.get("/user/me", response=UserProfileSchema, auth=auth_bearer)
-def get_current_user_info(request: HttpRequest):
-    user = request.auth
-    return UserProfileSchema(
-        id=user.id,
-        username=user.username,
-        email=user.email,
-        first_name=user.first_name,
-        last_name=user.last_name,
-        bio=user.profile.bio,
-        mobile=user.profile.mobile,
-        role=user.profile.role,
-    )
+def get_current_user_info(request: HttpRequest, response: HttpResponse):
+    return get_profile(request, response)
+
+
+@router.get("/cache/stats", response=PrincipalCacheStatsSchema, auth=manager_auth)
+def get_principal_cache_stats(request: HttpRequest):
+    return principal_cache.stats()
@@ -0,0 +1,299 @@
+"""
+Async variants of the authentication API.
+
+Same routes, schemas and responses as `users/api.py`, written against
+Django's async ORM (`aget`, `aexists`, async iteration) so a single ASGI
+worker can keep many requests in flight while they wait on Postgres.
+`app/urls.py` mounts this router instead of the sync one when
+AUTH_ASYNC_VIEWS is enabled; serve it with an ASGI worker, e.g.
+
+    gunicorn app.asgi:application -k uvicorn_worker.UvicornWorker
+
+## Authentication Classes:
+- AsyncAuthBearer: async counterpart of AuthBearer (returns a `Principal`)
+- AsyncManagerAuthBearer: async counterpart of ManagerAuthBearer
+- AsyncDefaultUserAuthBearer: async counterpart of DefaultUserAuthBearer
+- AsyncSessionAuthBearer: async counterpart of SessionAuthBearer
+"""
+
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import aauthenticate
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from ninja import File, Router
+from ninja.errors import HttpError
+from ninja.files import UploadedFile
+from ninja.security import HttpBearer
+
+from app.cache import cached
+from app.renderers import dumps
+
+from .api import (
+    apply_profile_update,
+    busy_response,
+    conditional_response,
+    create_account,
+    directory_etag,
+    encode_tokens,
+    login_throttles,
+    refresh_payload,
+    refresh_throttles,
+    register_throttles,
+    reject_refresh,
+    set_validators,
+    start_user_import,
+    unique_conflict,
+    user_profile_schema,
+    user_search,
+)
+from .cache import Principal, directory_cache, directory_version, principal_cache
+from .export import EXPORT_FORMATS, aexport_stream
+from .hashing import HashingPoolSaturated, ahash_password
+from .models import UserImport
+from .pagination import akeyset_page, directory_queryset
+from .projection import items, parse_fields, project
+from .schema import (
+    LoginSchema,
+    MessageSchema,
+    PrincipalCacheStatsSchema,
+    RefreshSchema,
+    RegisterSchema,
+    TokenSchema,
+    UpdateProfileSchema,
+    UserImportSchema,
+    UserPageSchema,
+    UserProfileSchema,
+    UserSearchSchema,
+)
+from .tokens import (
+    RefreshTokenStore,
+    adecode_access_token,
+    authorize,
+    authz_epochs,
+    refresh_tokens,
+)
+
+router = Router()
+
+
+class AsyncAuthBearer(HttpBearer):
+    """Async authentication class that validates JWT tokens and returns the principal."""
+
+    async def authenticate(self, request, token):
+        claims = authorize(await adecode_access_token(token))
+        if claims:
+            return await principal_cache.aget(claims.id)
+        return None
+
+
+class AsyncManagerAuthBearer(HttpBearer):
+    """Async authentication class that only allows users with Manager role access."""
+
+    async def authenticate(self, request, token):
+        return authorize(await adecode_access_token(token), manager=True)
+
+
+class AsyncDefaultUserAuthBearer(HttpBearer):
+    """Async authentication class that only allows users with DefaultUser role access."""
+
+    async def authenticate(self, request, token):
+        return authorize(await adecode_access_token(token), manager=False)
+
+
+class AsyncSessionAuthBearer(HttpBearer):
+    """Async authentication class that returns the verified `TokenClaims` of any user."""
+
+    async def authenticate(self, request, token):
+        return authorize(await adecode_access_token(token))
+
+
+# Authentication instances
+auth_bearer = AsyncAuthBearer()
+manager_auth = AsyncManagerAuthBearer()
+default_user_auth = AsyncDefaultUserAuthBearer()
+session_auth = AsyncSessionAuthBearer()
+
+
+@cached(directory_cache, key=directory_etag)
+async def adirectory_page(
+    version: float | None, cursor, limit, role, username_prefix, email_prefix, fields
+) -> bytes:
+    """Async counterpart of `api.directory_page`, sharing its cache."""
+    queryset = directory_queryset(role, username_prefix, email_prefix)
+    rows, next_cursor = await akeyset_page(project(queryset, fields), cursor, limit)
+    return dumps({"items": items(rows, fields), "next_cursor": next_cursor})
+
+
+async def agenerate_tokens(user):
+    principal = await principal_cache.aget(user.id)
+    session, jti = uuid.uuid4().hex, str(uuid.uuid4())
+    await refresh_tokens.aissue(user.id, session, jti)
+    epoch = await authz_epochs.aget(user.id)
+    return encode_tokens(user, principal.role, epoch, session, jti)
+
+
+@router.post("/login", response=TokenSchema, throttle=login_throttles)
+async def login_user(request: HttpRequest, data: LoginSchema):
+    try:
+        user = await aauthenticate(username=data.username, password=data.password)
+    except HashingPoolSaturated as exc:
+        return busy_response(exc)
+    if not user:
+        raise HttpError(401, "Invalid credentials")
+
+    return await agenerate_tokens(user)
+
+
+@router.post("/register", response=TokenSchema, throttle=register_throttles)
+async def register_user(request: HttpRequest, data: RegisterSchema):
+    try:
+        password = await ahash_password(data.password)
+    except HashingPoolSaturated as exc:
+        return busy_response(exc)
+
+    try:
+        user = await sync_to_async(create_account)(
+            data.username, data.email, password
+        )
+    except IntegrityError as exc:
+        raise unique_conflict(exc) from exc
+    return await agenerate_tokens(user)
+
+
+@router.get("/profile", response=UserProfileSchema, auth=auth_bearer)
+async def get_profile(request: HttpRequest, response: HttpResponse):
+    principal = request.auth
+    not_modified = conditional_response(request, principal.etag, principal.updated_at)
+    if not_modified:
+        return not_modified
+    set_validators(response, principal.etag, principal.updated_at)
+    return principal
+
+
+@router.put("/profile", response=UserProfileSchema, auth=auth_bearer)
+async def update_profile(
+    request: HttpRequest, data: UpdateProfileSchema, response: HttpResponse
+):
+    # Transactions and row locks are sync-only; see apply_profile_update.
+    try:
+        result = await sync_to_async(apply_profile_update)(request, data)
+    except IntegrityError as exc:
+        raise unique_conflict(exc) from exc
+    if isinstance(result, HttpResponse):
+        return result
+    user, profile = result
+
+    updated = Principal.from_user(user, profile)
+    set_validators(response, updated.etag, updated.updated_at)
+    return user_profile_schema(user, profile)
+
+
+@router.post("/refresh", response=TokenSchema, throttle=refresh_throttles)
+async def refresh_token(request: HttpRequest, data: RefreshSchema):
+    payload = refresh_payload(data.refresh_token)
+    session, jti = payload["sid"], str(uuid.uuid4())
+
+    status = await refresh_tokens.arotate(session, payload["jti"], jti)
+    if status != RefreshTokenStore.ROTATED:
+        reject_refresh(status, payload)
+
+    principal = await principal_cache.aget(payload["user_id"])
+    if principal is None:
+        await refresh_tokens.arevoke_family(session)
+        raise HttpError(401, "Invalid refresh token")
+    epoch = await authz_epochs.aget(principal.id)
+    return encode_tokens(principal, principal.role, epoch, session, jti)
+
+
+@router.post("/logout", response=MessageSchema, auth=session_auth)
+async def logout_user(request: HttpRequest):
+    if request.auth.session:
+        await refresh_tokens.arevoke_family(request.auth.session)
+    return MessageSchema(message="Successfully logged out")
+
+
+@router.get("/users", response=UserPageSchema, auth=manager_auth)
+async def list_all_users(
+    request: HttpRequest,
+    response: HttpResponse,
+    cursor: str = None,
+    limit: int = settings.USERS_PAGE_DEFAULT_SIZE,
+    role: str = None,
+    username_prefix: str = None,
+    email_prefix: str = None,
+    fields: str = None,
+):
+    limit = max(1, min(limit, settings.USERS_PAGE_MAX_SIZE))
+    fields = parse_fields(fields)
+    params = (cursor, limit, role, username_prefix, email_prefix, fields)
+    version = await directory_version.aget()
+    etag = directory_etag(version, *params)
+    if etag is not None:
+        not_modified = conditional_response(request, etag, version)
+        if not_modified:
+            return not_modified
+        set_validators(response, etag, version)
+
+    response.content = await adirectory_page(version, *params)
+    return response
+
+
+@router.get("/users/search", response=UserSearchSchema, auth=manager_auth)
+async def search_users(
+    request: HttpRequest,
+    response: HttpResponse,
+    q: str,
+    limit: int = settings.USER_SEARCH_DEFAULT_SIZE,
+    role: str = None,
+    fields: str = None,
+):
+    response.content = await sync_to_async(user_search)(q, limit, role, fields)
+    return response
+
+
+@router.get("/users/export", auth=manager_auth)
+async def export_users(request: HttpRequest, format: str = "ndjson", gzip: bool = False):
+    if format not in EXPORT_FORMATS:
+        raise HttpError(400, f"Unsupported export format: {format}")
+
+    filename = f"users.{format}"
+    content_type = EXPORT_FORMATS[format]
+    if gzip:
+        filename += ".gz"
+        content_type = "application/gzip"
+
+    response = StreamingHttpResponse(
+        aexport_stream(format, gzip=gzip), content_type=content_type
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+@router.post("/users/import", response={202: UserImportSchema}, auth=manager_auth)
+async def import_users_upload(
+    request: HttpRequest, file: UploadedFile = File(...), format: str = None
+):
+    create = sync_to_async(transaction.atomic(start_user_import))
+    return 202, await create(request.auth.id, file, format)
+
+
+@router.get("/users/import/{import_id}", response=UserImportSchema, auth=manager_auth)
+async def get_user_import(request: HttpRequest, import_id: int):
+    try:
+        return await UserImport.objects.aget(id=import_id)
+    except UserImport.DoesNotExist:
+        raise HttpError(404, "Import not found")
+
+
+@router.get("/user/me", response=UserProfileSchema, auth=auth_bearer)
+async def get_current_user_info(request: HttpRequest, response: HttpResponse):
+    return await get_profile(request, response)
+
+
+@router.get("/cache/stats", response=PrincipalCacheStatsSchema, auth=manager_auth)
+async def get_principal_cache_stats(request: HttpRequest):
+    return principal_cache.stats()
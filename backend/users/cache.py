@@ -0,0 +1,337 @@
+"""
+Authenticated principal cache.
+
+Resolving the caller of every authenticated request used to cost a User query
+plus a lazy Profile query. The principal cache keeps the fields the endpoints
+read in two tiers:
+
+- an in-process LRU with a TTL (no I/O on a hit)
+- a shared Redis tier keyed by user id (one round trip on a local miss)
+
+Writes to User or Profile invalidate both tiers through the receivers in
+`users/models.py`. The invalidation is published over Redis pub/sub so every
+gunicorn worker on every node drops its local copy as well.
+
+Without REDIS_URL the cache runs with the local tier only, and staleness in
+other processes is bounded by PRINCIPAL_CACHE_TTL.
+
+Each principal carries a strong ETag and its profile's `updated_at`, and
+`directory_version` stamps the user directory as a whole. Conditional
+requests are therefore answered without touching the database. The directory
+stamp lives only in Redis; without it listings carry no validators.
+
+Directory pages themselves go through `directory_cache` (app/cache.py), keyed
+by the version stamp, so a write makes every cached page unreachable.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from functools import cached_property
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from app.cache import LRUCache, TieredCache
+from app.metrics import cache_counters
+from app.redis import get_redis
+
+from .models import Profile, UserRole
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated caller, as read by the auth endpoints."""
+
+    id: int
+    username: str
+    email: str
+    first_name: str
+    last_name: str
+    bio: str
+    mobile: str
+    role: str
+    updated_at: float = 0.0
+
+    @property
+    def is_manager(self):
+        return self.role == UserRole.MANAGER
+
+    @cached_property
+    def etag(self):
+        """Strong validator over every field served by /profile and /user/me."""
+        encoded = json.dumps(asdict(self), sort_keys=True).encode()
+        return f'"{hashlib.blake2b(encoded, digest_size=16).hexdigest()}"'
+
+    @classmethod
+    def from_user(cls, user, profile):
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            bio=profile.bio,
+            mobile=profile.mobile,
+            role=profile.role,
+            updated_at=profile.updated_at.timestamp() if profile.updated_at else 0.0,
+        )
+
+
+class PrincipalCache:
+    """Two-tier cache of `Principal` objects keyed by user id."""
+
+    key_prefix = "users:principal:"
+    channel = "users:principal:invalidate"
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.ttl = ttl
+        self._local = LRUCache(maxsize, ttl)
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+        self._hit_counter, self._remote_hit_counter, self._miss_counter = (
+            cache_counters("principal")
+        )
+        self.hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id: int):
+        """Return the principal for `user_id`, or None if the user does not exist."""
+        principal = self._local.get(user_id)
+        if principal is not None:
+            self.hits += 1
+            self._hit_counter.inc()
+            return principal
+
+        principal = self._get_remote(user_id)
+        if principal is not None:
+            self.remote_hits += 1
+            self._remote_hit_counter.inc()
+        else:
+            self.misses += 1
+            self._miss_counter.inc()
+            principal = self._load(user_id)
+            if principal is None:
+                return None
+            self._set_remote(principal)
+
+        self._local.set(user_id, principal)
+        return principal
+
+    async def aget(self, user_id: int):
+        """Async variant of `get`, loading misses through the async ORM."""
+        principal = self._local.get(user_id)
+        if principal is not None:
+            self.hits += 1
+            self._hit_counter.inc()
+            return principal
+
+        if get_redis() is not None:
+            principal = await sync_to_async(self._get_remote, thread_sensitive=False)(
+                user_id
+            )
+        if principal is not None:
+            self.remote_hits += 1
+            self._remote_hit_counter.inc()
+        else:
+            self.misses += 1
+            self._miss_counter.inc()
+            principal = await self._aload(user_id)
+            if principal is None:
+                return None
+            if get_redis() is not None:
+                await sync_to_async(self._set_remote, thread_sensitive=False)(
+                    principal
+                )
+
+        self._local.set(user_id, principal)
+        return principal
+
+    def invalidate(self, user_id: int):
+        """Drop `user_id` from every tier and tell the other workers to do the same."""
+        self.invalidations += 1
+        self._local.delete(user_id)
+        client = self._redis()
+        if client is None:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            pipe.delete(self._key(user_id))
+            pipe.publish(self.channel, user_id)
+            pipe.execute()
+        except redis.RedisError:
+            logger.warning("Principal cache invalidation failed for user %s", user_id)
+
+    def clear(self):
+        """Empty the local tier and reset the counters."""
+        self._local.clear()
+        self._local.evictions = 0
+        self.hits = self.remote_hits = self.misses = self.invalidations = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.remote_hits + self.misses
+        return {
+            "size": len(self._local),
+            "hits": self.hits,
+            "remote_hits": self.remote_hits,
+            "misses": self.misses,
+            "evictions": self._local.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": (self.hits + self.remote_hits) / lookups if lookups else 0.0,
+        }
+
+    def _key(self, user_id):
+        return f"{self.key_prefix}{user_id}"
+
+    def _load(self, user_id):
+        try:
+            user = User.objects.select_related("profile").get(id=user_id)
+        except User.DoesNotExist:
+            return None
+        try:
+            profile = user.profile
+        except Profile.DoesNotExist:
+            profile, _ = Profile.objects.get_or_create(user=user)
+        return Principal.from_user(user, profile)
+
+    async def _aload(self, user_id):
+        try:
+            user = await User.objects.select_related("profile").aget(id=user_id)
+        except User.DoesNotExist:
+            return None
+        try:
+            profile = user.profile
+        except Profile.DoesNotExist:
+            profile, _ = await Profile.objects.aget_or_create(user=user)
+        return Principal.from_user(user, profile)
+
+    def _redis(self):
+        client = get_redis()
+        if client is not None:
+            self._ensure_listener()
+        return client
+
+    def _get_remote(self, user_id):
+        client = self._redis()
+        if client is None:
+            return None
+        try:
+            raw = client.get(self._key(user_id))
+        except redis.RedisError:
+            return None
+        if raw is None:
+            return None
+        return Principal(**json.loads(raw))
+
+    def _set_remote(self, principal):
+        client = self._redis()
+        if client is None:
+            return
+        try:
+            client.set(self._key(principal.id), json.dumps(asdict(principal)), ex=self.ttl)
+        except redis.RedisError:
+            pass
+
+    def _ensure_listener(self):
+        # One subscriber thread per process; gunicorn forks after import, so
+        # the pid check restarts the listener in each worker.
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._listener_lock:
+            if self._listener_pid == pid:
+                return
+            self._listener_pid = pid
+            thread = threading.Thread(
+                target=self._listen,
+                name="principal-cache-invalidation",
+                daemon=True,
+            )
+            thread.start()
+
+    def _listen(self):
+        # A dedicated connection without the short socket timeout used for
+        # request-path calls, since the subscriber mostly sits idle.
+        client = redis.Redis.from_url(settings.REDIS_URL, health_check_interval=30)
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Anything published while we were disconnected is lost.
+                self._local.clear()
+                while True:
+                    message = pubsub.get_message(timeout=5.0)
+                    if message is not None:
+                        self._local.delete(int(message["data"]))
+            except redis.RedisError:
+                logger.warning("Principal cache subscriber disconnected, retrying")
+                time.sleep(1.0)
+
+
+class DirectoryVersion:
+    """Last-change timestamp of the user directory, shared through Redis.
+
+    Bumped whenever a User or Profile is written, so a listing's validators
+    can be checked without running its query. Without Redis, or while it is
+    unreachable, there is no version that every process agrees on: `get`
+    returns None and listings are served uncached, without validators.
+    """
+
+    key = "users:directory:version"
+
+    def get(self) -> float | None:
+        client = self._redis()
+        if client is None:
+            return None
+        try:
+            value = client.get(self.key)
+        except redis.RedisError:
+            logger.warning("Directory version lookup failed")
+            return None
+        if value is None:
+            # Nothing written since Redis was (re)started; start a version now.
+            return self.bump()
+        return float(value)
+
+    async def aget(self) -> float | None:
+        if self._redis() is None:
+            return None
+        return await sync_to_async(self.get, thread_sensitive=False)()
+
+    def bump(self) -> float | None:
+        client = self._redis()
+        if client is None:
+            return None
+        now = time.time()
+        try:
+            client.set(self.key, now)
+        except redis.RedisError:
+            logger.warning("Directory version bump failed")
+            return None
+        return now
+
+    def _redis(self):
+        return get_redis()
+
+
+principal_cache = PrincipalCache(
+    maxsize=settings.PRINCIPAL_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL
+)
+
+directory_version = DirectoryVersion()
+
+# Version 2: pages are cached as rendered JSON bytes.
+# Version 3: Redis entries are a JSON header and raw bytes instead of a pickle.
+directory_cache = TieredCache(
+    "users:directory", ttl=settings.USERS_DIRECTORY_CACHE_TTL, version=3
+)
@@ -0,0 +1,129 @@
+"""
+Streaming export of the user directory.
+
+Rows are read through a server-side cursor (`iterator(chunk_size=...)`) as
+plain tuples and encoded a chunk at a time, so memory stays flat however
+large auth_user grows. Output is NDJSON or CSV, optionally gzipped on the fly.
+
+Behind PgBouncer (DB_PGBOUNCER) there are no server-side cursors, and
+`iterator()` would have psycopg fetch the whole result at once. Rows are
+then read by keyset instead, one `id > last LIMIT chunk_size` query per
+chunk. Each chunk is its own snapshot, so rows written during a long export
+may or may not appear in it.
+"""
+
+import csv
+import io
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .models import Profile
+
+EXPORT_FIELDS = (
+    ("id", "user_id"),
+    ("username", "user__username"),
+    ("email", "user__email"),
+    ("first_name", "user__first_name"),
+    ("last_name", "user__last_name"),
+    ("is_active", "user__is_active"),
+    ("date_joined", "user__date_joined"),
+    ("bio", "bio"),
+    ("mobile", "mobile"),
+    ("role", "role"),
+    ("created_at", "created_at"),
+    ("updated_at", "updated_at"),
+)
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def export_rows(chunk_size: int | None = None):
+    """Yield lists of up to `chunk_size` row tuples in a stable order."""
+    chunk_size = chunk_size or settings.USERS_EXPORT_CHUNK_SIZE
+    queryset = Profile.objects.order_by("id")
+    columns = [column for _, column in EXPORT_FIELDS]
+    if connections[queryset.db].settings_dict.get("DISABLE_SERVER_SIDE_CURSORS"):
+        yield from keyset_rows(queryset, columns, chunk_size)
+        return
+
+    rows = queryset.values_list(*columns).iterator(chunk_size=chunk_size)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def keyset_rows(queryset, columns, chunk_size: int):
+    """`export_rows` without a cursor: one query per chunk, keyed on the id."""
+    queryset = queryset.values_list(*columns, "id")
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if chunk:
+            last_id = chunk[-1][-1]
+            yield [row[:-1] for row in chunk]
+        if len(chunk) < chunk_size:
+            return
+
+
+def _isoformat(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def ndjson_stream(chunks):
+    names = [name for name, _ in EXPORT_FIELDS]
+    for chunk in chunks:
+        yield "".join(
+            json.dumps(dict(zip(names, map(_isoformat, row)))) + "\n" for row in chunk
+        ).encode()
+
+
+def csv_stream(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(name for name, _ in EXPORT_FIELDS)
+    for chunk in chunks:
+        writer.writerows(map(_isoformat, row) for row in chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzip_stream(stream):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for data in stream:
+        compressed = compressor.compress(data)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_stream(fmt: str, gzip: bool = False, chunk_size: int | None = None):
+    encode = ndjson_stream if fmt == "ndjson" else csv_stream
+    stream = encode(export_rows(chunk_size))
+    return gzip_stream(stream) if gzip else stream
+
+
+async def aexport_stream(fmt: str, gzip: bool = False, chunk_size: int | None = None):
+    """Async iterator over `export_stream` for ASGI responses.
+
+    Each chunk is pulled on the thread that owns the database connection, so
+    the server-side cursor stays valid and only one chunk is buffered at a time.
+    """
+    stream = export_stream(fmt, gzip=gzip, chunk_size=chunk_size)
+    pull = sync_to_async(next, thread_sensitive=True)
+    while (data := await pull(stream, None)) is not None:
+        yield data
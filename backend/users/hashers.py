@@ -0,0 +1,36 @@
+"""
+Password hashers with work factors taken from settings.
+
+Select the preferred algorithm with PASSWORD_HASHER ("pbkdf2" or "argon2").
+The other one stays registered, so existing hashes keep verifying. Django
+reports a hash as stale when it was made with a non-preferred algorithm or
+with different work factors. `users.hashing.verify_password` then rehashes it
+on the next successful login, so changing these settings migrates users
+transparently.
+"""
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return (
+            settings.PASSWORD_PBKDF2_ITERATIONS
+            or hashers.PBKDF2PasswordHasher.iterations
+        )
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM
@@ -0,0 +1,115 @@
+"""
+Bounded executor for password hashing.
+
+PBKDF2 and Argon2 are deliberately CPU-heavy. Run inline, a burst of logins
+occupies every request thread and starves cheap endpoints such as /user/me.
+All hashing goes through a small per-process thread pool instead; both
+hashlib and argon2-cffi release the GIL while they work. Admission is capped
+at PASSWORD_HASHING_WORKERS running plus PASSWORD_HASHING_QUEUE waiting jobs.
+Anything beyond that fails fast with `HashingPoolSaturated`, which the views
+turn into a 503 with Retry-After.
+
+Setting PASSWORD_HASHING_WORKERS to 0 hashes inline on the request thread.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+
+from app.tracing import traced
+
+
+class HashingPoolSaturated(Exception):
+    """Raised when the hashing pool's queue is full."""
+
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+        super().__init__("Password hashing capacity exhausted")
+
+
+class PasswordHashingPool:
+    def __init__(self, workers: int, queue_size: int, retry_after: int):
+        self.workers = workers
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(workers + queue_size) if workers else None
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Schedule `fn` on the pool, or raise `HashingPoolSaturated` if it is full."""
+        if self._slots is None:
+            future = Future()
+            future.set_result(fn(*args, **kwargs))
+            return future
+
+        if not self._slots.acquire(blocking=False):
+            raise HashingPoolSaturated(self.retry_after)
+        try:
+            future = self._get_executor().submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def arun(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _get_executor(self):
+        # Created lazily so gunicorn's forked workers each get their own threads.
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix="password-hashing"
+                    )
+        return self._executor
+
+
+hashing_pool = PasswordHashingPool(
+    workers=settings.PASSWORD_HASHING_WORKERS,
+    queue_size=settings.PASSWORD_HASHING_QUEUE,
+    retry_after=settings.PASSWORD_HASHING_RETRY_AFTER,
+)
+
+
+def _check(raw_password, encoded):
+    """Return `(valid, needs_rehash)` without touching the database."""
+    needs_rehash = []
+    valid = check_password(raw_password, encoded, setter=needs_rehash.append)
+    return valid, bool(needs_rehash)
+
+
+@traced("password.verify")
+def verify_password(user, raw_password) -> bool:
+    """Check `raw_password` against `user` on the pool, rehashing if the hasher changed."""
+    valid, needs_rehash = hashing_pool.run(_check, raw_password, user.password)
+    if valid and needs_rehash:
+        user.password = hashing_pool.run(make_password, raw_password)
+        user.save(update_fields=["password"])
+    return valid
+
+
+@traced("password.verify")
+async def averify_password(user, raw_password) -> bool:
+    valid, needs_rehash = await hashing_pool.arun(_check, raw_password, user.password)
+    if valid and needs_rehash:
+        user.password = await hashing_pool.arun(make_password, raw_password)
+        await user.asave(update_fields=["password"])
+    return valid
+
+
+@traced("password.hash")
+def hash_password(raw_password) -> str:
+    return hashing_pool.run(make_password, raw_password)
+
+
+@traced("password.hash")
+async def ahash_password(raw_password) -> str:
+    return await hashing_pool.arun(make_password, raw_password)
@@ -0,0 +1,298 @@
+"""
+Bulk user import pipeline.
+
+An upload is parsed into rows and processed in chunks of
+USER_IMPORT_CHUNK_SIZE. Each chunk is validated and deduplicated against the
+file and the database with two case-insensitive `IN` queries. Passwords are
+hashed in parallel, and User and Profile rows go in with `bulk_create`.
+Nothing goes through `Model.save()`, so the per-instance `post_save`
+receivers (`create_user_profile`, `save_user_profile`, cache invalidation)
+do not run. Each chunk records a `user.registered` outbox event per created
+user in the same transaction, as /register does, with the `import_id` added.
+
+Rows may carry a plain `password`, a Django-format `password_hash` taken
+from another system, or neither, which leaves the account with an unusable
+password until it is reset. Plain passwords are what bound throughput, at one
+full hash per row.
+"""
+
+import csv
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import DataError, IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Upper
+from django.utils import timezone
+
+from . import outbox
+from .cache import directory_version
+from .models import Profile, UserImport, UserImportStatus, UserRole
+
+IMPORT_FORMATS = ("csv", "ndjson")
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def parse_rows(payload: str, fmt: str):
+    """Yield `(line_number, row_dict)` from a CSV or NDJSON payload."""
+    if fmt == "csv":
+        reader = csv.DictReader(io.StringIO(payload))
+        for number, row in enumerate(reader, start=2):
+            yield number, row
+        return
+
+    for number, line in enumerate(payload.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            row = None
+        yield number, row if isinstance(row, dict) else {"_invalid": line}
+
+
+def count_rows(payload: str, fmt: str) -> int:
+    return sum(1 for _ in parse_rows(payload, fmt))
+
+
+def _text(row, name):
+    """`row[name]` as a string; NDJSON rows may hold any JSON value."""
+    value = row.get(name)
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        raise ImportRowError(f"{name} must be a string")
+    return value
+
+
+def _validate(name, value):
+    """Run the auth_user column's validators (format and max_length)."""
+    try:
+        User._meta.get_field(name).run_validators(value)
+    except ValidationError:
+        raise ImportRowError(f"Invalid {name}")
+
+
+def _clean(row):
+    if "_invalid" in row:
+        raise ImportRowError("Malformed row")
+    username = User.normalize_username(_text(row, "username").strip())
+    if not username:
+        raise ImportRowError("Missing username")
+    _validate("username", username)
+    email = User.objects.normalize_email(_text(row, "email").strip())
+    if email:
+        _validate("email", email)
+    role = _text(row, "role") or UserRole.DEFAULT_USER
+    if role not in UserRole.values:
+        raise ImportRowError(f"Unknown role: {role}")
+    password_hash = _text(row, "password_hash")
+    if password_hash:
+        try:
+            identify_hasher(password_hash)
+        except ValueError:
+            raise ImportRowError("Unrecognised password_hash")
+    return {
+        "username": username,
+        "email": email,
+        "first_name": _text(row, "first_name")[:150],
+        "last_name": _text(row, "last_name")[:150],
+        "password": _text(row, "password"),
+        "password_hash": password_hash,
+        "bio": _text(row, "bio")[:500],
+        "mobile": _text(row, "mobile")[:20],
+        "role": role,
+    }
+
+
+class UserImporter:
+    def __init__(self, job: UserImport):
+        self.job = job
+        self.seen_usernames = set()
+        self.seen_emails = set()
+        self.conflicts = []
+
+    def run(self):
+        chunk = []
+        for number, row in parse_rows(self.job.payload, self.job.format):
+            chunk.append((number, row))
+            if len(chunk) == settings.USER_IMPORT_CHUNK_SIZE:
+                self.process_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.process_chunk(chunk)
+
+    def conflict(self, number, row, reason):
+        username, email = row.get("username"), row.get("email")
+        return {
+            "line": number,
+            "username": "" if username is None else str(username),
+            "email": "" if email is None else str(email),
+            "reason": reason,
+        }
+
+    def process_chunk(self, chunk):
+        conflicts = []
+        accepted = []
+        for number, row in chunk:
+            try:
+                cleaned = _clean(row)
+            except ImportRowError as exc:
+                conflicts.append(self.conflict(number, row, str(exc)))
+                continue
+            username_key = cleaned["username"].lower()
+            email_key = cleaned["email"].lower()
+            if username_key in self.seen_usernames or (
+                email_key and email_key in self.seen_emails
+            ):
+                conflicts.append(self.conflict(number, cleaned, "Duplicate in file"))
+                continue
+            self.seen_usernames.add(username_key)
+            if email_key:
+                self.seen_emails.add(email_key)
+            accepted.append((number, cleaned))
+
+        accepted, existing = self.drop_existing(accepted)
+        conflicts.extend(existing)
+
+        passwords = self.hash_passwords([cleaned for _, cleaned in accepted])
+        created, failed = self.insert(accepted, passwords)
+        conflicts.extend(failed)
+        if created:
+            # bulk_create skips the receivers that normally bump this.
+            directory_version.bump()
+
+        self.conflicts.extend(sorted(conflicts, key=lambda conflict: conflict["line"]))
+        reported = self.conflicts[: settings.USER_IMPORT_MAX_REPORTED_CONFLICTS]
+        UserImport.objects.filter(pk=self.job.pk).update(
+            processed=F("processed") + len(chunk),
+            created=F("created") + created,
+            conflict_count=F("conflict_count") + len(conflicts),
+            conflicts=reported,
+            updated_at=timezone.now(),
+        )
+
+    def drop_existing(self, accepted):
+        # Compared as UPPER(column), like the case-insensitive unique indexes
+        # on auth_user (migration 0006), so these lookups can use them.
+        usernames = [cleaned["username"].upper() for _, cleaned in accepted]
+        emails = [
+            cleaned["email"].upper() for _, cleaned in accepted if cleaned["email"]
+        ]
+        taken_usernames = set(
+            User.objects.annotate(key=Upper("username"))
+            .filter(key__in=usernames)
+            .values_list("key", flat=True)
+        )
+        taken_emails = set(
+            User.objects.annotate(key=Upper("email"))
+            .filter(key__in=emails)
+            .exclude(email="")
+            .values_list("key", flat=True)
+        )
+
+        kept, conflicts = [], []
+        for number, cleaned in accepted:
+            if cleaned["username"].upper() in taken_usernames:
+                conflicts.append(
+                    self.conflict(number, cleaned, "Username already exists")
+                )
+            elif cleaned["email"] and cleaned["email"].upper() in taken_emails:
+                conflicts.append(self.conflict(number, cleaned, "Email already exists"))
+            else:
+                kept.append((number, cleaned))
+        return kept, conflicts
+
+    def hash_passwords(self, rows):
+        def encode(row):
+            if row["password_hash"]:
+                return row["password_hash"]
+            # make_password(None) is an unusable password and costs nothing.
+            return make_password(row["password"] or None)
+
+        with ThreadPoolExecutor(max_workers=settings.USER_IMPORT_HASH_WORKERS) as pool:
+            return list(pool.map(encode, rows))
+
+    def insert(self, accepted, passwords):
+        users = [
+            User(
+                username=cleaned["username"],
+                email=cleaned["email"],
+                first_name=cleaned["first_name"],
+                last_name=cleaned["last_name"],
+                password=password,
+            )
+            for (_, cleaned), password in zip(accepted, passwords)
+        ]
+        try:
+            with transaction.atomic():
+                self.bulk_insert(users, [cleaned for _, cleaned in accepted])
+            return len(users), []
+        except (IntegrityError, DataError):
+            pass
+
+        # A concurrent writer took some of these names, or a value was
+        # rejected by the database; find the offending rows one by one.
+        created, conflicts = 0, []
+        for (number, cleaned), user in zip(accepted, users):
+            user.pk = None
+            try:
+                with transaction.atomic():
+                    self.bulk_insert([user], [cleaned])
+                created += 1
+            except IntegrityError:
+                conflicts.append(self.conflict(number, cleaned, "Already exists"))
+            except DataError:
+                conflicts.append(self.conflict(number, cleaned, "Invalid value"))
+        return created, conflicts
+
+    def bulk_insert(self, users, rows):
+        users = User.objects.bulk_create(users)
+        Profile.objects.bulk_create(
+            Profile(user=user, bio=row["bio"], mobile=row["mobile"], role=row["role"])
+            for user, row in zip(users, rows)
+        )
+        outbox.publish_many(
+            outbox.USER_REGISTERED,
+            (
+                (
+                    str(user.id),
+                    {
+                        "user_id": user.id,
+                        "username": user.username,
+                        "email": user.email,
+                        "import_id": self.job.pk,
+                    },
+                )
+                for user in users
+            ),
+        )
+
+
+def run_import(import_id: int):
+    job = UserImport.objects.get(pk=import_id)
+    if job.status != UserImportStatus.PENDING:
+        return
+    UserImport.objects.filter(pk=job.pk).update(
+        status=UserImportStatus.RUNNING, updated_at=timezone.now()
+    )
+
+    status, error = UserImportStatus.COMPLETED, ""
+    try:
+        UserImporter(job).run()
+    except Exception as exc:
+        status, error = UserImportStatus.FAILED, str(exc)
+        raise
+    finally:
+        # The payload may hold plain-text passwords; drop it even on failure.
+        UserImport.objects.filter(pk=job.pk).update(
+            status=status, error=error, payload="", updated_at=timezone.now()
+        )
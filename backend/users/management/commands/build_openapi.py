@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.renderers import dumps
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the API's OpenAPI schema to OPENAPI_SCHEMA_FILE, "
+        "served as /api/openapi.json."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="Where to write the schema (default: OPENAPI_SCHEMA_FILE).",
+        )
+
+    def handle(self, output, **options):
+        from app.urls import api
+
+        path = Path(output or settings.OPENAPI_SCHEMA_FILE)
+        schema = api.get_openapi_schema()
+        content = dumps(schema)
+        path.write_bytes(content)
+        self.stdout.write(
+            f"Wrote {len(schema['paths'])} paths ({len(content)} bytes) to {path}"
+        )
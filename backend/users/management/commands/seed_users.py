@@ -0,0 +1,65 @@
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from users.cache import directory_version
+from users.models import Profile, UserRole
+
+
+class Command(BaseCommand):
+    help = "Seed N synthetic users with profiles for benchmarking."
+
+    def add_arguments(self, parser):
+        parser.add_argument("count", type=int)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--prefix", default="seed")
+        parser.add_argument(
+            "--password",
+            default="seedpass123",
+            help="Password for every seeded user (hashed once and reused).",
+        )
+        parser.add_argument(
+            "--managers",
+            type=int,
+            default=1,
+            help="How many of the seeded users get the manager role.",
+        )
+
+    def handle(self, count, batch_size, prefix, password, managers, **options):
+        password_hash = make_password(password)
+        start = User.objects.filter(username__startswith=f"{prefix}_").count()
+        created = 0
+
+        # bulk_create skips post_save, so profiles are created alongside.
+        while created < count:
+            size = min(batch_size, count - created)
+            numbers = range(start + created, start + created + size)
+            with transaction.atomic():
+                users = User.objects.bulk_create(
+                    User(
+                        username=f"{prefix}_{n}",
+                        email=f"{prefix}_{n}@example.com",
+                        first_name="Seed",
+                        last_name=str(n),
+                        password=password_hash,
+                    )
+                    for n in numbers
+                )
+                Profile.objects.bulk_create(
+                    Profile(
+                        user=user,
+                        bio=f"Seeded user number {n}",
+                        role=(
+                            UserRole.MANAGER
+                            if n - start < managers
+                            else UserRole.DEFAULT_USER
+                        ),
+                    )
+                    for n, user in zip(numbers, users)
+                )
+            created += size
+            self.stdout.write(f"Seeded {created}/{count} users")
+
+        directory_version.bump()
+        self.stdout.write(self.style.SUCCESS(f"Seeded {count} users"))
@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+# Every index here is built concurrently on Postgres, so users_profile and
+# auth_user stay writable while they are created.
+#
+# Prefix filters use `istartswith`, which Postgres renders as
+# UPPER("col"::text) LIKE UPPER(%s); these expression indexes match it.
+AUTH_USER_PREFIX_INDEXES = {
+    "users_auth_user_username_prefix_idx": "username",
+    "users_auth_user_email_prefix_idx": "email",
+}
+
+
+class AddIndexConcurrentlyOnPostgres(AddIndexConcurrently):
+    """AddIndexConcurrently, or a plain AddIndex on other databases."""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == "postgresql":
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_forwards(
+                self, app_label, schema_editor, from_state, to_state
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == "postgresql":
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_backwards(
+                self, app_label, schema_editor, from_state, to_state
+            )
+
+
+def create_auth_user_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, column in AUTH_USER_PREFIX_INDEXES.items():
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+            f"ON auth_user (UPPER({column}::text) text_pattern_ops)"
+        )
+
+
+def drop_auth_user_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name in AUTH_USER_PREFIX_INDEXES:
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("users", "0002_profile_role"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name="profile",
+            index=models.Index(
+                fields=["-created_at", "-id"], name="profile_created_id_idx"
+            ),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name="profile",
+            index=models.Index(
+                fields=["role", "-created_at", "-id"],
+                name="profile_role_created_id_idx",
+            ),
+        ),
+        migrations.RunPython(
+            create_auth_user_prefix_indexes, drop_auth_user_prefix_indexes
+        ),
+    ]
@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.db import migrations
+
+# Case-insensitive uniqueness for auth_user, which registration relies on
+# instead of checking first. The expressions match what `iexact` renders on
+# Postgres, UPPER("col"::text) = UPPER(%s), so lookups use them too. Blank
+# emails are allowed more than once. Built concurrently on Postgres so
+# auth_user stays writable. Existing rows that differ only in case must be
+# merged first: the migration lists them and stops. A concurrent build that
+# failed anyway leaves an INVALID index behind, which enforces nothing; it is
+# dropped and rebuilt on the next run rather than skipped by IF NOT EXISTS.
+AUTH_USER_UNIQUE_INDEXES = {
+    "users_auth_user_username_ci_uniq": ("username", ""),
+    "users_auth_user_email_ci_uniq": ("email", "WHERE email <> ''"),
+}
+
+
+def case_duplicates(schema_editor, column, where):
+    """A few values of `column` that more than one row holds, ignoring case."""
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT UPPER({column}), COUNT(*) FROM auth_user {where} "
+            f"GROUP BY UPPER({column}) HAVING COUNT(*) > 1 ORDER BY 1 LIMIT 10"
+        )
+        return cursor.fetchall()
+
+
+def drop_invalid_index(schema_editor, name):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)",
+            [name],
+        )
+        row = cursor.fetchone()
+    if row is not None and not row[0]:
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def create_auth_user_unique_indexes(apps, schema_editor):
+    postgres = schema_editor.connection.vendor == "postgresql"
+    for name, (column, where) in AUTH_USER_UNIQUE_INDEXES.items():
+        duplicates = case_duplicates(schema_editor, column, where)
+        if duplicates:
+            listed = ", ".join(f"{value!r} x{count}" for value, count in duplicates)
+            raise RuntimeError(
+                f"auth_user has {column} values that differ only in case; "
+                f"merge them before migrating: {listed}"
+            )
+        if postgres:
+            drop_invalid_index(schema_editor, name)
+            schema_editor.execute(
+                f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+                f"ON auth_user (UPPER({column}::text)) {where}"
+            )
+        else:
+            schema_editor.execute(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {name} "
+                f"ON auth_user (UPPER({column})) {where}"
+            )
+
+
+def drop_auth_user_unique_indexes(apps, schema_editor):
+    concurrently = (
+        "CONCURRENTLY " if schema_editor.connection.vendor == "postgresql" else ""
+    )
+    for name in AUTH_USER_UNIQUE_INDEXES:
+        schema_editor.execute(f"DROP INDEX {concurrently}IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("users", "0005_outboxevent"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            create_auth_user_unique_indexes, drop_auth_user_unique_indexes
+        ),
+    ]
@@ -0,0 +1,182 @@
+from django.conf import settings
+from django.db import migrations
+
+# Search columns on users_profile for users/search.py, Postgres only:
+#
+# - search_vector: a tsvector of username and email (weight A), names and
+#   mobile (B) and bio (C), split on punctuation so "jane.doe@example.com"
+#   is searchable by each part
+# - search_text: the short identifying fields, lowercased, for pg_trgm
+#   word similarity (typos and partial words)
+#
+# Triggers keep both in step with users_profile and auth_user, including
+# bulk_create and queryset.update(), which bypass Django signals. The
+# columns are not model fields, so the ORM never reads or writes them.
+# Rows are backfilled in batches and the GIN indexes are built concurrently.
+# The trigram index needs the pg_trgm extension; without it, search falls
+# back to the tsvector alone.
+
+BACKFILL_BATCH_SIZE = 10000
+
+FUNCTIONS = """
+CREATE OR REPLACE FUNCTION users_search_words(value text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT regexp_replace(lower(coalesce(value, '')), '[^[:alnum:]]+', ' ', 'g')
+$$;
+
+CREATE OR REPLACE FUNCTION users_search_vector(
+    username text, email text, first_name text, last_name text,
+    mobile text, bio text
+) RETURNS tsvector
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT setweight(to_tsvector('simple',
+               users_search_words(concat_ws(' ', username, email))), 'A')
+        || setweight(to_tsvector('simple',
+               users_search_words(concat_ws(' ', first_name, last_name, mobile))), 'B')
+        || setweight(to_tsvector('simple', users_search_words(bio)), 'C')
+$$;
+
+CREATE OR REPLACE FUNCTION users_search_text(
+    username text, email text, first_name text, last_name text, mobile text
+) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT lower(concat_ws(' ', username, email, first_name, last_name, mobile))
+$$;
+
+CREATE OR REPLACE FUNCTION users_profile_search_update() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    account auth_user%ROWTYPE;
+BEGIN
+    SELECT * INTO account FROM auth_user WHERE id = NEW.user_id;
+    NEW.search_vector := users_search_vector(
+        account.username, account.email, account.first_name, account.last_name,
+        NEW.mobile, NEW.bio
+    );
+    NEW.search_text := users_search_text(
+        account.username, account.email, account.first_name, account.last_name,
+        NEW.mobile
+    );
+    RETURN NEW;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION auth_user_search_update() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE users_profile SET
+        search_vector = users_search_vector(
+            NEW.username, NEW.email, NEW.first_name, NEW.last_name, mobile, bio
+        ),
+        search_text = users_search_text(
+            NEW.username, NEW.email, NEW.first_name, NEW.last_name, mobile
+        )
+    WHERE user_id = NEW.id;
+    RETURN NULL;
+END
+$$;
+"""
+
+TRIGGERS = """
+CREATE TRIGGER users_profile_search
+BEFORE INSERT OR UPDATE OF user_id, mobile, bio ON users_profile
+FOR EACH ROW EXECUTE FUNCTION users_profile_search_update();
+
+CREATE TRIGGER auth_user_search
+AFTER UPDATE OF username, email, first_name, last_name ON auth_user
+FOR EACH ROW
+WHEN ((OLD.username, OLD.email, OLD.first_name, OLD.last_name)
+      IS DISTINCT FROM (NEW.username, NEW.email, NEW.first_name, NEW.last_name))
+EXECUTE FUNCTION auth_user_search_update();
+"""
+
+BACKFILL = """
+UPDATE users_profile AS profile SET
+    search_vector = users_search_vector(
+        account.username, account.email, account.first_name, account.last_name,
+        profile.mobile, profile.bio
+    ),
+    search_text = users_search_text(
+        account.username, account.email, account.first_name, account.last_name,
+        profile.mobile
+    )
+FROM auth_user AS account
+WHERE account.id = profile.user_id AND profile.id >= %s AND profile.id < %s
+"""
+
+
+def create_profile_search(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    execute = schema_editor.execute
+    execute(
+        "ALTER TABLE users_profile "
+        "ADD COLUMN IF NOT EXISTS search_vector tsvector, "
+        "ADD COLUMN IF NOT EXISTS search_text text"
+    )
+    # No parameters, so the driver leaves `%ROWTYPE` alone.
+    execute(FUNCTIONS, params=None)
+    # Triggers first, so rows written during the backfill are covered too.
+    execute("DROP TRIGGER IF EXISTS users_profile_search ON users_profile")
+    execute("DROP TRIGGER IF EXISTS auth_user_search ON auth_user")
+    execute(TRIGGERS)
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT coalesce(min(id), 0), coalesce(max(id), 0) FROM users_profile"
+        )
+        low, high = cursor.fetchone()
+        for start in range(low, high + 1, BACKFILL_BATCH_SIZE):
+            cursor.execute(BACKFILL, [start, start + BACKFILL_BATCH_SIZE])
+
+        execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS users_profile_search_vector_idx "
+            "ON users_profile USING gin (search_vector)"
+        )
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_available_extensions "
+            "WHERE name = 'pg_trgm')"
+        )
+        if cursor.fetchone()[0]:
+            execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS "
+                "users_profile_search_text_trgm_idx "
+                "ON users_profile USING gin (search_text gin_trgm_ops)"
+            )
+
+
+def drop_profile_search(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    execute = schema_editor.execute
+    execute("DROP TRIGGER IF EXISTS users_profile_search ON users_profile")
+    execute("DROP TRIGGER IF EXISTS auth_user_search ON auth_user")
+    execute("DROP INDEX CONCURRENTLY IF EXISTS users_profile_search_text_trgm_idx")
+    execute("DROP INDEX CONCURRENTLY IF EXISTS users_profile_search_vector_idx")
+    execute(
+        "ALTER TABLE users_profile "
+        "DROP COLUMN IF EXISTS search_vector, DROP COLUMN IF EXISTS search_text"
+    )
+    for function in (
+        "auth_user_search_update()",
+        "users_profile_search_update()",
+        "users_search_text(text, text, text, text, text)",
+        "users_search_vector(text, text, text, text, text, text)",
+        "users_search_words(text)",
+    ):
+        execute(f"DROP FUNCTION IF EXISTS {function}")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("users", "0006_auth_user_unique_ci"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(create_profile_search, drop_profile_search),
+    ]
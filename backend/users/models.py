@@ -1,7 +1,10 @@
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
+
+from app.tracing import traced
 
 
 class UserRole(models.TextChoices):
@@ -19,23 +22,208 @@ class Profile(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    TRACKED_FIELDS = ("user_id", "bio", "mobile", "role")
+
     def __str__(self):
         return f"{self.user.username} ({self.get_role_display()})"  # type: ignore
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Keyset pagination of the user directory (see list_all_users).
+            models.Index(fields=["-created_at", "-id"], name="profile_created_id_idx"),
+            models.Index(
+                fields=["role", "-created_at", "-id"], name="profile_role_created_id_idx"
+            ),
+        ]
 
     @property
     def is_manager(self):
         return self.role == UserRole.MANAGER
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        # The reloaded values are the stored ones now; compare against them.
+        if fields is not None:
+            fields = {
+                getattr(self._meta.get_field(name), "attname", name) for name in fields
+            }
+        self._snapshot(fields)
+
+    def _snapshot(self, fields=None):
+        # Remember the stored values so save() can write only what changed and
+        # post_save receivers can compare against them.
+        loaded = self.__dict__.setdefault("_loaded_values", {})
+        deferred = self.get_deferred_fields()
+        for name in self.TRACKED_FIELDS:
+            if name not in deferred and (fields is None or name in fields):
+                loaded[name] = getattr(self, name)
+
+    @property
+    def dirty_fields(self):
+        """Tracked fields changed since load, or None if nothing was loaded."""
+        loaded = self.__dict__.get("_loaded_values")
+        if loaded is None:
+            return None
+        deferred = self.get_deferred_fields()
+        return [
+            name
+            for name in self.TRACKED_FIELDS
+            if name not in deferred
+            and (name not in loaded or getattr(self, name) != loaded[name])
+        ]
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        dirty = self.dirty_fields
+        if not args and update_fields is None and not self._state.adding:
+            if dirty is not None:
+                if not dirty:
+                    return
+                update_fields = kwargs["update_fields"] = [*dirty, "updated_at"]
+        super().save(*args, **kwargs)
+        if update_fields is not None:
+            update_fields = {self._meta.get_field(name).attname for name in update_fields}
+        self._snapshot(update_fields)
+
+
+class UserImportStatus(models.TextChoices):
+    PENDING = "pending", "Pending"
+    RUNNING = "running", "Running"
+    COMPLETED = "completed", "Completed"
+    FAILED = "failed", "Failed"
+
+
+class UserImport(models.Model):
+    """A bulk user import job, processed by `users.tasks.import_users`."""
+
+    created_by = models.ForeignKey(
+        User, null=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    format = models.CharField(max_length=10)
+    payload = models.TextField(blank=True)
+    status = models.CharField(
+        max_length=10,
+        choices=UserImportStatus.choices,
+        default=UserImportStatus.PENDING,
+    )
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    created = models.PositiveIntegerField(default=0)
+    conflict_count = models.PositiveIntegerField(default=0)
+    conflicts = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Import #{self.pk} ({self.get_status_display()})"  # type: ignore
+
+    class Meta:
+        ordering = ["-created_at"]
+
+
+class OutboxEvent(models.Model):
+    """A side effect recorded with the change that caused it (see users/outbox.py)."""
+
+    topic = models.CharField(max_length=100)
+    key = models.CharField(max_length=200)
+    payload = models.JSONField(default=dict)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.topic} {self.key}"
+
+    @property
+    def dedup_key(self):
+        """Stable across redeliveries; pass it downstream as an idempotency key."""
+        return f"{self.topic}:{self.key}"
+
+    class Meta:
+        ordering = ["id"]
+        constraints = [
+            models.UniqueConstraint(fields=["topic", "key"], name="outbox_topic_key_uniq")
+        ]
+        indexes = [
+            # The relay's scan: pending events that are due, oldest first.
+            models.Index(
+                fields=["available_at", "id"],
+                name="outbox_pending_idx",
+                condition=models.Q(processed_at__isnull=True),
+            ),
+        ]
+
 
 @receiver(post_save, sender=User)
+@traced("signal create_user_profile")
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
 
 
+# User columns that no principal or directory page shows.
+PRINCIPAL_IGNORED_FIELDS = frozenset({"last_login", "password"})
+
+
+def invalidate_principal(user_id):
+    """Drop the cached principal now and again once the transaction commits."""
+    from .cache import directory_version, principal_cache
+
+    principal_cache.invalidate(user_id)
+    directory_version.bump()
+    # A concurrent request may re-cache the old row before we commit.
+    transaction.on_commit(lambda: principal_cache.invalidate(user_id))
+    transaction.on_commit(directory_version.bump)
+
+
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
+@receiver(post_delete, sender=User)
+@traced("signal invalidate_user_principal")
+def invalidate_user_principal(sender, instance, update_fields=None, **kwargs):
+    # Logins write last_login and may rehash the password; neither is served.
+    if update_fields is not None and update_fields <= PRINCIPAL_IGNORED_FIELDS:
+        return
+    invalidate_principal(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+@traced("signal invalidate_profile_principal")
+def invalidate_profile_principal(sender, instance, **kwargs):
+    invalidate_principal(instance.user_id)
+
+
+@receiver(post_save, sender=Profile)
+@traced("signal bump_authz_epoch_on_role_change")
+def bump_authz_epoch_on_role_change(sender, instance, created, **kwargs):
+    from .tokens import authz_epochs
+
+    loaded = instance.__dict__.get("_loaded_values", {})
+    if not created and instance.role != loaded.get("role"):
+        # After commit, so a token minted from the old row in the meantime is
+        # rejected too, and a rolled-back change logs nobody out.
+        user_id = instance.user_id
+        transaction.on_commit(lambda: authz_epochs.bump(user_id))
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Profile)
+@traced("signal bump_authz_epoch_on_delete")
+def bump_authz_epoch_on_delete(sender, instance, **kwargs):
+    # Role bearers trust the token's claims, so a deleted account's tokens
+    # must go stale rather than keep their role until they expire.
+    from .tokens import authz_epochs
+
+    user_id = instance.pk if sender is User else instance.user_id
+    transaction.on_commit(lambda: authz_epochs.bump(user_id))
+
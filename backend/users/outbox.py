@@ -0,0 +1,153 @@
+"""
+Transactional outbox for work that follows a user change.
+
+Views record side effects (welcome notifications, CRM sync, search indexing)
+with `publish()` inside the transaction that writes the User or Profile, so
+an event exists exactly when its change committed. That costs one INSERT on
+the request path. `users.tasks.relay_outbox` then drains the table in
+batches of OUTBOX_BATCH_SIZE:
+
+    SELECT ... WHERE processed_at IS NULL AND available_at <= now()
+    ORDER BY id LIMIT n FOR UPDATE SKIP LOCKED
+
+Concurrent relays skip each other's rows instead of waiting on them, so
+running one per worker is safe. Each event runs its handlers in a savepoint
+and is marked processed in the same transaction. Handlers that only write to
+the database therefore take effect once. A failed event is retried with
+exponential backoff up to OUTBOX_MAX_ATTEMPTS. A relay that dies mid-batch
+rolls back, and the batch is delivered again.
+
+Delivery is at-least-once. Handlers that call other systems should pass
+`event.dedup_key` as an idempotency key. Publishing is deduplicated on
+`(topic, key)`: a second event with the same key is dropped.
+
+Register handlers by topic:
+
+    @outbox.handler("user.registered")
+    def send_welcome(event):
+        mailer.send_welcome(event.payload["user_id"], idempotency_key=event.dedup_key)
+"""
+
+import logging
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+USER_REGISTERED = "user.registered"
+PROFILE_UPDATED = "profile.updated"
+
+_handlers = defaultdict(list)
+
+
+def handler(topic: str):
+    """Register the decorated function to run for each event on `topic`."""
+
+    def decorator(func):
+        _handlers[topic].append(func)
+        return func
+
+    return decorator
+
+
+def handlers_for(topic: str):
+    return tuple(_handlers.get(topic, ()))
+
+
+def publish(topic: str, payload: dict, key: str | None = None):
+    """Record an event in the current transaction; duplicates of `key` are dropped."""
+    OutboxEvent.objects.bulk_create(
+        [OutboxEvent(topic=topic, key=key or uuid.uuid4().hex, payload=payload)],
+        ignore_conflicts=True,
+    )
+
+
+def publish_many(topic: str, events):
+    """`publish` each `(key, payload)` of `events` on `topic` in one INSERT."""
+    OutboxEvent.objects.bulk_create(
+        [OutboxEvent(topic=topic, key=key, payload=payload) for key, payload in events],
+        ignore_conflicts=True,
+    )
+
+
+def backoff(attempts: int) -> timedelta:
+    return timedelta(
+        seconds=min(
+            settings.OUTBOX_RETRY_BASE * 2 ** (attempts - 1), settings.OUTBOX_RETRY_MAX
+        )
+    )
+
+
+def deliver(event: OutboxEvent, now):
+    """Run `event`'s handlers; return the fields to save on it."""
+    try:
+        with transaction.atomic():
+            for func in handlers_for(event.topic):
+                func(event)
+    except Exception as exc:
+        event.attempts += 1
+        event.last_error = f"{type(exc).__name__}: {exc}"
+        event.available_at = now + backoff(event.attempts)
+        if event.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            logger.error(
+                "Outbox event %s (%s) failed %d times, giving up",
+                event.pk,
+                event.dedup_key,
+                event.attempts,
+            )
+        else:
+            logger.warning("Outbox event %s (%s) failed", event.pk, event.dedup_key)
+        return ["attempts", "last_error", "available_at"]
+    event.processed_at = now
+    return ["processed_at"]
+
+
+def relay_batch(batch_size: int | None = None) -> int:
+    """Deliver one batch of due events and return how many were claimed."""
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(
+                processed_at__isnull=True,
+                available_at__lte=now,
+                attempts__lt=settings.OUTBOX_MAX_ATTEMPTS,
+            )
+            .order_by("available_at", "id")[:batch_size]
+        )
+        updated = defaultdict(list)
+        for event in events:
+            updated[tuple(deliver(event, now))].append(event)
+        for fields, group in updated.items():
+            OutboxEvent.objects.bulk_update(group, fields)
+    return len(events)
+
+
+def relay(batch_size: int | None = None, max_batches: int | None = None) -> int:
+    """Drain due events batch by batch; return how many were claimed."""
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    max_batches = max_batches or settings.OUTBOX_MAX_BATCHES
+    total = 0
+    for _ in range(max_batches):
+        claimed = relay_batch(batch_size)
+        total += claimed
+        if claimed < batch_size:
+            break
+    return total
+
+
+def purge(older_than: timedelta | None = None) -> int:
+    """Delete events processed more than OUTBOX_RETENTION ago."""
+    older_than = older_than or timedelta(seconds=settings.OUTBOX_RETENTION)
+    deleted, _ = OutboxEvent.objects.filter(
+        processed_at__lt=timezone.now() - older_than
+    ).delete()
+    return deleted
@@ -0,0 +1,76 @@
+"""
+Keyset pagination for the user directory.
+
+Pages are ordered by `(Profile.created_at, Profile.id)` descending and the
+next page starts strictly after the last row of the previous one, so every
+page is an index range scan on `profile_created_id_idx` (or
+`profile_role_created_id_idx` when filtering by role) no matter how deep the
+client pages. Cursors are signed so clients cannot forge arbitrary offsets.
+
+Pages are read as `values()` rows (see users/projection.py), so a cursor is
+built from a row's `created_at` and `id` keys.
+"""
+
+from django.core import signing
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from ninja.errors import HttpError
+
+from .models import Profile
+
+CURSOR_SALT = "users.directory.cursor"
+
+
+def encode_cursor(row) -> str:
+    return signing.dumps(
+        [row["created_at"].isoformat(), row["id"]], salt=CURSOR_SALT, compress=True
+    )
+
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, profile_id = signing.loads(cursor, salt=CURSOR_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise HttpError(400, "Invalid cursor")
+    return parse_datetime(created_at), profile_id
+
+
+def directory_queryset(role=None, username_prefix=None, email_prefix=None):
+    """Profiles in directory order, with optional filters."""
+    queryset = Profile.objects.order_by("-created_at", "-id")
+    if role:
+        queryset = queryset.filter(role=role)
+    if username_prefix:
+        queryset = queryset.filter(user__username__istartswith=username_prefix)
+    if email_prefix:
+        queryset = queryset.filter(user__email__istartswith=email_prefix)
+    return queryset
+
+
+def _after_cursor(queryset, cursor):
+    if not cursor:
+        return queryset
+    created_at, profile_id = decode_cursor(cursor)
+    # The redundant `created_at <= ...` bound keeps the scan on the index range.
+    return queryset.filter(created_at__lte=created_at).filter(
+        Q(created_at__lt=created_at) | Q(id__lt=profile_id)
+    )
+
+
+def _page(rows, limit):
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def keyset_page(queryset, cursor: str | None, limit: int):
+    """Return `(rows, next_cursor)` for the page of `queryset` after `cursor`."""
+    rows = list(_after_cursor(queryset, cursor)[: limit + 1])
+    return _page(rows, limit)
+
+
+async def akeyset_page(queryset, cursor: str | None, limit: int):
+    """Async variant of `keyset_page`."""
+    rows = [row async for row in _after_cursor(queryset, cursor)[: limit + 1]]
+    return _page(rows, limit)
@@ -0,0 +1,53 @@
+"""
+Sparse fieldsets for the user list endpoints.
+
+`/users` and `/users/search` take `fields=id,username` to return only those
+keys of each item. The selection reaches the ORM as a `values()` query, so
+unrequested columns are never read: without a `user__` field the query does
+not even join auth_user, and without `bio` no profile text is fetched.
+
+Rows come back as plain dicts and are rendered with orjson directly
+(app/renderers.py), skipping a pydantic `UserProfileSchema` per row.
+"""
+
+from ninja.errors import HttpError
+
+# UserProfileSchema field -> Profile lookup, in the schema's order.
+USER_FIELDS = {
+    "id": "user_id",
+    "username": "user__username",
+    "email": "user__email",
+    "first_name": "user__first_name",
+    "last_name": "user__last_name",
+    "bio": "bio",
+    "mobile": "mobile",
+    "role": "role",
+}
+
+
+def parse_fields(fields: str | None) -> tuple[str, ...]:
+    """The requested field names in schema order; every field when omitted."""
+    if not fields:
+        return tuple(USER_FIELDS)
+    requested = {name.strip() for name in fields.split(",")} - {""}
+    unknown = requested - USER_FIELDS.keys()
+    if unknown:
+        raise HttpError(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+    if not requested:
+        raise HttpError(400, "No fields requested")
+    return tuple(name for name in USER_FIELDS if name in requested)
+
+
+def project(queryset, fields: tuple[str, ...]):
+    """`values()` of `queryset` with the columns behind `fields`.
+
+    The profile's own `created_at` and `id` come along for keyset cursors.
+    """
+    columns = [USER_FIELDS[name] for name in fields]
+    return queryset.values(*columns, "created_at", "id")
+
+
+def items(rows, fields: tuple[str, ...]) -> list[dict]:
+    """Response items for projected `rows`, keyed by field name."""
+    columns = [(name, USER_FIELDS[name]) for name in fields]
+    return [{name: row[column] for name, column in columns} for row in rows]
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from ninja import Schema
 
 
@@ -33,6 +35,28 @@ class UserProfileSchema(Schema):
     role: str = "default_user"
 
 
+class UserItemSchema(Schema):
+    """A directory item; with `fields=` only the requested keys are present."""
+
+    id: int = None
+    username: str = None
+    email: str = None
+    first_name: str = None
+    last_name: str = None
+    bio: str = None
+    mobile: str = None
+    role: str = None
+
+
+class UserPageSchema(Schema):
+    items: list[UserItemSchema]
+    next_cursor: str | None = None
+
+
+class UserSearchSchema(Schema):
+    items: list[UserItemSchema]
+
+
 class UpdateProfileSchema(Schema):
     email: str = None
     first_name: str = None
@@ -44,3 +68,34 @@ class UpdateProfileSchema(Schema):
 
 class MessageSchema(Schema):
     message: str
+
+
+class PrincipalCacheStatsSchema(Schema):
+    size: int
+    hits: int
+    remote_hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    hit_ratio: float
+
+
+class UserImportConflictSchema(Schema):
+    line: int
+    username: str
+    email: str
+    reason: str
+
+
+class UserImportSchema(Schema):
+    id: int
+    status: str
+    format: str
+    total: int
+    processed: int
+    created: int
+    conflict_count: int
+    conflicts: list[UserImportConflictSchema]
+    error: str
+    created_at: datetime
+    updated_at: datetime
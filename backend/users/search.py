@@ -0,0 +1,184 @@
+"""
+Ranked user search over username, email, names, mobile and bio.
+
+On Postgres, search reads two columns that triggers keep on users_profile
+(see migration 0007):
+
+- `search_vector`, matched with a tsquery of the term's words and ranked
+  with `ts_rank_cd`. Username and email weigh most and bio least. Only the
+  last word also matches as a prefix, as in search-as-you-type:
+  `jane & (exa | exa:*)`. A prefix is read in full from the index, so a
+  common one in every position would cost a scan of its whole posting list.
+  Spelling the word out as well lets the planner use its statistics, and
+  take a short sequential scan for a word in nearly every row.
+- `search_text`, matched with pg_trgm word similarity (`term <% search_text`)
+  so typos and partial words still match. Without the extension, only the
+  tsvector is used.
+
+Both have GIN indexes. Ranking stops at USER_SEARCH_CANDIDATES matches, so a
+term matching half the table still costs a bounded amount of work. The whole
+query runs under USER_SEARCH_TIMEOUT_MS, and a search that runs past it
+raises `SearchTimeout`. At 1M users a search takes a few milliseconds to a
+few tens of them (benchmarks/user_search.py).
+
+Other databases fall back to case-insensitive substring matching, which is
+enough for development and tests.
+
+The admin's `get_search_results` uses `matching_ids()`, so it shares the
+same matching and cap. The cap also tells the planner the match set is
+small. Without it, the planner can misjudge a tsquery as broad and walk
+auth_user in display order, probing every profile.
+"""
+
+import re
+from functools import cache
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from .models import Profile
+from .projection import USER_FIELDS, project
+
+# Mirrors users_search_words() in the migration: runs of letters and digits.
+WORDS = re.compile(r"[^\W_]+")
+
+FALLBACK_FIELDS = (
+    "user__username",
+    "user__email",
+    "user__first_name",
+    "user__last_name",
+    "mobile",
+    "bio",
+)
+
+
+class SearchTimeout(Exception):
+    """The search ran past USER_SEARCH_TIMEOUT_MS."""
+
+
+def tsquery(term: str) -> str:
+    """A tsquery matching every word of `term`, or "" if it has none."""
+    words = WORDS.findall(term.lower())
+    if not words:
+        return ""
+    last = words.pop()
+    return " & ".join([*words, f"({last} | {last}:*)"])
+
+
+@cache
+def has_trigram() -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"
+        )
+        return cursor.fetchone()[0]
+
+
+def _match(term: str):
+    """SQL matching `term` against users_profile, with its params."""
+    clauses, params = [], []
+    query = tsquery(term)
+    if query:
+        clauses.append("search_vector @@ to_tsquery('simple', %s)")
+        params.append(query)
+    if has_trigram():
+        clauses.append("%s <%% search_text")
+        params.append(term.lower())
+    return " OR ".join(clauses), params
+
+
+def _rank(term: str):
+    clauses, params = [], []
+    query = tsquery(term)
+    if query:
+        clauses.append(
+            "ts_rank_cd(users_profile.search_vector, to_tsquery('simple', %s))"
+        )
+        params.append(query)
+    if has_trigram():
+        clauses.append("word_similarity(%s, users_profile.search_text)")
+        params.append(term.lower())
+    return " + ".join(clauses), params
+
+
+def _fallback_match(term: str) -> Q:
+    match = Q()
+    for field in FALLBACK_FIELDS:
+        match |= Q(**{f"{field}__icontains": term})
+    return match
+
+
+def matching_ids(term: str):
+    """Ids of up to USER_SEARCH_CANDIDATES matching profiles, for filtering."""
+    limit = settings.USER_SEARCH_CANDIDATES
+    if connection.vendor != "postgresql":
+        return Profile.objects.filter(_fallback_match(term)).values("id")[:limit]
+    match, params = _match(term)
+    if not match:
+        return Profile.objects.none().values("id")
+    return RawSQL(
+        f"SELECT id FROM users_profile WHERE {match} LIMIT %s", [*params, limit]
+    )
+
+
+def search_profiles(
+    term: str,
+    limit: int,
+    role: str | None = None,
+    fields: tuple[str, ...] = tuple(USER_FIELDS),
+) -> list[dict]:
+    """The `limit` best-ranked profiles matching `term`, as rows of `fields`."""
+    queryset = Profile.objects.all()
+    if role:
+        queryset = queryset.filter(role=role)
+
+    if connection.vendor != "postgresql":
+        exact = Q(user__username__iexact=term) | Q(user__email__iexact=term)
+        queryset = (
+            queryset.filter(_fallback_match(term))
+            .annotate(
+                rank=Case(
+                    When(exact, then=Value(1)),
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+            )
+            .order_by("-rank", "user__username")
+        )
+        return list(project(queryset, fields)[:limit])
+
+    match, params = _match(term)
+    if not match:
+        return []
+    if role:
+        match = f"({match}) AND role = %s"
+        params = [*params, role]
+    candidates = RawSQL(
+        f"SELECT id FROM users_profile WHERE {match} LIMIT %s",
+        [*params, settings.USER_SEARCH_CANDIDATES],
+    )
+    rank, rank_params = _rank(term)
+    queryset = (
+        queryset.filter(id__in=candidates)
+        .annotate(rank=RawSQL(rank, rank_params))
+        .order_by("-rank", "-id")
+    )
+    queryset = project(queryset, fields)[:limit]
+    try:
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # SET takes no parameters; set_config(..., true) is SET LOCAL.
+                # A prepared statement's generic plan would not see how
+                # common the searched words are, so plan each search afresh.
+                cursor.execute(
+                    "SELECT set_config('statement_timeout', %s, true), "
+                    "set_config('plan_cache_mode', 'force_custom_plan', true)",
+                    [f"{settings.USER_SEARCH_TIMEOUT_MS}ms"],
+                )
+            return list(queryset)
+    except OperationalError as exc:
+        if getattr(exc.__cause__, "sqlstate", None) == "57014":  # query_canceled
+            raise SearchTimeout() from exc
+        raise
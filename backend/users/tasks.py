@@ -0,0 +1,22 @@
+from celery import shared_task
+
+from . import outbox
+from .imports import run_import
+
+
+@shared_task
+def import_users(import_id: int):
+    """Process a `UserImport` job uploaded through /auth/users/import."""
+    run_import(import_id)
+
+
+@shared_task
+def relay_outbox():
+    """Deliver pending outbox events; scheduled every OUTBOX_RELAY_INTERVAL."""
+    return outbox.relay()
+
+
+@shared_task
+def purge_outbox():
+    """Delete delivered outbox events older than OUTBOX_RETENTION."""
+    return outbox.purge()
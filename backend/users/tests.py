@@ -1,16 +1,104 @@
+import asyncio
+import csv
+import gzip
+import io
 import json
+import pickle
+import tempfile
+import threading
+import time
+from datetime import UTC, datetime, timedelta
+from decimal import Decimal
+from importlib import import_module
+from pathlib import Path
+from unittest import mock, skipUnless
 
+import brotli
 import jwt
+import redis
+from celery import Celery
+from celery.signals import (
+    after_task_publish,
+    before_task_publish,
+    worker_process_shutdown,
+)
 from django.conf import settings
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from django.test import TestCase
-from ninja.testing import TestClient
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DataError, IntegrityError, connection, transaction
+from django.test import (
+    Client,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from kombu import Connection
+from ninja.responses import NinjaJSONEncoder
+from ninja.testing import TestAsyncClient, TestClient
+from opentelemetry import trace
+from opentelemetry.sdk.trace.sampling import Decision
+from opentelemetry.trace import StatusCode
+from prometheus_client import REGISTRY
 
-from users.api import router
+from app import tracing
+from app.cache import Entry, TieredCache, cached
+from app.metrics import QueueDepthCollector
+from app.openapi import schema_document
+from app.renderers import dumps
+from app.redis import TracedRedis, require_redis
+from app.testing import QueryBudgetMixin
+from app.urls import api
+from users import outbox
+from users.api import (
+    create_account,
+    email_taken,
+    generate_tokens,
+    router,
+    save_profile_changes,
+)
+from users.api_async import router as async_router
+from users.api import check_user_role, login_throttles, require_manager_role
+from users.cache import directory_cache, directory_version, principal_cache
+from users.export import export_rows
+from users.hashing import PasswordHashingPool
+from users.imports import UserImporter
+from users.models import (
+    OutboxEvent,
+    Profile,
+    UserImport,
+    UserImportStatus,
+    UserRole,
+)
+from users.projection import USER_FIELDS
+from users.search import SearchTimeout, has_trigram
+from users.tasks import import_users, relay_outbox
+from users.throttling import limiter
+from users.tokens import authz_epochs, refresh_tokens
+
+
+def share_directory_version(test):
+    """Keep `directory_version` in a dict for `test`, standing in for Redis."""
+    store = {}
+    client = mock.Mock()
+    client.get.side_effect = store.get
+    client.set.side_effect = lambda key, value: store.__setitem__(key, str(value))
+    patcher = mock.patch.object(directory_version, "_redis", return_value=client)
+    patcher.start()
+    test.addCleanup(patcher.stop)
 
 
 class AuthAPITestCase(TestCase):
     def setUp(self):
+        principal_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
         self.client = TestClient(router)
         self.test_user = User.objects.create_user(
             username="testuser",
@@ -58,6 +146,35 @@ class AuthAPITestCase(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn("Email already exists", response.json()["detail"])
 
+    def test_register_conflicts_ignore_case(self):
+        data = {"username": "TESTUSER", "email": "new@example.com", "password": "x"}
+        response = self.client.post("/register", json=data)
+        self.assertEqual(response.json()["detail"], "Username already exists")
+
+        data = {"username": "newuser", "email": "Test@Example.com", "password": "x"}
+        response = self.client.post("/register", json=data)
+        self.assertEqual(response.json()["detail"], "Email already exists")
+
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_register_is_one_insert(self):
+        data = {"username": "single", "email": "single@example.com", "password": "x"}
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post("/register", json=data)
+
+        # No lookups ahead of the INSERT; only the savepoint around it.
+        statements = [query["sql"] for query in queries.captured_queries]
+        self.assertTrue(statements[0].startswith("SAVEPOINT"))
+        self.assertTrue(statements[1].startswith('INSERT INTO "auth_user"'))
+
+    @skipUnless(connection.vendor == "postgresql", "expression indexes on Postgres")
+    def test_email_check_uses_unique_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = email_taken("Test@Example.com").explain()
+
+        self.assertIn("users_auth_user_email_ci_uniq", plan)
+
     def test_login_success(self):
         data = {"username": "testuser", "password": "testpass123"}
         response = self.client.post("/login", json=data)
@@ -155,6 +272,13 @@ class AuthAPITestCase(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn("Email already exists", response.json()["detail"])
 
+        response = self.client.put(
+            "/profile",
+            json={"email": "OTHER@example.com"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        self.assertEqual(response.status_code, 400)
+
     def test_refresh_token_success(self):
         login_data = {"username": "testuser", "password": "testpass123"}
         login_response = self.client.post("/login", json=login_data)
@@ -228,6 +352,9 @@ class AuthAPITestCase(TestCase):
 
 class RoleBasedAccessTestCase(TestCase):
     def setUp(self):
+        principal_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
         self.client = TestClient(router)
 
         self.regular_user = User.objects.create_user(
@@ -261,7 +388,7 @@ class RoleBasedAccessTestCase(TestCase):
             )
             self.assertEqual(response.status_code, 200)
             users_data = response.json()
-            self.assertIsInstance(users_data, list)
+            self.assertIsInstance(users_data["items"], list)
 
         with self.subTest("Regular users should not be able to view all users"):
             login_data = {"username": "regular_user", "password": "regularpass123"}
@@ -283,3 +410,2108 @@ class RoleBasedAccessTestCase(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertIn("regular_user", response.json()["username"])
+
+
+class PrincipalCacheTestCase(TestCase):
+    def setUp(self):
+        share_directory_version(self)
+        principal_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        self.client = TestClient(router)
+        self.user = User.objects.create_user(
+            username="cacheduser", email="cached@example.com", password="cachedpass123"
+        )
+        login_data = {"username": "cacheduser", "password": "cachedpass123"}
+        token = self.client.post("/login", json=login_data).json()["access_token"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def test_repeated_requests_hit_local_cache(self):
+        self.client.get("/user/me", headers=self.headers)
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/user/me", headers=self.headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["username"], "cacheduser")
+        stats = principal_cache.stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 2)
+
+    def test_profile_save_invalidates_principal(self):
+        self.client.get("/user/me", headers=self.headers)
+
+        self.user.profile.bio = "Changed elsewhere"
+        self.user.profile.save()
+
+        response = self.client.get("/user/me", headers=self.headers)
+        self.assertEqual(response.json()["bio"], "Changed elsewhere")
+
+    def test_update_profile_invalidates_principal(self):
+        self.client.get("/profile", headers=self.headers)
+
+        self.client.put("/profile", json={"bio": "New bio"}, headers=self.headers)
+
+        response = self.client.get("/profile", headers=self.headers)
+        self.assertEqual(response.json()["bio"], "New bio")
+
+    def test_login_writes_keep_the_principal(self):
+        self.client.get("/user/me", headers=self.headers)
+        version = directory_version.get()
+        invalidations = principal_cache.stats()["invalidations"]
+
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=["last_login"])
+        self.user.set_password("rehashed123")
+        self.user.save(update_fields=["password"])
+
+        self.assertEqual(principal_cache.stats()["invalidations"], invalidations)
+        self.assertEqual(directory_version.get(), version)
+        with self.assertNumQueries(0):
+            self.client.get("/user/me", headers=self.headers)
+
+        self.user.save(update_fields=["last_login", "email"])
+        self.assertGreater(principal_cache.stats()["invalidations"], invalidations)
+
+    def test_deleted_user_is_rejected(self):
+        self.client.get("/user/me", headers=self.headers)
+
+        self.user.delete()
+
+        response = self.client.get("/user/me", headers=self.headers)
+        self.assertEqual(response.status_code, 401)
+
+
+class TokenClaimsTestCase(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        self.client = TestClient(router)
+        self.manager = User.objects.create_user(
+            username="claims_manager", email="claims@example.com", password="managerpass123"
+        )
+        self.manager.profile.role = UserRole.MANAGER
+        self.manager.profile.save()
+
+    def login(self):
+        login_data = {"username": "claims_manager", "password": "managerpass123"}
+        return self.client.post("/login", json=login_data).json()["access_token"]
+
+    def test_access_token_carries_role_and_epoch(self):
+        payload = jwt.decode(self.login(), settings.SECRET_KEY, algorithms=["HS256"])
+        self.assertEqual(payload["role"], "manager")
+        self.assertEqual(payload["epoch"], authz_epochs.get(self.manager.id))
+
+    def test_manager_auth_needs_no_queries(self):
+        token = self.login()
+
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/cache/stats", headers={"Authorization": f"Bearer {token}"}
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_role_change_rejects_older_tokens(self):
+        token = self.login()
+
+        profile = User.objects.get(id=self.manager.id).profile
+        profile.role = UserRole.DEFAULT_USER
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.save()
+
+        response = self.client.get(
+            "/users", headers={"Authorization": f"Bearer {token}"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+        response = self.client.get(
+            "/user/me", headers={"Authorization": f"Bearer {self.login()}"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["role"], "default_user")
+
+    def test_role_change_bumps_the_epoch_on_commit(self):
+        epoch = authz_epochs.get(self.manager.id)
+        profile = User.objects.get(id=self.manager.id).profile
+        profile.role = UserRole.DEFAULT_USER
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            profile.save()
+            self.assertEqual(authz_epochs.get(self.manager.id), epoch)
+        for callback in callbacks:
+            callback()
+        self.assertGreater(authz_epochs.get(self.manager.id), epoch)
+
+    def test_deleted_user_tokens_are_rejected(self):
+        token = self.login()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.get(id=self.manager.id).delete()
+
+        response = self.client.get(
+            "/cache/stats", headers={"Authorization": f"Bearer {token}"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_unrelated_profile_save_keeps_tokens_valid(self):
+        token = self.login()
+
+        profile = User.objects.get(id=self.manager.id).profile
+        profile.bio = "Still a manager"
+        profile.save()
+
+        response = self.client.get(
+            "/users", headers={"Authorization": f"Bearer {token}"}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_refresh_token_is_not_an_access_token(self):
+        login_data = {"username": "claims_manager", "password": "managerpass123"}
+        refresh = self.client.post("/login", json=login_data).json()["refresh_token"]
+
+        response = self.client.get(
+            "/user/me", headers={"Authorization": f"Bearer {refresh}"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_role_helpers_read_principal_without_queries(self):
+        principal = principal_cache.get(self.manager.id)
+
+        with self.assertNumQueries(0):
+            self.assertTrue(check_user_role(principal, UserRole.MANAGER))
+            self.assertTrue(require_manager_role(principal))
+
+
+class UserDirectoryTestCase(TestCase):
+    def setUp(self):
+        share_directory_version(self)
+        principal_cache.clear()
+        directory_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        self.client = TestClient(router)
+        manager = User.objects.create_user(
+            username="directory_manager",
+            email="boss@example.com",
+            password="managerpass123",
+        )
+        manager.profile.role = UserRole.MANAGER
+        manager.profile.save()
+        for i in range(5):
+            User.objects.create_user(
+                username=f"member{i}", email=f"member{i}@example.org", password="x"
+            )
+        login_data = {"username": "directory_manager", "password": "managerpass123"}
+        token = self.client.post("/login", json=login_data).json()["access_token"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def get_page(self, query=""):
+        response = self.client.get(f"/users?{query}", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_cover_every_user_once(self):
+        seen = []
+        page = self.get_page("limit=2")
+        while True:
+            self.assertLessEqual(len(page["items"]), 2)
+            seen.extend(item["username"] for item in page["items"])
+            if not page["next_cursor"]:
+                break
+            page = self.get_page(f"limit=2&cursor={page['next_cursor']}")
+
+        self.assertEqual(len(seen), 6)
+        self.assertEqual(len(set(seen)), 6)
+
+    def test_filters(self):
+        page = self.get_page("role=manager")
+        self.assertEqual(
+            [item["username"] for item in page["items"]], ["directory_manager"]
+        )
+
+        page = self.get_page("username_prefix=MEMBER")
+        self.assertEqual(len(page["items"]), 5)
+
+        page = self.get_page("email_prefix=boss")
+        self.assertEqual(len(page["items"]), 1)
+
+    def test_limit_is_bounded(self):
+        page = self.get_page("limit=100000")
+        self.assertEqual(len(page["items"]), 6)
+        self.assertIsNone(page["next_cursor"])
+
+    def test_tampered_cursor_is_rejected(self):
+        response = self.client.get("/users?cursor=not-a-cursor", headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Invalid cursor", response.json()["detail"])
+
+    def test_fields_read_only_their_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            page = self.get_page("fields=username,id&limit=2")
+        self.assertEqual(list(page["items"][0]), ["id", "username"])
+        self.assertTrue(page["next_cursor"])
+        self.assertEqual(len(self.get_page("fields=id&limit=2")["items"][0]), 1)
+
+        with CaptureQueriesContext(connection) as role_queries:
+            page = self.get_page("fields=role")
+        self.assertEqual(page["items"][0], {"role": "default_user"})
+
+        pages = [
+            query["sql"]
+            for query in queries.captured_queries + role_queries.captured_queries
+            if "ORDER BY" in query["sql"]
+        ]
+        self.assertEqual(len(pages), 2)
+        self.assertNotIn('"bio"', pages[0])
+        self.assertNotIn("auth_user", pages[1])
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get("/users?fields=id,password", headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["detail"], "Unknown fields: password")
+
+    def test_repeated_page_is_served_from_cache(self):
+        first = self.get_page("limit=3")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_page("limit=3"), first)
+
+        User.objects.create_user(username="aaa_newcomer", password="x")
+        page = self.get_page("limit=3")
+        self.assertEqual(page["items"][0]["username"], "aaa_newcomer")
+
+    def test_pages_are_not_cached_without_a_shared_version(self):
+        with mock.patch.object(directory_version, "_redis", return_value=None):
+            response = self.client.get("/users?limit=3", headers=self.headers)
+            self.assertFalse(response.has_header("ETag"))
+            with self.assertNumQueries(1):
+                response = self.client.get(
+                    "/users?limit=3", headers={**self.headers, "IF_NONE_MATCH": "*"}
+                )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["items"]), 3)
+
+
+class UserSearchTestCase(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        self.client = TestClient(router)
+        manager = User.objects.create_user(
+            username="search_manager", email="boss@example.com", password="x"
+        )
+        manager.profile.role = UserRole.MANAGER
+        manager.profile.save()
+        self.jane = User.objects.create_user(
+            username="jane.doe",
+            email="jane@acme.test",
+            first_name="Jane",
+            last_name="Doe",
+            password="x",
+        )
+        self.jane.profile.bio = "Runs the billing team"
+        self.jane.profile.mobile = "+1 555 0100"
+        self.jane.profile.save()
+        User.objects.create_user(
+            username="janet", email="janet@example.org", first_name="Janet"
+        )
+        token = self.client.post(
+            "/login", json={"username": "search_manager", "password": "x"}
+        ).json()["access_token"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def search(self, query, status=200):
+        response = self.client.get(f"/users/search?{query}", headers=self.headers)
+        self.assertEqual(response.status_code, status)
+        return response.json()
+
+    def usernames(self, query):
+        return [item["username"] for item in self.search(query)["items"]]
+
+    def test_matches_every_searched_field(self):
+        self.assertEqual(self.usernames("q=jane.doe")[0], "jane.doe")
+        self.assertEqual(self.usernames("q=acme"), ["jane.doe"])
+        self.assertEqual(self.usernames("q=billing"), ["jane.doe"])
+        self.assertEqual(self.usernames("q=0100"), ["jane.doe"])
+        self.assertEqual(set(self.usernames("q=jane")), {"jane.doe", "janet"})
+
+    def test_role_and_limit(self):
+        self.assertEqual(self.usernames("q=example&role=manager"), ["search_manager"])
+        self.assertEqual(len(self.usernames("q=jane&limit=1")), 1)
+
+    def test_rejects_short_terms_and_non_managers(self):
+        self.search("q=j", status=400)
+        token = self.client.post(
+            "/login", json={"username": "jane.doe", "password": "x"}
+        ).json()["access_token"]
+        response = self.client.get(
+            "/users/search?q=jane", headers={"Authorization": f"Bearer {token}"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_fields(self):
+        self.assertEqual(
+            self.search("q=billing&fields=username,role")["items"],
+            [{"username": "jane.doe", "role": "default_user"}],
+        )
+        self.search("q=billing&fields=nope", status=400)
+
+    def test_timeout_is_a_503(self):
+        with mock.patch("users.api.search_profiles", side_effect=SearchTimeout):
+            self.search("q=jane", status=503)
+
+    def test_admin_search(self):
+        admin = User.objects.create_superuser("root", "root@example.com", "x")
+        client = Client()
+        client.force_login(admin)
+
+        for url in ("/admin/users/profile/", "/admin/auth/user/"):
+            response = client.get(url, {"q": "billing"})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context["cl"].result_count, 1)
+
+    @skipUnless(connection.vendor == "postgresql", "search columns on Postgres")
+    def test_index_follows_user_updates(self):
+        User.objects.filter(id=self.jane.id).update(last_name="Zimmermann")
+        self.assertEqual(self.usernames("q=zimmer"), ["jane.doe"])
+        self.assertEqual(self.usernames("q=doe"), ["jane.doe"])
+
+        Profile.objects.filter(user=self.jane).update(bio="Platform")
+        self.assertEqual(self.usernames("q=billing"), [])
+
+    @skipUnless(connection.vendor == "postgresql", "search columns on Postgres")
+    def test_typos_match_with_trigrams(self):
+        if not has_trigram():
+            self.skipTest("pg_trgm is not installed")
+        self.assertIn("jane.doe", self.usernames("q=jnae.doe"))
+
+
+class ResponseCompressionTestCase(TestCase):
+    def setUp(self):
+        share_directory_version(self)
+        principal_cache.clear()
+        directory_cache.clear()
+        manager = User.objects.create_user(username="squeezer", password="x")
+        manager.profile.role = UserRole.MANAGER
+        manager.profile.save()
+        for i in range(20):
+            User.objects.create_user(f"packed{i}", f"packed{i}@example.com", "x")
+        token = generate_tokens(manager).access_token
+        self.client = Client(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def get(self, url, **headers):
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_large_json_is_compressed(self):
+        plain = self.get("/api/auth/users")
+        self.assertNotIn("Content-Encoding", plain)
+        self.assertIn("Accept-Encoding", plain["Vary"])
+
+        response = self.get("/api/auth/users", accept_encoding="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(int(response["Content-Length"]), len(response.content))
+        self.assertLess(len(response.content), len(plain.content) / 2)
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+        response = self.get("/api/auth/users", accept_encoding="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+
+        response = self.get("/api/auth/users", accept_encoding="br;q=0, gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+
+    def test_small_responses_and_html_are_left_alone(self):
+        response = self.get("/api/auth/users?fields=id&limit=2", accept_encoding="gzip")
+        self.assertNotIn("Content-Encoding", response)
+
+        admin = User.objects.create_superuser("root", "root@example.com", "x")
+        self.client.force_login(admin)
+        response = self.get("/admin/auth/user/", accept_encoding="gzip")
+        self.assertNotIn("Content-Encoding", response)
+
+    def test_revalidation_matches_compressed_pages(self):
+        response = self.get("/api/auth/users", accept_encoding="gzip")
+        response = self.client.get(
+            "/api/auth/users",
+            headers={"accept_encoding": "gzip", "if_none_match": response["ETag"]},
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_renderer_falls_back_for_unknown_types(self):
+        self.assertEqual(
+            dumps({"amount": Decimal("1.50"), "at": datetime(2025, 1, 2, tzinfo=UTC)}),
+            b'{"amount":"1.50","at":"2025-01-02T00:00:00Z"}',
+        )
+
+
+class AdminChangelistTestCase(TestCase):
+    def setUp(self):
+        admin = User.objects.create_superuser("root", "root@example.com", "x")
+        self.client = Client()
+        self.client.force_login(admin)
+        self.add_users(3)
+
+    def add_users(self, count):
+        start = User.objects.count()
+        for n in range(start, start + count):
+            User.objects.create_user(f"listed{n}", f"listed{n}@example.com", "x")
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        # Session, user, groups (user filter only), count, the page rows and
+        # their profiles or users. Postgres first asks for an estimate of the
+        # count.
+        estimate = connection.vendor == "postgresql"
+        for url, queries in (("/admin/auth/user/", 6), ("/admin/users/profile/", 5)):
+            queries += estimate
+            with self.assertNumQueries(queries):
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.add_users(5)
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertContains(response, "Default User")
+
+    def test_role_filter(self):
+        manager = User.objects.get(username="listed1")
+        manager.profile.role = UserRole.MANAGER
+        manager.profile.save()
+
+        response = self.client.get(
+            "/admin/auth/user/", {"profile__role__exact": "manager"}
+        )
+
+        self.assertEqual(
+            [user.username for user in response.context["cl"].result_list], ["listed1"]
+        )
+
+    @override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=0)
+    def test_large_tables_are_not_counted(self):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE auth_user")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/admin/auth/user/")
+
+        self.assertEqual(response.context["cl"].result_count, User.objects.count())
+        counted = any("COUNT(" in query["sql"] for query in queries.captured_queries)
+        self.assertEqual(counted, connection.vendor != "postgresql")
+
+    def test_user_autocomplete(self):
+        response = self.client.get(
+            "/admin/autocomplete/",
+            {
+                "app_label": "users",
+                "model_name": "profile",
+                "field_name": "user",
+                "term": "listed2",
+            },
+        )
+
+        self.assertEqual(
+            [result["text"] for result in response.json()["results"]], ["listed2"]
+        )
+
+    def test_user_autocomplete_finds_users_without_a_profile(self):
+        orphan = User.objects.create_user("orphan", "orphan@example.com", "x")
+        Profile.objects.filter(user=orphan).delete()
+
+        for term in ("orph", "ORPHAN@EX"):
+            response = self.client.get(
+                "/admin/autocomplete/",
+                {
+                    "app_label": "users",
+                    "model_name": "profile",
+                    "field_name": "user",
+                    "term": term,
+                },
+            )
+            self.assertEqual(
+                [result["text"] for result in response.json()["results"]], ["orphan"]
+            )
+
+
+def dict_redis(store):
+    """A mock Redis client over `store`, with the commands TieredCache uses."""
+
+    def set_(key, value, nx=False, px=None):
+        if nx and key in store:
+            return None
+        store[key] = value if isinstance(value, bytes) else str(value).encode()
+        return True
+
+    def compare_and_delete(keys, args, client=None):
+        if store.get(keys[0]) != args[0].encode():
+            return 0
+        del store[keys[0]]
+        return 1
+
+    client = mock.Mock()
+    client.get.side_effect = store.get
+    client.set.side_effect = set_
+    client.delete.side_effect = lambda key: store.pop(key, None)
+    client.register_script.return_value = compare_and_delete
+    return client
+
+
+class TieredCacheTestCase(TestCase):
+    def setUp(self):
+        self.cache = TieredCache("tests", ttl=60)
+
+    def test_redis_tier_stores_json_and_raw_bytes(self):
+        store = {}
+        with mock.patch("app.cache.get_redis", return_value=dict_redis(store)):
+            self.cache.get_or_set("page", lambda: b'{"items":[]}')
+            self.cache.get_or_set("count", lambda: {"n": 3})
+            self.cache.clear()
+
+            self.assertEqual(self.cache.get_or_set("page", lambda: b""), b'{"items":[]}')
+            self.assertEqual(self.cache.get_or_set("count", lambda: None), {"n": 3})
+            self.assertEqual(self.cache.stats()["remote_hits"], 2)
+
+            # Whatever else sits under a key is never unpickled.
+            evil = Entry("stale", delta=0.0, expires_at=time.time() + 60)
+            store[self.cache.make_key("evil")] = pickle.dumps(evil)
+            self.assertEqual(self.cache.get_or_set("evil", lambda: "fresh"), "fresh")
+
+        self.assertTrue(store[self.cache.make_key("page")].endswith(b'\n{"items":[]}'))
+
+    def test_load_lock_is_released_only_by_its_owner(self):
+        store = {}
+        lock = f"{self.cache.make_key('key')}:lock"
+
+        def loader():
+            # Our lock expired mid-load and another process took it over.
+            store[lock] = b"other"
+            return "value"
+
+        with mock.patch("app.cache.get_redis", return_value=dict_redis(store)):
+            self.cache.get_or_set("key", loader)
+            self.assertEqual(store[lock], b"other")
+
+            # Gave up waiting on the holder and loaded anyway: not ours to release.
+            held = f"{self.cache.make_key('held')}:lock"
+            store[held] = b"holder"
+            with override_settings(CACHE_LOAD_LOCK_TIMEOUT=0.05):
+                self.assertEqual(self.cache.get_or_set("held", lambda: "v"), "v")
+            self.cache.get_or_set("free", lambda: "v")
+
+        self.assertEqual(store[lock], b"other")
+        self.assertEqual(store[held], b"holder")
+        self.assertNotIn(f"{self.cache.make_key('free')}:lock", store)
+
+    def test_concurrent_misses_load_once(self):
+        calls = []
+        barrier = threading.Barrier(50)
+        results = []
+
+        def loader():
+            calls.append(1)
+            time.sleep(0.05)
+            return {"value": 42}
+
+        def worker():
+            barrier.wait()
+            results.append(self.cache.get_or_set("hot", loader))
+
+        threads = [threading.Thread(target=worker) for _ in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"value": 42}] * 50)
+        self.assertEqual(self.cache.stats()["misses"] - self.cache.stats()["coalesced"], 1)
+
+    async def test_concurrent_async_misses_load_once(self):
+        calls = []
+
+        @cached(self.cache, key=lambda name: name)
+        async def load(name):
+            calls.append(name)
+            await asyncio.sleep(0.05)
+            return name.upper()
+
+        results = await asyncio.gather(*(load("hot") for _ in range(50)))
+
+        self.assertEqual(calls, ["hot"])
+        self.assertEqual(set(results), {"HOT"})
+
+    def test_keys_are_versioned(self):
+        self.cache.get_or_set("key", lambda: "v1")
+        bumped = TieredCache("tests", ttl=60, version=2)
+
+        self.assertEqual(bumped.make_key("key"), "tests:v2:key")
+        self.assertEqual(bumped.get_or_set("key", lambda: "v2"), "v2")
+        self.assertEqual(self.cache.get_or_set("key", lambda: "unused"), "v1")
+
+    def test_early_refresh_probability_rises_towards_expiry(self):
+        entry = Entry("value", delta=1.0, expires_at=100.0)
+        with mock.patch("app.cache.random.random", return_value=0.5):
+            self.assertFalse(entry.should_refresh(1.0, now=50.0))
+            self.assertTrue(entry.should_refresh(1.0, now=99.5))
+            self.assertFalse(entry.should_refresh(0.0, now=99.5))
+
+    def test_early_refresh_reloads_before_expiry(self):
+        values = iter(["old", "new"])
+
+        def slow_loader():
+            time.sleep(0.01)
+            return next(values)
+
+        self.cache.get_or_set("key", slow_loader, ttl=5)
+        # A 10ms load with 5s to live refreshes only with a very eager beta.
+        with override_settings(CACHE_EARLY_REFRESH_BETA=1000), mock.patch(
+            "app.cache.random.random", return_value=0.9
+        ):
+            self.assertEqual(self.cache.get_or_set("key", slow_loader), "new")
+        self.assertEqual(self.cache.stats()["early_refreshes"], 1)
+
+    def test_works_while_redis_is_down(self):
+        client = mock.Mock()
+        client.get.side_effect = redis.ConnectionError
+        client.set.side_effect = redis.ConnectionError
+        client.delete.side_effect = redis.ConnectionError
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return "value"
+
+        with mock.patch("app.cache.get_redis", return_value=client):
+            self.assertEqual(self.cache.get_or_set("key", loader), "value")
+            self.assertEqual(self.cache.get_or_set("key", loader), "value")
+            self.cache.delete("key")
+
+        self.assertEqual(len(calls), 1)
+
+
+class UserExportTestCase(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        self.client = TestClient(router)
+        manager = User.objects.create_user(
+            username="export_manager", email="export@example.com", password="managerpass123"
+        )
+        manager.profile.role = UserRole.MANAGER
+        manager.profile.save()
+        for i in range(3):
+            User.objects.create_user(username=f"exported{i}", password="x")
+        login_data = {"username": "export_manager", "password": "managerpass123"}
+        token = self.client.post("/login", json=login_data).json()["access_token"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def test_ndjson_export(self):
+        response = self.client.get("/users/export", headers=self.headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in response.content.decode().splitlines()]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]["username"], "export_manager")
+        self.assertEqual(rows[0]["role"], "manager")
+
+    def test_gzipped_csv_export(self):
+        response = self.client.get(
+            "/users/export?format=csv&gzip=true", headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('filename="users.csv.gz"', response["Content-Disposition"])
+        text = gzip.decompress(response.content).decode()
+        rows = list(csv.DictReader(io.StringIO(text)))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(
+            {row["username"] for row in rows},
+            {"export_manager", "exported0", "exported1", "exported2"},
+        )
+
+    def test_export_pages_by_keyset_without_server_side_cursors(self):
+        streamed = list(export_rows(chunk_size=3))
+
+        with mock.patch.dict(
+            connection.settings_dict, {"DISABLE_SERVER_SIDE_CURSORS": True}
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                paged = list(export_rows(chunk_size=3))
+
+        self.assertEqual(paged, streamed)
+        self.assertEqual([len(chunk) for chunk in paged], [3, 1])
+        self.assertEqual(len(queries), 2)
+        self.assertIn("LIMIT 3", queries[1]["sql"])
+
+    def test_unknown_format(self):
+        response = self.client.get("/users/export?format=xml", headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_default_users_cannot_export(self):
+        login_data = {"username": "exported0", "password": "x"}
+        token = self.client.post("/login", json=login_data).json()["access_token"]
+
+        response = self.client.get(
+            "/users/export", headers={"Authorization": f"Bearer {token}"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class UserImportTestCase(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        self.client = TestClient(router)
+        manager = User.objects.create_user(
+            username="import_manager", email="import@example.com", password="managerpass123"
+        )
+        manager.profile.role = UserRole.MANAGER
+        manager.profile.save()
+        User.objects.create_user(username="taken", email="taken@example.com")
+        login_data = {"username": "import_manager", "password": "managerpass123"}
+        token = self.client.post("/login", json=login_data).json()["access_token"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def upload(self, name, content):
+        upload = SimpleUploadedFile(name, content.encode())
+        with mock.patch.object(import_users, "delay") as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    "/users/import", FILES={"file": upload}, headers=self.headers
+                )
+        return response, delay
+
+    def test_csv_import(self):
+        hashed = make_password("prehashed123")
+        content = (
+            "username,email,password,password_hash,first_name,role\n"
+            "alice,alice@example.com,alicepass123,,Alice,manager\n"
+            f"bob,bob@example.com,,{hashed},Bob,\n"
+            "carol,carol@example.com,,,Carol,\n"
+            "taken,new@example.com,,,,\n"
+            "alice,other@example.com,,,,\n"
+            "dave,dave@example.com,,,,admin\n"
+        )
+        response, delay = self.upload("users.csv", content)
+
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["id"]
+        self.assertEqual(response.json()["status"], "pending")
+        self.assertEqual(response.json()["total"], 6)
+        delay.assert_called_once_with(job_id)
+
+        import_users(job_id)
+
+        job = UserImport.objects.get(id=job_id)
+        self.assertEqual(job.status, UserImportStatus.COMPLETED)
+        self.assertEqual((job.processed, job.created, job.conflict_count), (6, 3, 3))
+        self.assertEqual(job.payload, "")
+        self.assertEqual(
+            [(c["line"], c["reason"]) for c in job.conflicts],
+            [
+                (5, "Username already exists"),
+                (6, "Duplicate in file"),
+                (7, "Unknown role: admin"),
+            ],
+        )
+
+        alice = User.objects.get(username="alice")
+        self.assertTrue(alice.check_password("alicepass123"))
+        self.assertEqual(alice.profile.role, UserRole.MANAGER)
+        self.assertTrue(User.objects.get(username="bob").check_password("prehashed123"))
+        self.assertFalse(User.objects.get(username="carol").has_usable_password())
+
+        response = self.client.get(f"/users/import/{job_id}", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["created"], 3)
+
+    def test_existing_users_match_in_any_case(self):
+        content = (
+            "username,email\n"
+            "TAKEN,fresh@example.com\n"
+            "fresh,Taken@Example.COM\n"
+            "Import_Manager,\n"
+        )
+        response, _ = self.upload("users.csv", content)
+        import_users(response.json()["id"])
+
+        job = UserImport.objects.get(id=response.json()["id"])
+        self.assertEqual(job.created, 0)
+        self.assertEqual(
+            [(c["line"], c["reason"]) for c in job.conflicts],
+            [
+                (2, "Username already exists"),
+                (3, "Email already exists"),
+                (4, "Username already exists"),
+            ],
+        )
+
+    def test_import_publishes_registrations(self):
+        response, _ = self.upload("users.csv", "username,email\nerin,erin@example.com\n")
+        import_users(response.json()["id"])
+
+        erin = User.objects.get(username="erin")
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.topic, outbox.USER_REGISTERED)
+        self.assertEqual(event.dedup_key, f"user.registered:{erin.id}")
+        self.assertEqual(
+            event.payload,
+            {
+                "user_id": erin.id,
+                "username": "erin",
+                "email": "erin@example.com",
+                "import_id": response.json()["id"],
+            },
+        )
+
+    def test_ndjson_import_in_chunks(self):
+        rows = [json.dumps({"username": f"nd{i}"}) for i in range(5)]
+        response, _ = self.upload("users.ndjson", "\n".join(rows + ["not json"]))
+
+        with override_settings(USER_IMPORT_CHUNK_SIZE=2):
+            import_users(response.json()["id"])
+
+        job = UserImport.objects.get(id=response.json()["id"])
+        self.assertEqual((job.processed, job.created, job.conflict_count), (6, 5, 1))
+        self.assertEqual(User.objects.filter(username__startswith="nd").count(), 5)
+        self.assertEqual(job.conflicts[0]["reason"], "Malformed row")
+
+    def test_bad_ndjson_values_become_conflicts(self):
+        rows = [
+            {"username": 123},
+            {"username": "fine", "first_name": 5},
+            {"username": "u" * 151},
+            {"username": "no spaces"},
+            {"username": "longmail", "email": "x" * 250 + "@example.com"},
+            {"username": "badmail", "email": "not-an-email"},
+            {"username": "kept", "email": "kept@example.com"},
+        ]
+        response, _ = self.upload(
+            "users.ndjson", "\n".join(json.dumps(row) for row in rows)
+        )
+        import_users(response.json()["id"])
+
+        job = UserImport.objects.get(id=response.json()["id"])
+        self.assertEqual(job.status, UserImportStatus.COMPLETED)
+        self.assertEqual((job.created, job.conflict_count), (1, 6))
+        self.assertEqual(
+            [(c["line"], c["reason"]) for c in job.conflicts],
+            [
+                (1, "username must be a string"),
+                (2, "first_name must be a string"),
+                (3, "Invalid username"),
+                (4, "Invalid username"),
+                (5, "Invalid email"),
+                (6, "Invalid email"),
+            ],
+        )
+        self.assertEqual(job.conflicts[0]["username"], "123")
+
+    def test_rows_the_database_rejects_become_conflicts(self):
+        bulk_insert = UserImporter.bulk_insert
+
+        def reject_bad(importer, users, rows):
+            if any(user.username == "bad" for user in users):
+                raise DataError("value too long")
+            return bulk_insert(importer, users, rows)
+
+        response, _ = self.upload("users.csv", "username\ngood\nbad\n")
+        with mock.patch.object(UserImporter, "bulk_insert", reject_bad):
+            import_users(response.json()["id"])
+
+        job = UserImport.objects.get(id=response.json()["id"])
+        self.assertEqual(job.status, UserImportStatus.COMPLETED)
+        self.assertEqual(job.created, 1)
+        self.assertEqual(job.conflicts[0]["reason"], "Invalid value")
+
+    def test_failed_import_drops_the_payload(self):
+        response, _ = self.upload("users.csv", "username,password\nx,secret123\n")
+        with mock.patch.object(UserImporter, "run", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                import_users(response.json()["id"])
+
+        job = UserImport.objects.get(id=response.json()["id"])
+        self.assertEqual(job.status, UserImportStatus.FAILED)
+        self.assertEqual(job.error, "boom")
+        self.assertEqual(job.payload, "")
+
+    def test_import_requires_manager_and_known_format(self):
+        upload = SimpleUploadedFile("users.xlsx", b"username\nx\n")
+        response = self.client.post(
+            "/users/import", FILES={"file": upload}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+        self.client.post(
+            "/register",
+            json={"username": "plain", "email": "plain@example.com", "password": "p"},
+        )
+        login_data = {"username": "plain", "password": "p"}
+        token = self.client.post("/login", json=login_data).json()["access_token"]
+        response = self.client.get(
+            "/users/import/1", headers={"Authorization": f"Bearer {token}"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class ProfileWriteTestCase(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        self.client = TestClient(router)
+        self.user = User.objects.create_user(
+            username="writer", email="writer@example.com", password="writerpass123"
+        )
+        login_data = {"username": "writer", "password": "writerpass123"}
+        token = self.client.post("/login", json=login_data).json()["access_token"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.client.get("/profile", headers=self.headers)
+
+    def writes(self, request):
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        statements = [query["sql"].split(" ", 1)[0] for query in queries]
+        return response, [sql for sql in statements if sql in ("INSERT", "UPDATE")]
+
+    def test_save_after_refresh_writes_against_the_reloaded_row(self):
+        profile = Profile.objects.get(user=self.user)
+        Profile.objects.filter(pk=profile.pk).update(bio="changed elsewhere")
+        profile.refresh_from_db()
+        self.assertEqual(profile.dirty_fields, [])
+
+        profile.bio = ""
+        profile.save()
+        profile.refresh_from_db(fields=["bio"])
+        self.assertEqual(profile.bio, "")
+        self.assertEqual(profile.dirty_fields, [])
+
+    def test_user_save_does_not_touch_profile(self):
+        with self.assertNumQueries(1):
+            self.user.save(update_fields=["last_name"])
+
+    def test_login_does_not_write(self):
+        login_data = {"username": "writer", "password": "writerpass123"}
+        _, writes = self.writes(lambda: self.client.post("/login", json=login_data))
+        self.assertEqual(writes, [])
+
+    def test_update_profile_writes_changed_columns_once(self):
+        data = {"first_name": "Wri", "bio": "Hello"}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put("/profile", json=data, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        updates = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 2)
+        self.assertNotIn('"last_name"', updates[0])
+        self.assertIn('"bio"', updates[1])
+        self.assertNotIn('"mobile"', updates[1])
+
+        _, writes = self.writes(
+            lambda: self.client.put("/profile", json=data, headers=self.headers)
+        )
+        self.assertEqual(writes, [])
+
+        _, writes = self.writes(
+            lambda: self.client.put(
+                "/profile", json={"mobile": "555"}, headers=self.headers
+            )
+        )
+        self.assertEqual(writes, ["UPDATE", "INSERT"])
+        self.assertEqual(Profile.objects.get(user=self.user).mobile, "555")
+
+    def test_update_profile_query_count(self):
+        # SAVEPOINT, locking load, UPDATE, outbox INSERT, RELEASE.
+        with self.assertNumQueries(5):
+            self.client.put("/profile", json={"bio": "Hi"}, headers=self.headers)
+
+
+class ConditionalRequestTestCase(TestCase):
+    def setUp(self):
+        share_directory_version(self)
+        principal_cache.clear()
+        directory_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        self.client = TestClient(router)
+        self.user = User.objects.create_user(
+            username="conditional", email="cond@example.com", password="condpass123"
+        )
+        self.user.profile.role = UserRole.MANAGER
+        self.user.profile.save()
+        login_data = {"username": "conditional", "password": "condpass123"}
+        token = self.client.post("/login", json=login_data).json()["access_token"]
+        self.auth = {"Authorization": f"Bearer {token}"}
+
+    # TestClient copies header names into META verbatim, hence IF_NONE_MATCH etc.
+    def get(self, path, **headers):
+        return self.client.get(path, headers={**self.auth, **headers})
+
+    def put(self, data, **headers):
+        return self.client.put("/profile", json=data, headers={**self.auth, **headers})
+
+    def test_profile_revalidates_without_queries(self):
+        response = self.get("/profile")
+        etag = response["ETag"]
+        self.assertTrue(etag.startswith('"'))
+        self.assertTrue(response.has_header("Last-Modified"))
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+
+        with self.assertNumQueries(0):
+            response = self.get("/user/me", IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+        response = self.get(
+            "/profile", IF_MODIFIED_SINCE=self.get("/profile")["Last-Modified"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_produce_a_new_etag(self):
+        etag = self.get("/profile")["ETag"]
+
+        self.put({"first_name": "Con"})
+
+        response = self.get("/profile", IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["first_name"], "Con")
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_put_with_if_match(self):
+        etag = self.get("/profile")["ETag"]
+
+        response = self.put({"bio": "First"}, IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        response = self.put({"bio": "Second"}, IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(Profile.objects.get(user=self.user).bio, "First")
+
+    def test_directory_page_revalidates_until_a_user_changes(self):
+        etag = self.get("/users?limit=10")["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.get("/users?limit=10", IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.get("/users?limit=5", IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        User.objects.create_user(username="newcomer")
+        response = self.get("/users?limit=10", IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["items"]), 2)
+
+
+class RefreshTokenRotationTestCase(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        refresh_tokens.clear()
+        self.client = TestClient(router)
+        User.objects.create_user(username="rotator", password="rotatepass123")
+        login_data = {"username": "rotator", "password": "rotatepass123"}
+        self.tokens = self.client.post("/login", json=login_data).json()
+
+    def refresh(self, token):
+        return self.client.post("/refresh", json={"refresh_token": token})
+
+    def test_refresh_rotates_and_reuse_revokes_the_session(self):
+        first = self.tokens["refresh_token"]
+        response = self.refresh(first)
+        self.assertEqual(response.status_code, 200)
+        second = response.json()["refresh_token"]
+        self.assertNotEqual(second, first)
+
+        self.assertEqual(self.refresh(first).status_code, 401)
+        # The replay revoked the family, so the legitimate successor is dead too.
+        self.assertEqual(self.refresh(second).status_code, 401)
+
+    def test_refresh_does_not_query_the_database(self):
+        self.client.get(
+            "/user/me",
+            headers={"Authorization": f"Bearer {self.tokens['access_token']}"},
+        )
+        with self.assertNumQueries(0):
+            response = self.refresh(self.tokens["refresh_token"])
+        self.assertEqual(response.status_code, 200)
+
+    def test_logout_revokes_refresh_token(self):
+        response = self.client.post(
+            "/logout",
+            headers={"Authorization": f"Bearer {self.tokens['access_token']}"},
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.refresh(self.tokens["refresh_token"]).status_code, 401)
+
+    def test_sessions_are_independent(self):
+        login_data = {"username": "rotator", "password": "rotatepass123"}
+        other = self.client.post("/login", json=login_data).json()
+        self.client.post(
+            "/logout", headers={"Authorization": f"Bearer {other['access_token']}"}
+        )
+
+        self.assertEqual(self.refresh(self.tokens["refresh_token"]).status_code, 200)
+
+    def test_serving_requires_redis(self):
+        # The in-process registry is per worker, so servers refuse to start.
+        with override_settings(REDIS_URL=""), self.assertRaises(ImproperlyConfigured):
+            require_redis()
+        with override_settings(REDIS_URL="redis://localhost:6379/0"):
+            require_redis()
+
+    def test_refresh_token_without_session_is_rejected(self):
+        payload = jwt.decode(
+            self.tokens["refresh_token"], settings.SECRET_KEY, algorithms=["HS256"]
+        )
+        del payload["sid"]
+        legacy = jwt.encode(payload, settings.SECRET_KEY, algorithm="HS256")
+
+        self.assertEqual(self.refresh(legacy).status_code, 401)
+
+
+class RateLimitTestCase(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        self.client = TestClient(router)
+
+    def login(self, username, META=None, **headers):
+        data = {"username": username, "password": "wrongpass123"}
+        kwargs = {"META": META} if META else {}
+        return self.client.post("/login", json=data, headers=headers, **kwargs)
+
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_login_is_limited_per_username(self):
+        limit = login_throttles.throttles[1].num_requests
+        for _ in range(limit):
+            self.assertEqual(self.login("victim").status_code, 401)
+
+        response = self.login("Victim")
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+
+        self.assertEqual(self.login("someone_else").status_code, 401)
+
+    def test_login_is_limited_per_address(self):
+        with mock.patch.object(login_throttles.throttles[0], "num_requests", 2):
+            self.assertEqual(self.login("a").status_code, 401)
+            self.assertEqual(self.login("b").status_code, 401)
+            self.assertEqual(self.login("c").status_code, 429)
+
+            response = self.login("d", X_FORWARDED_FOR="10.0.0.9")
+            self.assertEqual(response.status_code, 429)
+
+    def test_rejected_requests_do_not_fill_the_global_cap(self):
+        address, _, global_cap = login_throttles.throttles
+        with mock.patch.object(address, "num_requests", 2), mock.patch.object(
+            global_cap, "num_requests", 3
+        ):
+            for _ in range(10):
+                self.login("attacker", META={"REMOTE_ADDR": "10.0.0.1"})
+
+            response = self.login("victim", META={"REMOTE_ADDR": "10.0.0.2"})
+            self.assertEqual(response.status_code, 401)
+
+            response = self.login("bystander", META={"REMOTE_ADDR": "10.0.0.3"})
+            self.assertEqual(response.status_code, 429)
+
+    def test_window_slides(self):
+        with mock.patch("users.throttling.time.monotonic", return_value=1000.0):
+            for _ in range(2):
+                self.assertEqual(limiter.hit("scope:key", 2, 60), 0)
+            self.assertEqual(limiter.hit("scope:key", 2, 60), 60)
+        with mock.patch("users.throttling.time.monotonic", return_value=1030.0):
+            self.assertEqual(limiter.hit("scope:key", 2, 60), 30)
+        with mock.patch("users.throttling.time.monotonic", return_value=1060.5):
+            self.assertEqual(limiter.hit("scope:key", 2, 60), 0)
+
+
+class AsyncAuthAPITestCase(TestCase):
+    def setUp(self):
+        share_directory_version(self)
+        principal_cache.clear()
+        directory_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        self.client = TestAsyncClient(async_router)
+        manager = User.objects.create_user(
+            username="async_manager", email="async@example.com", password="managerpass123"
+        )
+        manager.profile.role = UserRole.MANAGER
+        manager.profile.save()
+
+    async def login(self, username="async_manager", password="managerpass123"):
+        response = await self.client.post(
+            "/login", json={"username": username, "password": password}
+        )
+        self.assertEqual(response.status_code, 200)
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def test_register_and_read_profile(self):
+        data = {
+            "username": "async_user",
+            "email": "async_user@example.com",
+            "password": "asyncpass123",
+        }
+        response = await self.client.post("/register", json=data)
+        self.assertEqual(response.status_code, 200)
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        response = await self.client.get("/user/me", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["username"], "async_user")
+
+        response = await self.client.post("/register", json=data)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_update_profile(self):
+        headers = await self.login()
+
+        response = await self.client.put(
+            "/profile", json={"bio": "Async bio"}, headers=headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["bio"], "Async bio")
+
+        response = await self.client.get("/profile", headers=headers)
+        self.assertEqual(response.json()["bio"], "Async bio")
+
+    async def test_conditional_requests(self):
+        headers = await self.login()
+        etag = (await self.client.get("/user/me", headers=headers))["ETag"]
+
+        response = await self.client.get(
+            "/profile", headers={**headers, "IF_NONE_MATCH": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        response = await self.client.put(
+            "/profile", json={"bio": "Late"}, headers={**headers, "IF_MATCH": '"stale"'}
+        )
+        self.assertEqual(response.status_code, 412)
+
+        etag = (await self.client.get("/users", headers=headers))["ETag"]
+        response = await self.client.get(
+            "/users", headers={**headers, "IF_NONE_MATCH": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    async def test_manager_routes(self):
+        headers = await self.login()
+
+        response = await self.client.get("/users", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["items"][0]["username"], "async_manager")
+
+        response = await self.client.get("/users/export", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.content.decode().splitlines()), 1)
+
+    async def test_invalid_token(self):
+        response = await self.client.get(
+            "/user/me", headers={"Authorization": "Bearer invalid_token"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class PasswordHashingTestCase(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        self.client = TestClient(router)
+        self.user = User.objects.create_user(username="hasher", password="hashpass123")
+
+    def login(self):
+        return self.client.post(
+            "/login", json={"username": "hasher", "password": "hashpass123"}
+        )
+
+    def test_saturated_pool_fails_fast(self):
+        pool = PasswordHashingPool(workers=1, queue_size=0, retry_after=7)
+        release = threading.Event()
+        pool.submit(release.wait)
+        try:
+            with mock.patch("users.hashing.hashing_pool", pool):
+                response = self.login()
+                register_response = self.client.post(
+                    "/register",
+                    json={"username": "late", "email": "late@example.com", "password": "x"},
+                )
+        finally:
+            release.set()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "7")
+        self.assertEqual(register_response.status_code, 503)
+        self.assertFalse(User.objects.filter(username="late").exists())
+
+    def test_changed_work_factor_rehashes_on_login(self):
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            self.assertEqual(self.login().status_code, 200)
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$1000$"))
+
+    def test_switching_to_argon2_rehashes_on_login(self):
+        hashers = [
+            "users.hashers.Argon2PasswordHasher",
+            "users.hashers.PBKDF2PasswordHasher",
+        ]
+        with override_settings(
+            PASSWORD_HASHERS=hashers,
+            PASSWORD_ARGON2_MEMORY_COST=1024,
+            PASSWORD_ARGON2_PARALLELISM=1,
+        ):
+            self.assertEqual(self.login().status_code, 200)
+            self.user.refresh_from_db()
+            self.assertTrue(self.user.password.startswith("argon2"))
+            self.assertEqual(self.login().status_code, 200)
+
+    def test_unknown_user_still_rejected(self):
+        response = self.client.post(
+            "/login", json={"username": "nobody", "password": "hashpass123"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    query_budgets = {
+        # The user, then the principal for the tokens.
+        "POST /login": 2,
+        # User, Profile and outbox inserts, then the principal. Writes run in a
+        # savepoint here, which adds SAVEPOINT and RELEASE; in production the
+        # transaction is the outermost one.
+        "POST /register": 6,
+        "POST /refresh": 0,
+        "POST /logout": 0,
+        # A cold principal; /profile then reads it from the cache.
+        "GET /user/me": 1,
+        "GET /profile": 0,
+        # Load with the profile joined, one UPDATE per changed table and the
+        # outbox insert, plus SAVEPOINT and RELEASE.
+        "PUT /profile": 6,
+        "GET /users": 1,
+        "GET /users/import/{id}": 1,
+        "GET /cache/stats": 0,
+    }
+
+    def setUp(self):
+        principal_cache.clear()
+        directory_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        refresh_tokens.clear()
+        self.client = TestClient(router)
+        manager = User.objects.create_user(username="budget", password="budgetpass123")
+        manager.profile.role = UserRole.MANAGER
+        manager.profile.save()
+        principal_cache.clear()
+
+    def login(self):
+        with self.within_budget("POST /login"):
+            response = self.client.post(
+                "/login", json={"username": "budget", "password": "budgetpass123"}
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_auth_endpoints(self):
+        with self.within_budget("POST /register"):
+            response = self.client.post(
+                "/register",
+                json={"username": "newbie", "email": "new@example.com", "password": "x"},
+            )
+        self.assertEqual(response.status_code, 200)
+
+        tokens = self.login()
+        with self.within_budget("POST /refresh"):
+            response = self.client.post(
+                "/refresh", json={"refresh_token": tokens["refresh_token"]}
+            )
+        self.assertEqual(response.status_code, 200)
+
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        with self.within_budget("POST /logout"):
+            self.assertEqual(self.client.post("/logout", headers=headers).status_code, 200)
+
+    def test_register_fits_its_production_budget(self):
+        budget, _ = settings.QUERY_BUDGETS["POST /api/auth/register"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/register",
+                json={"username": "newbie", "email": "new@example.com", "password": "x"},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Profile.objects.filter(user__username="newbie").exists())
+        # Only the test's own transaction makes register's atomic a savepoint.
+        statements = [
+            query["sql"]
+            for query in queries.captured_queries
+            if not query["sql"].startswith(("SAVEPOINT", "RELEASE SAVEPOINT"))
+        ]
+        self.assertLessEqual(len(statements), budget)
+
+    def test_profile_endpoints(self):
+        headers = {"Authorization": f"Bearer {self.login()['access_token']}"}
+        principal_cache.clear()
+
+        for endpoint in ("GET /user/me", "GET /profile"):
+            path = endpoint.split()[1]
+            with self.within_budget(endpoint):
+                self.assertEqual(self.client.get(path, headers=headers).status_code, 200)
+
+        with self.within_budget("PUT /profile"):
+            response = self.client.put(
+                "/profile", json={"bio": "Budgeted", "first_name": "B"}, headers=headers
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_manager_endpoints(self):
+        headers = {"Authorization": f"Bearer {self.login()['access_token']}"}
+        job = UserImport.objects.create(format="csv", payload="")
+        for i in range(20):
+            User.objects.create_user(username=f"listed{i}", password="x")
+
+        with self.within_budget("GET /users"):
+            self.assertEqual(self.client.get("/users", headers=headers).status_code, 200)
+        with self.within_budget("GET /users/import/{id}"):
+            response = self.client.get(f"/users/import/{job.id}", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        with self.within_budget("GET /cache/stats"):
+            response = self.client.get("/cache/stats", headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(
+        QUERY_BUDGETS={"GET /api/auth/user/me": (0, None)}, SERVER_TIMING=True
+    )
+    def test_middleware_reports_and_logs_over_budget(self):
+        token = self.login()["access_token"]
+        principal_cache.clear()
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+        with self.assertLogs("app.query_budget", "WARNING") as logs:
+            response = client.get("/api/auth/user/me")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(
+            response["Server-Timing"], r'^db;dur=[\d.]+;desc="1 queries", app;dur=[\d.]+$'
+        )
+        self.assertIn("GET /api/auth/user/me over query budget: 1 queries", logs.output[0])
+
+        with self.assertNoLogs("app.query_budget", "WARNING"):
+            response = client.get("/api/auth/user/me")
+        self.assertIn('desc="0 queries"', response["Server-Timing"])
+
+    @override_settings(SERVER_TIMING=False)
+    def test_server_timing_can_be_turned_off(self):
+        token = self.login()["access_token"]
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+        response = client.get("/api/auth/user/me")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Server-Timing"))
+
+
+class OpenAPISchemaTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "openapi.json"
+        settings_override = override_settings(OPENAPI_SCHEMA_FILE=str(self.path))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        schema_document.cache_clear()
+        self.addCleanup(schema_document.cache_clear)
+
+    def test_build_openapi_writes_the_schema(self):
+        call_command("build_openapi", stdout=io.StringIO())
+
+        # Same document ninja's own view would have served.
+        schema = json.loads(self.path.read_bytes())
+        expected = json.dumps(api.get_openapi_schema(), cls=NinjaJSONEncoder)
+        self.assertEqual(schema, json.loads(expected))
+        self.assertIn("/api/auth/users", schema["paths"])
+
+    def test_directory_items_document_sparse_fieldsets(self):
+        schemas = api.get_openapi_schema()["components"]["schemas"]
+
+        # `fields=` may leave out any key, so list items require none.
+        for name in ("UserPageSchema", "UserSearchSchema"):
+            items = schemas[name]["properties"]["items"]["items"]
+            self.assertEqual(items["$ref"], "#/components/schemas/UserItemSchema")
+        self.assertNotIn("required", schemas["UserItemSchema"])
+        self.assertEqual(
+            list(schemas["UserItemSchema"]["properties"]), list(USER_FIELDS)
+        )
+
+    def test_prebuilt_schema_is_served_with_validators(self):
+        self.path.write_bytes(b'{"openapi": "prebuilt"}')
+
+        with mock.patch.object(api, "get_openapi_schema") as generate:
+            response = self.client.get("/api/openapi.json")
+        generate.assert_not_called()
+        self.assertEqual(response.content, b'{"openapi": "prebuilt"}')
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response["Cache-Control"], "public, max-age=86400")
+
+        response = self.client.get(
+            "/api/openapi.json", headers={"if_none_match": response["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_schema_is_generated_once_without_a_file(self):
+        with mock.patch.object(
+            api, "get_openapi_schema", wraps=api.get_openapi_schema
+        ) as generate:
+            first = self.client.get("/api/openapi.json")
+            second = self.client.get("/api/openapi.json")
+
+        generate.assert_called_once()
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first["ETag"], second["ETag"])
+        self.assertIn("/api/auth/login", first.json()["paths"])
+        self.assertFalse(self.path.exists())
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        self.client = TestClient(router)
+        User.objects.create_user(username="measured", password="measuredpass123")
+        login_data = {"username": "measured", "password": "measuredpass123"}
+        self.token = self.client.post("/login", json=login_data).json()["access_token"]
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    def test_requests_are_timed_per_route(self):
+        labels = {"method": "GET", "route": "/api/auth/user/me", "status": "200"}
+        before = self.sample("http_request_duration_seconds_count", **labels)
+
+        response = Client().get(
+            "/api/auth/user/me", HTTP_AUTHORIZATION=f"Bearer {self.token}"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.sample("http_request_duration_seconds_count", **labels), before + 1
+        )
+        body = Client().get("/metrics").content.decode()
+        self.assertIn('http_request_duration_seconds_bucket{le="0.005"', body)
+        self.assertIn("http_requests_in_flight", body)
+
+    def test_auth_outcomes(self):
+        outcomes = ("success", "invalid", "role_denied")
+        before = {o: self.sample("auth_outcomes_total", outcome=o) for o in outcomes}
+        headers = {"Authorization": f"Bearer {self.token}"}
+
+        self.client.get("/user/me", headers=headers)
+        self.client.get("/user/me", headers={"Authorization": "Bearer invalid_token"})
+        self.client.get("/users", headers=headers)
+
+        for outcome in outcomes:
+            self.assertEqual(
+                self.sample("auth_outcomes_total", outcome=outcome), before[outcome] + 1
+            )
+
+    def test_cache_lookups(self):
+        labels = {"cache": "principal", "result": "hit"}
+        before = self.sample("cache_lookups_total", **labels)
+        headers = {"Authorization": f"Bearer {self.token}"}
+
+        self.client.get("/user/me", headers=headers)
+
+        self.assertEqual(self.sample("cache_lookups_total", **labels), before + 1)
+
+    def test_task_metrics(self):
+        labels = {"task": "users.tasks.import_users"}
+        before = {
+            name: self.sample(name, **labels)
+            for name in (
+                "celery_task_runtime_seconds_count",
+                "celery_task_queue_wait_seconds_sum",
+                "celery_task_failures_total",
+            )
+        }
+
+        import_users.apply(
+            args=[0], headers={"published_at": time.time() - 2}, throw=False
+        )
+
+        self.assertEqual(
+            self.sample("celery_task_runtime_seconds_count", **labels),
+            before["celery_task_runtime_seconds_count"] + 1,
+        )
+        self.assertGreaterEqual(
+            self.sample("celery_task_queue_wait_seconds_sum", **labels),
+            before["celery_task_queue_wait_seconds_sum"] + 2,
+        )
+        self.assertEqual(
+            self.sample("celery_task_failures_total", **labels),
+            before["celery_task_failures_total"] + 1,
+        )
+
+    def test_worker_memory(self):
+        exits = self.sample("celery_worker_process_exits_total")
+        at_exit = self.sample("celery_worker_rss_at_exit_bytes_count")
+
+        import_users.apply(args=[0], throw=False)
+        worker_process_shutdown.send(sender=None, pid=None, exitcode=0)
+
+        self.assertGreater(self.sample("celery_worker_rss_bytes"), 0)
+        self.assertEqual(self.sample("celery_worker_process_exits_total"), exits + 1)
+        self.assertEqual(
+            self.sample("celery_worker_rss_at_exit_bytes_count"), at_exit + 1
+        )
+
+    def test_queue_depth(self):
+        app = Celery("depth", broker="memory://")
+        app.conf.task_queues = {"busy": {}, "idle": {}}
+        for _ in range(3):
+            app.send_task("users.tasks.import_users", args=[0], queue="busy")
+
+        (family,) = QueueDepthCollector(app).collect()
+
+        depths = {sample.labels["queue"]: sample.value for sample in family.samples}
+        self.assertEqual(depths, {"busy": 3, "idle": 0, "celery": 0})
+
+    @override_settings(METRICS_TOKEN="scrape-secret")
+    def test_metrics_token(self):
+        self.assertEqual(Client().get("/metrics").status_code, 403)
+        response = Client().get(
+            "/metrics", HTTP_AUTHORIZATION="Bearer scrape-secret"
+        )
+        self.assertEqual(response.status_code, 200)
+        response = Client().get(
+            "/metrics", HTTP_AUTHORIZATION="Bearer scrape-secreT"
+        )
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN="", METRICS_PUBLIC=False)
+    def test_metrics_need_a_token_unless_public(self):
+        self.assertEqual(Client().get("/metrics").status_code, 403)
+        with override_settings(METRICS_PUBLIC=True):
+            self.assertEqual(Client().get("/metrics").status_code, 200)
+
+
+class TracingTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.exporter = tracing.configure(exporter="memory", sample_ratio=1.0)
+
+    def setUp(self):
+        principal_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        self.exporter.clear()
+
+    def spans(self):
+        return {span.name: span for span in self.exporter.get_finished_spans()}
+
+    def register(self, **extra):
+        return Client().post(
+            "/api/auth/register",
+            data=json.dumps({"username": "traced", "email": "t@example.com", "password": "x"}),
+            content_type="application/json",
+            **extra,
+        )
+
+    def test_request_spans_cover_the_work(self):
+        self.assertEqual(self.register().status_code, 200)
+
+        spans = self.spans()
+        server = spans["POST /api/auth/register"]
+        self.assertEqual(server.attributes["ninja.operation"], "register_user")
+        self.assertEqual(server.attributes["http.response.status_code"], 200)
+        for name in ("password.hash", "jwt.encode", "signal create_user_profile"):
+            self.assertIn(name, spans)
+        self.assertIn("db INSERT", spans)
+        self.assertEqual(
+            {span.context.trace_id for span in spans.values()}, {server.context.trace_id}
+        )
+
+    def test_incoming_traceparent_is_continued(self):
+        trace_id, span_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+        self.register(HTTP_TRACEPARENT=f"00-{trace_id}-{span_id}-01")
+
+        server = self.spans()["POST /api/auth/register"]
+        self.assertEqual(server.context.trace_id, int(trace_id, 16))
+        self.assertEqual(server.parent.span_id, int(span_id, 16))
+
+    def test_task_joins_the_publishers_trace(self):
+        headers = {"id": "traced-task"}
+        with tracing.tracer.start_as_current_span("request") as request_span:
+            before_task_publish.send(
+                sender="users.tasks.import_users", headers=headers, body=None
+            )
+            after_task_publish.send(
+                sender="users.tasks.import_users", headers=headers, body=None
+            )
+        self.assertIn("traceparent", headers)
+
+        import_users.apply(args=[0], headers=headers, throw=False)
+
+        spans = self.spans()
+        publish = spans["celery.publish users.tasks.import_users"]
+        run = spans["celery.run users.tasks.import_users"]
+        self.assertEqual(publish.parent.span_id, request_span.get_span_context().span_id)
+        self.assertEqual(run.parent.span_id, publish.context.span_id)
+        self.assertEqual(run.context.trace_id, request_span.get_span_context().trace_id)
+        self.assertEqual(run.status.status_code, StatusCode.ERROR)
+
+    def test_redis_commands_are_traced(self):
+        client = TracedRedis.from_url("redis://127.0.0.1:1/0", socket_connect_timeout=0.1)
+        with self.assertRaises(redis.ConnectionError):
+            client.get("key")
+
+        self.assertEqual(self.spans()["redis GET"].status.status_code, StatusCode.ERROR)
+
+    def test_head_sampling_follows_the_parent(self):
+        sampler = tracing.build_sampler(0.0)
+        trace_id = int("4bf92f3577b34da6a3ce929d0e0e4736", 16)
+        self.assertEqual(
+            sampler.should_sample(None, trace_id, "root").decision, Decision.DROP
+        )
+
+        parent = trace.NonRecordingSpan(
+            trace.SpanContext(
+                trace_id,
+                int("00f067aa0ba902b7", 16),
+                is_remote=True,
+                trace_flags=trace.TraceFlags(trace.TraceFlags.SAMPLED),
+            )
+        )
+        decision = sampler.should_sample(
+            trace.set_span_in_context(parent), trace_id, "child"
+        ).decision
+        self.assertEqual(decision, Decision.RECORD_AND_SAMPLE)
+
+
+class OutboxTestCase(TestCase):
+    def setUp(self):
+        principal_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        self.client = TestClient(router)
+        self.delivered = []
+
+    def handle(self, event):
+        self.delivered.append((event.topic, event.payload, event.dedup_key))
+
+    def register(self, username="outboxer"):
+        data = {"username": username, "email": f"{username}@example.com", "password": "x"}
+        response = self.client.post("/register", json=data)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_register_records_event_with_the_user(self):
+        self.register()
+        user = User.objects.get(username="outboxer")
+
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.topic, outbox.USER_REGISTERED)
+        self.assertEqual(event.payload["user_id"], user.id)
+        self.assertEqual(event.dedup_key, f"user.registered:{user.id}")
+        self.assertIsNone(event.processed_at)
+
+    def test_rolled_back_registration_leaves_no_event(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            create_account("ghost", "ghost@example.com", "x")
+            raise RuntimeError
+
+        self.assertFalse(User.objects.filter(username="ghost").exists())
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_update_profile_records_changed_fields(self):
+        tokens = self.register()
+        headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+        OutboxEvent.objects.all().delete()
+
+        data = {"first_name": "Out", "bio": "Hello"}
+        self.client.put("/profile", json=data, headers=headers)
+        self.client.put("/profile", json=data, headers=headers)
+
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.topic, outbox.PROFILE_UPDATED)
+        self.assertEqual(event.payload["fields"], ["first_name", "bio"])
+
+    def test_duplicate_keys_are_dropped(self):
+        outbox.publish("test.topic", {"n": 1}, key="same")
+        outbox.publish("test.topic", {"n": 2}, key="same")
+
+        self.assertEqual(OutboxEvent.objects.get().payload, {"n": 1})
+
+    def test_relay_delivers_in_batches(self):
+        for n in range(5):
+            outbox.publish("test.topic", {"n": n}, key=str(n))
+
+        with mock.patch.dict(outbox._handlers, {"test.topic": [self.handle]}):
+            self.assertEqual(outbox.relay(batch_size=2), 5)
+            self.assertEqual(outbox.relay(batch_size=2), 0)
+
+        self.assertEqual([payload["n"] for _, payload, _ in self.delivered], [0, 1, 2, 3, 4])
+        self.assertFalse(OutboxEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_relay_task_claims_pending_events(self):
+        outbox.publish("test.topic", {}, key="task")
+        self.assertEqual(relay_outbox.apply().get(), 1)
+        self.assertEqual(relay_outbox.apply().get(), 0)
+
+    @override_settings(OUTBOX_RETRY_BASE=5, OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_event_is_retried_with_backoff(self):
+        def fail(event):
+            Profile.objects.update(bio="partial")
+            raise ValueError("downstream down")
+
+        self.register()
+        outbox.publish("test.topic", {}, key="ok")
+        handlers = {outbox.USER_REGISTERED: [fail], "test.topic": [self.handle]}
+        with mock.patch.dict(outbox._handlers, handlers), self.assertLogs(
+            "users.outbox", "WARNING"
+        ):
+            self.assertEqual(outbox.relay(), 2)
+
+        failed = OutboxEvent.objects.get(topic=outbox.USER_REGISTERED)
+        self.assertIsNone(failed.processed_at)
+        self.assertEqual(failed.attempts, 1)
+        self.assertEqual(failed.last_error, "ValueError: downstream down")
+        self.assertGreater(failed.available_at, timezone.now())
+        # The failing handler's writes were rolled back; the other event went out.
+        self.assertFalse(Profile.objects.filter(bio="partial").exists())
+        self.assertEqual(len(self.delivered), 1)
+
+        with mock.patch.dict(outbox._handlers, handlers), self.assertLogs(
+            "users.outbox", "ERROR"
+        ):
+            self.assertEqual(outbox.relay(), 0)
+            OutboxEvent.objects.filter(pk=failed.pk).update(available_at=timezone.now())
+            self.assertEqual(outbox.relay(), 1)
+            # Out of attempts: the event is left for inspection.
+            OutboxEvent.objects.filter(pk=failed.pk).update(available_at=timezone.now())
+            self.assertEqual(outbox.relay(), 0)
+        self.assertEqual(OutboxEvent.objects.get(pk=failed.pk).attempts, 2)
+
+    def test_purge_keeps_recent_and_pending_events(self):
+        outbox.publish("test.topic", {}, key="old")
+        outbox.publish("test.topic", {}, key="new")
+        outbox.publish("test.topic", {}, key="pending")
+        OutboxEvent.objects.filter(key="old").update(
+            processed_at=timezone.now() - timedelta(days=30)
+        )
+        OutboxEvent.objects.filter(key="new").update(processed_at=timezone.now())
+
+        self.assertEqual(outbox.purge(), 1)
+        self.assertEqual(
+            sorted(OutboxEvent.objects.values_list("key", flat=True)), ["new", "pending"]
+        )
+
+
+@skipUnlessDBFeature("has_select_for_update")
+class ProfileConcurrencyTestCase(TransactionTestCase):
+    def setUp(self):
+        principal_cache.clear()
+        authz_epochs.clear()
+        limiter.clear()
+        self.client = TestClient(router)
+        User.objects.create_user(username="racer", password="racerpass123")
+        login_data = {"username": "racer", "password": "racerpass123"}
+        token = self.client.post("/login", json=login_data).json()["access_token"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def test_concurrent_puts_with_one_etag_let_only_one_through(self):
+        etag = self.client.get("/profile", headers=self.headers)["ETag"]
+        locked = threading.Event()
+        release = threading.Event()
+        save = save_profile_changes
+        statuses = []
+
+        def slow_save(*args):
+            if not locked.is_set():
+                locked.set()
+                release.wait(5)
+            save(*args)
+
+        def put(bio):
+            try:
+                response = self.client.put(
+                    "/profile",
+                    json={"bio": bio},
+                    headers={**self.headers, "IF_MATCH": etag},
+                )
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        with mock.patch("users.api.save_profile_changes", slow_save):
+            first = threading.Thread(target=put, args=("First",))
+            first.start()
+            locked.wait(5)
+            # The second PUT waits on the first one's row lock.
+            second = threading.Thread(target=put, args=("Second",))
+            second.start()
+            second.join(0.5)
+            release.set()
+            first.join()
+            second.join()
+
+        self.assertEqual(statuses, [200, 412])
+        self.assertEqual(Profile.objects.get(user__username="racer").bio, "First")
+
+
+@skipUnless(connection.vendor == "postgresql", "concurrent index builds on Postgres")
+class UniqueIndexMigrationTestCase(TransactionTestCase):
+    migration = import_module("users.migrations.0006_auth_user_unique_ci")
+    index = "users_auth_user_username_ci_uniq"
+
+    def setUp(self):
+        self.addCleanup(self.rebuild)
+        self.execute(f"DROP INDEX IF EXISTS {self.index}")
+        User.objects.create_user(username="Twin")
+        User.objects.create_user(username="TWIN")
+
+    def execute(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+
+    def rebuild(self):
+        User.objects.filter(username="TWIN").delete()
+        with connection.schema_editor(atomic=False) as editor:
+            self.migration.create_auth_user_unique_indexes(None, editor)
+
+    def index_is_valid(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)",
+                [self.index],
+            )
+            return cursor.fetchone()[0]
+
+    def test_case_duplicates_stop_the_migration(self):
+        with self.assertRaisesMessage(RuntimeError, "'TWIN' x2"):
+            with connection.schema_editor(atomic=False) as editor:
+                self.migration.create_auth_user_unique_indexes(None, editor)
+
+    def test_invalid_index_from_a_failed_build_is_rebuilt(self):
+        with self.assertRaises(IntegrityError):
+            self.execute(
+                f"CREATE UNIQUE INDEX CONCURRENTLY {self.index} "
+                "ON auth_user (UPPER(username::text))"
+            )
+        self.assertFalse(self.index_is_valid())
+
+        self.rebuild()
+        self.assertTrue(self.index_is_valid())
+
+
+@skipUnlessDBFeature("has_select_for_update_skip_locked")
+class OutboxConcurrencyTestCase(TransactionTestCase):
+    def test_concurrent_relays_skip_locked_rows(self):
+        for n in range(4):
+            outbox.publish("test.topic", {"n": n}, key=str(n))
+        claimed = threading.Event()
+        release = threading.Event()
+
+        def slow(event):
+            claimed.set()
+            release.wait(5)
+
+        def run():
+            try:
+                outbox.relay_batch(batch_size=2)
+            finally:
+                connection.close()
+
+        with mock.patch.dict(outbox._handlers, {"test.topic": [slow]}):
+            first = threading.Thread(target=run)
+            first.start()
+            claimed.wait(5)
+            # The first relay holds rows 0 and 1; this one takes the rest.
+            with mock.patch.dict(outbox._handlers, {"test.topic": []}):
+                self.assertEqual(outbox.relay_batch(batch_size=4), 2)
+            release.set()
+            first.join()
+
+        self.assertFalse(OutboxEvent.objects.filter(processed_at__isnull=True).exists())
+
+
+@skipUnless(connection.vendor == "postgresql", "pgbroker needs Postgres")
+class PostgresBrokerTestCase(SimpleTestCase):
+    def connect(self, **options):
+        broker = Connection("pgbroker://", transport_options=options)
+        self.addCleanup(broker.release)
+        return broker
+
+    def queue(self, broker, name=None):
+        queue = broker.SimpleQueue(name or self._testMethodName)
+        self.addCleanup(queue.close)
+        return queue
+
+    def setUp(self):
+        self.queue(self.connect()).clear()
+
+    def test_ack_removes_the_message(self):
+        queue = self.queue(self.connect())
+        queue.put({"n": 1})
+
+        message = queue.get(timeout=1)
+        self.assertEqual(message.payload, {"n": 1})
+        self.assertEqual(queue.qsize(), 1)
+        message.ack()
+        self.assertEqual(queue.qsize(), 0)
+
+    def test_unacked_message_returns_when_the_consumer_closes(self):
+        consumer = self.connect()
+        queue = consumer.SimpleQueue(self._testMethodName)
+        queue.put({"n": 1})
+        queue.get(timeout=1)
+        with mock.patch("sys.stderr"):  # "Restoring 1 unacknowledged message(s)"
+            queue.close()
+            consumer.release()
+
+        message = self.queue(self.connect()).get(timeout=1)
+        self.assertEqual(message.payload, {"n": 1})
+        self.assertTrue(message.delivery_info["redelivered"])
+        message.ack()
+
+    def test_claimed_messages_are_skipped_until_the_visibility_timeout(self):
+        first = self.queue(self.connect(visibility_timeout=0.5, batch_size=1))
+        second = self.queue(self.connect(polling_interval=0.1))
+        first.put({"n": 1})
+        first.put({"n": 2})
+
+        claimed = first.get(timeout=1)
+        self.assertEqual(claimed.payload, {"n": 1})
+        second.get(timeout=1).ack()
+        # Not acked within the visibility timeout, so it comes back.
+        redelivered = second.get(timeout=2)
+        self.assertEqual(redelivered.payload, {"n": 1})
+        self.assertTrue(redelivered.delivery_info["redelivered"])
+        redelivered.ack()
+        claimed.ack()
+        self.assertEqual(second.qsize(), 0)
+
+    def test_publish_wakes_an_idle_consumer(self):
+        queue = self.queue(self.connect(polling_interval=30))
+        publisher = self.queue(self.connect())
+        timer = threading.Timer(0.2, publisher.put, args=({"n": 1},))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        started = time.monotonic()
+        message = queue.get(timeout=5)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(message.payload, {"n": 1})
+        message.ack()
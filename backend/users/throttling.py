@@ -0,0 +1,225 @@
+"""
+Sliding-window rate limits for the auth endpoints.
+
+Each throttle keeps a log of recent hits per key in a Redis sorted set and
+admits a request only while fewer than `rate` hits fall inside the window.
+Trimming, counting and recording run in one Lua script, so every check costs
+one round trip. `CombinedThrottle` checks several throttles in the same
+script and records the hit only when all of them admit the request. Without
+REDIS_URL the same algorithm runs in process memory, which is what the tests
+use. If Redis is unreachable, requests are admitted rather than failing every
+login.
+
+Throttles are attached per operation in `users/api.py`, e.g.
+
+    @router.post("/login", throttle=CombinedThrottle(IPThrottle("login_ip"), ...))
+
+and rates come from NINJA_DEFAULT_THROTTLE_RATES keyed by scope. Rejected
+requests get ninja's 429 response with a Retry-After header.
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+
+import redis
+from ninja.throttling import BaseThrottle, SimpleRateThrottle
+
+from app.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+# KEYS: hit logs; ARGV: now (ms), member, then window (ms) and limit per key
+# Returns 0 when every limit admits the request, and records it under each
+# key. Otherwise returns the milliseconds until all of them have a free slot
+# and records nothing.
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local window = tonumber(ARGV[2 * i + 1])
+    redis.call("ZREMRANGEBYSCORE", key, "-inf", now - window)
+    if redis.call("ZCARD", key) >= tonumber(ARGV[2 * i + 2]) then
+        local oldest = redis.call("ZRANGE", key, 0, 0, "WITHSCORES")
+        wait = math.max(wait, 1, tonumber(oldest[2]) + window - now)
+    end
+end
+if wait > 0 then
+    return wait
+end
+for i, key in ipairs(KEYS) do
+    redis.call("ZADD", key, now, ARGV[2])
+    redis.call("PEXPIRE", key, ARGV[2 * i + 1])
+end
+return 0
+"""
+
+
+class SlidingWindowLimiter:
+    """Per-key sliding-log limiter backed by Redis or process memory."""
+
+    key_prefix = "users:throttle:"
+
+    def __init__(self):
+        self._local = {}
+        self._lock = threading.Lock()
+        self._script = None
+
+    def hit(self, key: str, limit: int, window: float) -> float:
+        """Record a hit for `key`; returns 0, or seconds to wait if over `limit`."""
+        return self.hit_all([(key, limit, window)])
+
+    def hit_all(self, limits) -> float:
+        """Record a hit under every `(key, limit, window)` if all of them admit it.
+
+        Returns 0, or the seconds until every limit has room. A rejected
+        request is not counted under any key.
+        """
+        client = get_redis()
+        if client is None:
+            return self._hit_local(limits)
+        if self._script is None:
+            self._script = client.register_script(SLIDING_WINDOW_SCRIPT)
+        now = int(time.time() * 1000)
+        args = [now, f"{now}:{uuid.uuid4().hex}"]
+        for _, limit, window in limits:
+            args += [int(window * 1000), limit]
+        try:
+            wait_ms = self._script(
+                keys=[f"{self.key_prefix}{key}" for key, _, _ in limits],
+                args=args,
+                client=client,
+            )
+        except redis.RedisError:
+            logger.warning("Rate limit check failed for %s; admitting", limits[0][0])
+            return 0.0
+        return int(wait_ms) / 1000
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+    def _hit_local(self, limits):
+        now = time.monotonic()
+        wait = 0.0
+        with self._lock:
+            logs = []
+            for key, limit, window in limits:
+                hits = self._local.setdefault(key, deque())
+                while hits and hits[0] <= now - window:
+                    hits.popleft()
+                if len(hits) >= limit:
+                    wait = max(wait, hits[0] + window - now)
+                logs.append(hits)
+            if wait:
+                return wait
+            for hits in logs:
+                hits.append(now)
+            return 0.0
+
+
+limiter = SlidingWindowLimiter()
+
+# Throttle instances are shared by every request to an operation, so the wait
+# for the request being checked is kept per thread / task.
+_wait = ContextVar("throttle_wait", default=None)
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """Base class: subclasses derive the key a request is counted under."""
+
+    def __init__(self, scope: str, rate: str = None):
+        self.scope = scope
+        super().__init__(rate)
+
+    def get_ident_key(self, request):
+        raise NotImplementedError(".get_ident_key() must be overridden")
+
+    def get_cache_key(self, request):
+        ident = self.get_ident_key(request)
+        if ident is None:
+            return None
+        return f"{self.scope}:{ident}"
+
+    def get_limit(self, request):
+        """`(key, limit, window)` this request is counted under, or None."""
+        if self.num_requests is None:
+            return None
+        key = self.get_cache_key(request)
+        if key is None:
+            return None
+        return key, self.num_requests, self.duration
+
+    def allow_request(self, request):
+        return check_throttles(request, [self])
+
+    def wait(self):
+        return _wait.get()
+
+
+class CombinedThrottle(BaseThrottle):
+    """Admits a request only when every one of `throttles` does.
+
+    Ninja asks each throttle of an operation in turn, and each would record
+    its own hit, so a request turned away by one still filled the others'
+    windows: one client over its address limit could use up a global cap for
+    everyone. Combined throttles are checked in one script call, and only an
+    admitted request is counted.
+    """
+
+    def __init__(self, *throttles: SlidingWindowThrottle):
+        self.throttles = throttles
+
+    def allow_request(self, request):
+        return check_throttles(request, self.throttles)
+
+    def wait(self):
+        return _wait.get()
+
+
+def check_throttles(request, throttles) -> bool:
+    """Admit `request` if every throttle has room, counting it under each."""
+    _wait.set(None)
+    limits = [
+        limit
+        for limit in (throttle.get_limit(request) for throttle in throttles)
+        if limit is not None
+    ]
+    if not limits:
+        return True
+    wait = limiter.hit_all(limits)
+    if wait:
+        _wait.set(wait)
+        return False
+    return True
+
+
+class IPThrottle(SlidingWindowThrottle):
+    """Counts requests per client address (see NINJA_NUM_PROXIES)."""
+
+    def get_ident_key(self, request):
+        return self.get_ident(request)
+
+
+class UsernameThrottle(SlidingWindowThrottle):
+    """Counts requests per `username` in the JSON body, from any address."""
+
+    def get_ident_key(self, request):
+        try:
+            username = json.loads(request.body).get("username")
+        except (ValueError, AttributeError):
+            return None
+        if not isinstance(username, str) or not username:
+            return None
+        return username.strip().lower()
+
+
+class RouteThrottle(SlidingWindowThrottle):
+    """Caps the total rate of an operation across all clients."""
+
+    def get_ident_key(self, request):
+        return "all"
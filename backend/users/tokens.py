@@ -0,0 +1,316 @@
+"""
+Access token claims and the per-user authorization epoch.
+
+Access tokens carry the caller's role and an "authz epoch" so role-gated
+endpoints can authorize from the verified token alone. The epoch is bumped
+whenever `Profile.role` changes; tokens minted under an older epoch are
+rejected, which stops a demoted manager from keeping access until expiry.
+
+The epoch lives in Redis when REDIS_URL is configured and in process memory
+otherwise. Only tokens with an epoch *older* than the current one are
+rejected, so a restarted process or an unreachable Redis fails open to the
+token's own expiry rather than locking every user out.
+
+Refresh tokens are tracked by `jti` in `RefreshTokenStore`. Each login starts a
+token family (the `sid` claim, shared by every access and refresh token of the
+session). `/refresh` consumes the presented token and registers its
+successor. Presenting an already-consumed token revokes the whole family,
+because either the client or an attacker holds a copy. Unlike epochs, refresh
+checks fail closed: with Redis unreachable, `/refresh` rejects the token.
+The in-process registry used without REDIS_URL is per process, so it only
+serves the test suite; the WSGI and ASGI entry points refuse to start without
+Redis (app.redis.require_redis).
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+import jwt
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from app.metrics import record_auth
+from app.redis import get_redis
+from app.tracing import traced
+
+from .cache import principal_cache
+from .models import UserRole
+
+logger = logging.getLogger(__name__)
+
+
+class AuthzEpochStore:
+    """Monotonic per-user counters bumped on authorization changes."""
+
+    key_prefix = "users:authz_epoch:"
+
+    def __init__(self):
+        self._local = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> int:
+        client = get_redis()
+        if client is not None:
+            try:
+                value = client.get(self._key(user_id))
+                return int(value) if value is not None else 0
+            except redis.RedisError:
+                logger.warning("Authz epoch lookup failed for user %s", user_id)
+        return self._local.get(user_id, 0)
+
+    async def aget(self, user_id: int) -> int:
+        if get_redis() is None:
+            return self._local.get(user_id, 0)
+        return await sync_to_async(self.get, thread_sensitive=False)(user_id)
+
+    def bump(self, user_id: int) -> int:
+        with self._lock:
+            epoch = self._local[user_id] = self._local.get(user_id, 0) + 1
+        client = get_redis()
+        if client is not None:
+            try:
+                epoch = client.incr(self._key(user_id))
+            except redis.RedisError:
+                logger.warning("Authz epoch bump failed for user %s", user_id)
+        return epoch
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+    def _key(self, user_id):
+        return f"{self.key_prefix}{user_id}"
+
+
+authz_epochs = AuthzEpochStore()
+
+
+REFRESH_TOKEN_TTL = 7 * 24 * 60 * 60
+
+# Consume a refresh token and register its successor in one round trip.
+# KEYS: presented token, family revocation marker, successor token
+# ARGV: marker TTL, successor value, successor TTL
+ROTATE_SCRIPT = """
+if redis.call("EXISTS", KEYS[2]) == 1 then
+    return 0
+end
+if redis.call("DEL", KEYS[1]) == 0 then
+    redis.call("SET", KEYS[2], "1", "EX", ARGV[1])
+    return -1
+end
+redis.call("SET", KEYS[3], ARGV[2], "EX", ARGV[3])
+return 1
+"""
+
+
+class RefreshTokenStore:
+    """Registry of unused refresh tokens, keyed by `jti` and grouped in families."""
+
+    token_prefix = "users:refresh:"
+    family_prefix = "users:refresh_family:"
+
+    ROTATED = 1
+    REVOKED = 0
+    REUSED = -1
+
+    def __init__(self):
+        self._tokens = {}
+        self._revoked = {}
+        self._lock = threading.Lock()
+        self._rotate = None
+
+    def issue(self, user_id: int, family: str, jti: str):
+        client = get_redis()
+        if client is None:
+            with self._lock:
+                self._tokens[jti] = (family, time.monotonic() + REFRESH_TOKEN_TTL)
+            return
+        try:
+            client.set(self._token_key(jti), family, ex=REFRESH_TOKEN_TTL)
+        except redis.RedisError:
+            logger.warning("Refresh token registration failed for user %s", user_id)
+
+    async def aissue(self, user_id: int, family: str, jti: str):
+        if get_redis() is None:
+            return self.issue(user_id, family, jti)
+        return await sync_to_async(self.issue, thread_sensitive=False)(
+            user_id, family, jti
+        )
+
+    def rotate(self, family: str, jti: str, new_jti: str):
+        """Consume `jti` and register `new_jti`; returns ROTATED, REVOKED or REUSED.
+
+        Returns None when the registry cannot be reached.
+        """
+        client = get_redis()
+        if client is None:
+            return self._rotate_local(family, jti, new_jti)
+        if self._rotate is None:
+            self._rotate = client.register_script(ROTATE_SCRIPT)
+        try:
+            result = self._rotate(
+                keys=[
+                    self._token_key(jti),
+                    self._family_key(family),
+                    self._token_key(new_jti),
+                ],
+                args=[REFRESH_TOKEN_TTL, family, REFRESH_TOKEN_TTL],
+                client=client,
+            )
+        except redis.RedisError:
+            logger.warning("Refresh token rotation failed for family %s", family)
+            return None
+        return int(result)
+
+    async def arotate(self, family: str, jti: str, new_jti: str):
+        if get_redis() is None:
+            return self._rotate_local(family, jti, new_jti)
+        return await sync_to_async(self.rotate, thread_sensitive=False)(
+            family, jti, new_jti
+        )
+
+    def revoke_family(self, family: str):
+        client = get_redis()
+        if client is None:
+            with self._lock:
+                self._revoked[family] = time.monotonic() + REFRESH_TOKEN_TTL
+            return
+        try:
+            client.set(self._family_key(family), "1", ex=REFRESH_TOKEN_TTL)
+        except redis.RedisError:
+            logger.warning("Refresh token revocation failed for family %s", family)
+
+    async def arevoke_family(self, family: str):
+        if get_redis() is None:
+            return self.revoke_family(family)
+        return await sync_to_async(self.revoke_family, thread_sensitive=False)(family)
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._revoked.clear()
+
+    def _rotate_local(self, family, jti, new_jti):
+        now = time.monotonic()
+        with self._lock:
+            if self._revoked.get(family, 0) > now:
+                return self.REVOKED
+            entry = self._tokens.pop(jti, None)
+            if entry is None or entry[1] < now:
+                self._revoked[family] = now + REFRESH_TOKEN_TTL
+                return self.REUSED
+            self._tokens[new_jti] = (family, now + REFRESH_TOKEN_TTL)
+            return self.ROTATED
+
+    def _token_key(self, jti):
+        return f"{self.token_prefix}{jti}"
+
+    def _family_key(self, family):
+        return f"{self.family_prefix}{family}"
+
+
+refresh_tokens = RefreshTokenStore()
+
+
+@dataclass(frozen=True)
+class TokenClaims:
+    """The verified claims of an access token."""
+
+    id: int
+    username: str
+    role: str
+    epoch: int
+    session: str = ""
+
+    @property
+    def is_manager(self):
+        return self.role == UserRole.MANAGER
+
+
+@traced("jwt.decode")
+def _verified_payload(token: str):
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+    except jwt.ExpiredSignatureError:
+        record_auth("expired")
+        return None
+    except jwt.DecodeError:
+        record_auth("invalid")
+        return None
+    if not payload.get("user_id") or payload.get("type") == "refresh":
+        record_auth("invalid")
+        return None
+    return payload
+
+
+def _claims(payload, role):
+    return TokenClaims(
+        id=payload["user_id"],
+        username=payload.get("username", ""),
+        role=role,
+        epoch=payload.get("epoch", 0),
+        session=payload.get("sid", ""),
+    )
+
+
+def decode_access_token(token: str):
+    """Verify an access token and return its claims, or None if it is not acceptable."""
+    payload = _verified_payload(token)
+    if payload is None:
+        return None
+
+    user_id = payload["user_id"]
+    if payload.get("epoch", 0) < authz_epochs.get(user_id):
+        record_auth("stale")
+        return None
+
+    role = payload.get("role")
+    if role is None:
+        # Tokens minted before role claims existed: fall back to the cache.
+        principal = principal_cache.get(user_id)
+        if principal is None:
+            record_auth("invalid")
+            return None
+        role = principal.role
+
+    return _claims(payload, role)
+
+
+async def adecode_access_token(token: str):
+    """Async variant of `decode_access_token`."""
+    payload = _verified_payload(token)
+    if payload is None:
+        return None
+
+    user_id = payload["user_id"]
+    if payload.get("epoch", 0) < await authz_epochs.aget(user_id):
+        record_auth("stale")
+        return None
+
+    role = payload.get("role")
+    if role is None:
+        principal = await principal_cache.aget(user_id)
+        if principal is None:
+            record_auth("invalid")
+            return None
+        role = principal.role
+
+    return _claims(payload, role)
+
+
+def authorize(claims, manager: bool | None = None):
+    """Return `claims` if they hold the required role, recording the outcome.
+
+    `manager` is None for any role, True for managers only and False for
+    default users only.
+    """
+    if claims is None:
+        return None
+    if manager is not None and claims.is_manager != manager:
+        record_auth("role_denied")
+        return None
+    record_auth("success")
+    return claims